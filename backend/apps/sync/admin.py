@@ -1,5 +1,60 @@
 from django.contrib import admin
 
+from apps.sync.models import Gate, GateCursor, StagedGateEvents
+from apps.sync.services.gate_cursor import SeqRanges
 
-# Sync-related admin (if needed) will be configured here
 
+@admin.register(Gate)
+class GateAdmin(admin.ModelAdmin):
+    list_display = ("name", "is_active", "created_at")
+    list_filter = ("is_active",)
+    search_fields = ("name",)
+    # Keys are issued and rotated with `manage.py gate_keys`; only their hash is stored.
+    readonly_fields = ("key_hash", "created_at")
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(GateCursor)
+class GateCursorAdmin(admin.ModelAdmin):
+    list_display = (
+        "gate",
+        "epoch",
+        "high_water_seq",
+        "last_durable_seq",
+        "head_seq",
+        "lag_events",
+        "gap_count",
+        "advanced_at",
+        "head_reported_at",
+    )
+    list_select_related = ("gate",)
+    readonly_fields = tuple(f.name for f in GateCursor._meta.fields)
+
+    def last_durable_seq(self, obj):
+        return SeqRanges.of(obj).last_contiguous
+
+    def lag_events(self, obj):
+        return max(0, obj.head_seq - obj.high_water_seq) if obj.head_seq is not None else None
+
+    def gap_count(self, obj):
+        return len(obj.gaps or ())
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(StagedGateEvents)
+class StagedGateEventsAdmin(admin.ModelAdmin):
+    list_display = ("id", "roll", "event_count", "received_at", "attempts", "available_at", "last_error")
+    list_filter = ("attempts",)
+    search_fields = ("roll",)
+    # Queued by staged sync requests and applied by `manage.py apply_staged_events`.
+    readonly_fields = tuple(f.name for f in StagedGateEvents._meta.fields)
+
+    def event_count(self, obj):
+        return len(obj.events)
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,84 @@
+"""
+Apply gate events queued in staged ingest mode (SYNC_INGEST_MODE = "staged").
+
+Runs SYNC_STAGED_WORKERS worker processes; each claims staged rows with
+SELECT ... FOR UPDATE SKIP LOCKED and applies them like a direct sync request
+would (see apps.sync.services.staged_ingest). Keep it running next to the web
+server, under a process supervisor, whenever staged mode is on.
+
+Usage:
+    python manage.py apply_staged_events
+    python manage.py apply_staged_events --workers 4
+    python manage.py apply_staged_events --once       # apply what is due, then exit
+"""
+
+import multiprocessing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+
+from apps.sync.services.staged_ingest import StagedEventsWorker, is_staged_mode, queue_stats
+
+
+class Command(BaseCommand):
+    help = "Apply staged gate sync events with a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None, help="Worker processes (default SYNC_STAGED_WORKERS).")
+        parser.add_argument(
+            "--claim-rows", type=int, default=None, help="Rows claimed per transaction (default SYNC_STAGED_CLAIM_ROWS)."
+        )
+        parser.add_argument("--once", action="store_true", help="Exit once no staged row is due.")
+
+    def handle(self, *args, **options):
+        workers = options.get("workers") or getattr(settings, "SYNC_STAGED_WORKERS", 2)
+        if workers < 1:
+            raise CommandError("--workers must be at least 1")
+        if workers > 1 and connection.vendor == "sqlite":
+            self.stderr.write("apply_staged_events: sqlite has no SKIP LOCKED; running 1 worker")
+            workers = 1
+        if not is_staged_mode():
+            self.stderr.write(
+                "apply_staged_events: SYNC_INGEST_MODE is not 'staged'; applying what is queued from before"
+            )
+
+        stats = queue_stats()
+        age = f", oldest staged {(timezone.now() - stats['oldest']).total_seconds():.0f}s ago" if stats["oldest"] else ""
+        self.stdout.write(f"apply_staged_events: {stats['rows']} rows queued{age}; {workers} workers")
+
+        if workers == 1:
+            applied = self._work(0, options)
+            if options.get("once"):
+                self.stdout.write(self.style.SUCCESS(f"apply_staged_events: applied {applied} events"))
+            return
+
+        # Children must not share the parent's database connection.
+        connections.close_all()
+        ctx = multiprocessing.get_context("fork")
+        procs = [ctx.Process(target=self._work, args=(i, options), daemon=True) for i in range(workers)]
+        for proc in procs:
+            proc.start()
+        try:
+            for proc in procs:
+                proc.join()
+        except KeyboardInterrupt:
+            # The children got the interrupt too; a transaction cut short rolls back and its rows stay queued.
+            for proc in procs:
+                proc.join(timeout=10)
+        failed = [proc for proc in procs if proc.exitcode]
+        if failed:
+            raise CommandError(f"{len(failed)} of {workers} workers failed")
+        if options.get("once"):
+            self.stdout.write(self.style.SUCCESS("apply_staged_events: nothing due"))
+
+    def _work(self, index: int, options) -> int:
+        worker = StagedEventsWorker(
+            claim_rows=options.get("claim_rows"),
+            log=lambda message: self.stdout.write(f"apply_staged_events w{index}: {message}"),
+        )
+        try:
+            return worker.run(getattr(settings, "SYNC_STAGED_POLL_MS", 500) / 1000, until_empty=options.get("once"))
+        except KeyboardInterrupt:
+            return 0
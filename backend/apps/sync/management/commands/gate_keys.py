@@ -0,0 +1,80 @@
+"""
+Per-gate API keys and sync lag.
+
+Each gate authenticates with its own key (X-GATE-API-KEY). A new key is
+printed once; only its SHA-256 is stored. `list` shows every gate's cursor:
+the highest durable seq, the newest seq the gate reported and the lag between
+them.
+
+Usage:
+    python manage.py gate_keys add gate-2          # prints the new key
+    python manage.py gate_keys rotate gate-2       # new key; the old one stops working
+    python manage.py gate_keys revoke gate-2
+    python manage.py gate_keys list
+"""
+
+import secrets
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.text import slugify
+
+from apps.sync.models import Gate, GateCursor
+from apps.sync.services.gate_cursor import describe, hash_key
+
+
+class Command(BaseCommand):
+    help = "Issue, rotate or revoke per-gate sync API keys, and list each gate's sync lag."
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["add", "rotate", "revoke", "list"])
+        parser.add_argument("name", nargs="?", help="Gate name (a slug, e.g. gate-2).")
+
+    def handle(self, *args, **options):
+        action, name = options["action"], options.get("name")
+        if action == "list":
+            return self._list()
+        if not name:
+            raise CommandError(f"gate_keys {action} needs a gate name")
+        if slugify(name) != name:
+            raise CommandError(f"Invalid gate name '{name}' (use lowercase letters, digits and dashes)")
+
+        if action == "add":
+            if Gate.objects.filter(name=name).exists():
+                raise CommandError(f"Gate '{name}' exists already; use rotate for a new key")
+            key = secrets.token_urlsafe(32)
+            Gate.objects.create(name=name, key_hash=hash_key(key))
+            self._print_key(name, key)
+            return
+
+        gate = Gate.objects.filter(name=name).first()
+        if gate is None:
+            raise CommandError(f"Unknown gate '{name}'")
+        if action == "rotate":
+            key = secrets.token_urlsafe(32)
+            gate.key_hash, gate.is_active = hash_key(key), True
+            gate.save(update_fields=["key_hash", "is_active"])
+            self._print_key(name, key)
+        else:
+            gate.is_active = False
+            gate.save(update_fields=["is_active"])
+            self.stdout.write(self.style.SUCCESS(f"gate_keys: {name} revoked"))
+
+    def _print_key(self, name: str, key: str) -> None:
+        self.stdout.write(self.style.SUCCESS(f"gate_keys: key for {name} (shown once; set GATE_API_KEY on the gate):"))
+        self.stdout.write(key)
+
+    def _list(self) -> None:
+        cursors = {c.gate_id: c for c in GateCursor.objects.select_related("gate")}
+        for gate in Gate.objects.order_by("name"):
+            state = "" if gate.is_active else " (revoked)"
+            cursor = cursors.get(gate.pk)
+            if cursor is None or cursor.epoch is None:
+                self.stdout.write(f"{gate.name}{state}: no events yet")
+                continue
+            info = describe(cursor)
+            lag = "unknown" if info["lagEvents"] is None else f"{info['lagEvents']} events"
+            self.stdout.write(
+                f"{gate.name}{state}: durable up to {info['lastDurableSeq']} (high water {info['highWaterSeq']}, "
+                f"{len(info['gaps'])} gaps / {info['missingSeqs']} seqs missing), head {info['headSeq']}, "
+                f"lag {lag}; advanced {info['advancedAt'] or '-'}, reported {info['headReportedAt'] or '-'}"
+            )
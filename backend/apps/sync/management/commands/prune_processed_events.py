@@ -0,0 +1,60 @@
+"""
+Retention for the gate-event idempotency store (processed_gate_events).
+
+Forgets event ids received more than SYNC_PROCESSED_RETENTION_DAYS ago and,
+on Postgres, creates the next SYNC_PROCESSED_PARTITIONS_AHEAD partitions.
+Expired partitions are dropped whole; other databases delete expired rows in
+batches. Run daily via cron/scheduler.
+
+Usage:
+    python manage.py prune_processed_events
+    python manage.py prune_processed_events --dry-run
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.sync.services.processed_events import (
+    ensure_partitions,
+    is_partitioned,
+    partitions,
+    purge_expired,
+    replay_horizon,
+)
+
+
+class Command(BaseCommand):
+    help = "Drop processed gate event ids past the retention horizon and create upcoming partitions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be dropped or deleted.")
+
+    def handle(self, *args, **options):
+        dry_run = options.get("dry_run")
+        horizon = replay_horizon()
+        suffix = " (DRY RUN)" if dry_run else ""
+
+        if is_partitioned() and not dry_run:
+            for name in ensure_partitions():
+                self.stdout.write(f"prune_processed_events: created partition {name}")
+
+        result = purge_expired(dry_run=dry_run)
+        if is_partitioned():
+            self.stdout.write(
+                f"prune_processed_events: {len(result['partitions'])} partitions before {horizon.isoformat()} "
+                f"dropped (~{result['rows']} ids){suffix}"
+            )
+            for name in result["partitions"]:
+                self.stdout.write(f"  {name}")
+            with connection.cursor() as cursor:
+                for name, start, end in partitions():
+                    cursor.execute("SELECT pg_total_relation_size(to_regclass(%s))", [name])
+                    size = cursor.fetchone()[0]
+                    self.stdout.write(
+                        f"  {name}: {start.isoformat() if start else 'MINVALUE'} .. "
+                        f"{end.isoformat() if end else 'MAXVALUE'} {size / 1024:.0f}kB"
+                    )
+        else:
+            self.stdout.write(
+                f"prune_processed_events: {result['rows']} ids received before {horizon.isoformat()} deleted{suffix}"
+            )
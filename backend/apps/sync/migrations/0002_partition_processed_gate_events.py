@@ -0,0 +1,75 @@
+# Partition processed_gate_events by RANGE (received_at) so expired ids are
+# dropped a partition at a time (apps.sync.services.processed_events).
+# Postgres only; other databases keep the plain table. The existing table is
+# attached as the first partition (MINVALUE up to the next partition boundary)
+# without copying a row, and is dropped as a whole once it is past retention.
+# The primary key becomes (event_id, received_at): a partitioned table's keys
+# must contain the partition key. The model state is unchanged.
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import migrations
+
+
+PARTITION_SQL = [
+    "ALTER TABLE processed_gate_events RENAME TO processed_gate_events_legacy",
+    "ALTER TABLE processed_gate_events_legacy RENAME CONSTRAINT processed_gate_events_pkey "
+    "TO processed_gate_events_legacy_pkey",
+    "ALTER INDEX pge_received_at_idx RENAME TO pge_received_at_legacy_idx",
+    """
+    CREATE TABLE processed_gate_events (
+        event_id uuid NOT NULL,
+        event_type varchar(32) NOT NULL,
+        received_at timestamp with time zone NOT NULL,
+        CONSTRAINT processed_gate_events_pkey PRIMARY KEY (event_id, received_at)
+    ) PARTITION BY RANGE (received_at)
+    """,
+    "CREATE INDEX pge_received_at_idx ON processed_gate_events (received_at)",
+]
+
+ATTACH_SQL = (
+    "ALTER TABLE processed_gate_events ATTACH PARTITION processed_gate_events_legacy "
+    "FOR VALUES FROM (MINVALUE) TO ('{upper}')"
+)
+
+UNPARTITION_SQL = [
+    "CREATE TABLE processed_gate_events_flat (LIKE processed_gate_events INCLUDING DEFAULTS)",
+    "INSERT INTO processed_gate_events_flat SELECT DISTINCT ON (event_id) * FROM processed_gate_events "
+    "ORDER BY event_id, received_at",
+    "DROP TABLE processed_gate_events",
+    "ALTER TABLE processed_gate_events_flat RENAME TO processed_gate_events",
+    "ALTER TABLE processed_gate_events ADD CONSTRAINT processed_gate_events_pkey PRIMARY KEY (event_id)",
+    "CREATE INDEX pge_received_at_idx ON processed_gate_events (received_at)",
+]
+
+
+def partition(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    # Same boundaries as processed_events.ensure_partitions: multiples of the width since the epoch.
+    epoch = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+    width = timedelta(days=max(1, getattr(settings, "SYNC_PROCESSED_PARTITION_DAYS", 1)))
+    upper = epoch + width * ((datetime.now(dt_timezone.utc) - epoch) // width + 1)
+    for sql in PARTITION_SQL:
+        schema_editor.execute(sql)
+    # DDL takes no bind parameters; the bound is a timestamp computed here.
+    schema_editor.execute(ATTACH_SQL.format(upper=upper.isoformat()))
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for sql in UNPARTITION_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sync", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
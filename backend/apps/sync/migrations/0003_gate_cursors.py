@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sync", "0002_partition_processed_gate_events"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Gate",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.SlugField(max_length=64, unique=True)),
+                ("key_hash", models.CharField(max_length=64, unique=True)),
+                ("is_active", models.BooleanField(default=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "db_table": "sync_gates",
+            },
+        ),
+        migrations.CreateModel(
+            name="GateCursor",
+            fields=[
+                ("gate", models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name="cursor", serialize=False, to="sync.gate")),
+                ("epoch", models.UUIDField(blank=True, null=True)),
+                ("high_water_seq", models.BigIntegerField(default=0)),
+                ("floor_seq", models.BigIntegerField(default=1)),
+                ("gaps", models.JSONField(blank=True, default=list)),
+                ("advanced_at", models.DateTimeField(blank=True, null=True)),
+                ("head_seq", models.BigIntegerField(blank=True, null=True)),
+                ("head_reported_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "db_table": "sync_gate_cursors",
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sync", "0003_gate_cursors"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StagedGateEvents",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("roll", models.CharField(max_length=50)),
+                ("events", models.JSONField()),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("available_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("last_error", models.TextField(blank=True, default="")),
+            ],
+            options={
+                "db_table": "sync_staged_events",
+                "indexes": [models.Index(fields=["roll", "id"], name="sse_roll_id_idx")],
+            },
+        ),
+    ]
@@ -1,10 +1,15 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 
 
 class ProcessedGateEvent(models.Model):
     """
     Idempotency table: a gate eventId is processed at most once.
+
+    Ids are kept for SYNC_PROCESSED_RETENTION_DAYS. On Postgres the table is
+    partitioned by received_at (migration 0002), with primary key
+    (event_id, received_at); use services.processed_events to claim ids.
     """
 
     event_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -17,3 +22,71 @@ class ProcessedGateEvent(models.Model):
             models.Index(fields=["received_at"], name="pge_received_at_idx"),
         ]
 
+
+class Gate(models.Model):
+    """
+    A gate allowed to sync, authenticated by its own API key (X-GATE-API-KEY).
+
+    Only the key's SHA-256 is stored; keys are issued with `manage.py gate_keys add`.
+    """
+
+    name = models.SlugField(max_length=64, unique=True)
+    key_hash = models.CharField(max_length=64, unique=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "sync_gates"
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class GateCursor(models.Model):
+    """
+    Which outbox seqs of a gate are durable here (see services.gate_cursor).
+
+    Within `epoch`, every seq from floor_seq to high_water_seq is durable
+    except the inclusive [start, end] ranges in `gaps`.
+    """
+
+    gate = models.OneToOneField(Gate, on_delete=models.CASCADE, primary_key=True, related_name="cursor")
+    epoch = models.UUIDField(null=True, blank=True)
+    high_water_seq = models.BigIntegerField(default=0)
+    floor_seq = models.BigIntegerField(default=1)
+    gaps = models.JSONField(default=list, blank=True)
+    advanced_at = models.DateTimeField(null=True, blank=True)
+    head_seq = models.BigIntegerField(null=True, blank=True)  # the gate's newest seq, as last reported
+    head_reported_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "sync_gate_cursors"
+
+    def __str__(self) -> str:
+        return f"GateCursor(gate={self.gate_id}, epoch={self.epoch}, high_water_seq={self.high_water_seq})"
+
+
+class StagedGateEvents(models.Model):
+    """
+    Events of one roll acked in staged mode (SYNC_INGEST_MODE = "staged") but not applied yet.
+
+    A staged request writes one row per roll in its batch with one INSERT;
+    `manage.py apply_staged_events` applies the rows and deletes them, each
+    roll's rows in id order (see services.staged_ingest).
+    """
+
+    roll = models.CharField(max_length=50)
+    events = models.JSONField()  # the events as the gate sent them
+    received_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)  # failed applies
+    available_at = models.DateTimeField(default=timezone.now)  # not retried before then
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        db_table = "sync_staged_events"
+        indexes = [
+            models.Index(fields=["roll", "id"], name="sse_roll_id_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"StagedGateEvents(roll={self.roll}, events={len(self.events)}, attempts={self.attempts})"
@@ -0,0 +1,73 @@
+"""
+Backpressure for the gate sync endpoint.
+
+Each backend process counts the sync batches it is ingesting right now and
+keeps a moving average of ingest time per event. gate_events uses them to:
+
+  - refuse a batch with 503 + Retry-After when SYNC_MAX_CONCURRENT_BATCHES are
+    already being ingested (the gate defers it without counting a failed attempt)
+  - suggest a smaller batch (X-Sync-Batch-Size header and "suggestedBatchSize")
+    when a full one would take longer than SYNC_TARGET_BATCH_MS; the gate caps
+    its adaptive batch size at the suggestion until one comes without it
+
+Counters are per process, which is what a threaded server (runserver) shares.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class IngestLoad:
+    ALPHA = 0.2  # weight of the latest batch in the per-event average
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.per_event_s = None
+
+    def try_enter(self, max_inflight: int) -> bool:
+        """Reserve a slot for one batch; False if `max_inflight` batches are already in progress (0 = no limit)."""
+        with self._lock:
+            if max_inflight and self.inflight >= max_inflight:
+                return False
+            self.inflight += 1
+            return True
+
+    def leave(self, events: int, elapsed_s: float) -> None:
+        with self._lock:
+            self.inflight -= 1
+        self.record(events, elapsed_s)
+
+    def record(self, events: int, elapsed_s: float) -> None:
+        """Fold the ingest time of `events` into the per-event average (a stream records each micro-batch)."""
+        if not events:
+            return
+        sample = elapsed_s / events
+        with self._lock:
+            if self.per_event_s is None:
+                self.per_event_s = sample
+            else:
+                self.per_event_s += self.ALPHA * (sample - self.per_event_s)
+
+    @contextmanager
+    def batch(self, events: int):
+        """Time one admitted batch (after a successful try_enter)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.leave(events, time.perf_counter() - started)
+
+    def suggested_batch_size(self, target_s: float, max_events: int) -> int | None:
+        """Events that ingest within `target_s` at the current rate, or None if a full batch does."""
+        with self._lock:
+            per_event_s, inflight = self.per_event_s, self.inflight
+        if not per_event_s:
+            return None
+        # Batches in progress share the DB with the next one.
+        fit = int(target_s / per_event_s) // (inflight + 1)
+        return max(1, fit) if fit < max_events else None
+
+
+ingest_load = IngestLoad()
@@ -0,0 +1,550 @@
+"""
+Ingest of gate sync batches (POST /api/sync/gate/events).
+
+`ingest_events` handles a whole batch with a fixed number of queries:
+
+  0. events whose id is known to be processed (processed_events.recent_event_ids:
+     an in-process LRU, an optional shared cache, one SELECT for the rest) are
+     acked right away; a batch resent after a timeout ends here, without a
+     transaction. For a gate with its own key, a durable `seq` in its cursor
+     (gate_cursor) replaces the SELECT
+  1. every other event is validated in Python first (same checks and error messages
+     as the per-event path)
+  2. the valid events are claimed in the idempotency store (processed_events:
+     one `INSERT ... ON CONFLICT DO NOTHING RETURNING event_id`, or on the
+     partitioned Postgres table a lookup plus an insert); events that come
+     back are new, the others were processed before and are only acked
+  3. users are upserted in one statement (User.ensure)
+  4. existing EntryLog / ExitLog rows are fetched with one `IN` query each, the
+     events are applied to them in memory in batch order (latest scanned_at
+     wins, as before), and the changed rows are written with one bulk upsert
+     per table
+
+After the batch commits, the seqs of the acked events advance the gate's
+cursor.
+
+`stage_events` (SYNC_INGEST_MODE = "staged") stops after step 1: it queues the
+valid events with one INSERT and acks them; worker processes run steps 2-4
+later (staged_ingest).
+
+The result is the same acked/rejected split the per-event loop produced. If
+the set-based transaction fails on a constraint (or the DB has no
+`ON CONFLICT ... RETURNING`), the batch is processed again by
+`ingest_events_one_by_one`, which gives every event its own savepoint so one
+bad row only rejects its own event.
+"""
+
+import uuid
+
+from django.db import DataError, IntegrityError, connection, transaction
+from django.db.utils import OperationalError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from shared.apps.entries.models import EntryLog
+from shared.apps.entries.models import ExitLog
+from shared.apps.users.models import User
+
+from ..models import StagedGateEvents
+from .gate_cursor import event_seqs, parse_seq
+from .processed_events import claim_events, ensure_partitions, recent_event_ids
+
+
+ENTRY_STATUSES = {choice for choice, _ in EntryLog.STATUS_CHOICES}
+
+
+def _parse_dt(val):
+    if not val:
+        return None
+    if hasattr(val, "tzinfo"):
+        # Already a datetime
+        dt = val
+    else:
+        dt = parse_datetime(str(val))
+    if not dt:
+        return None
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt, timezone=timezone.utc)
+    return dt
+
+
+def _parse_uuid(val):
+    if not val:
+        return None
+    if isinstance(val, uuid.UUID):
+        return val
+    return uuid.UUID(str(val))
+
+
+def _should_apply_ts(existing_ts, incoming_ts):
+    """
+    Returns True if we should apply incoming data to the record.
+    Latest scanned_at wins; if incoming is missing, we don't overwrite.
+    """
+    if incoming_ts is None:
+        return False
+    if existing_ts is None:
+        return True
+    return incoming_ts >= existing_ts
+
+
+def _snapshot_fields(existing, op: dict) -> dict | None:
+    """
+    The EntryLog fields an ENTRY snapshot writes over `existing` (None: it's an older replay).
+
+    A row no snapshot has reached yet has no entry_flag: a placeholder made from
+    an ENTRY_STATUS or EXIT that arrived first, or a row made by generate_token.
+    The snapshot always fills it in, but a status change with a newer ts than the
+    snapshot's scannedAt keeps its status (and, for EXPIRED, its scanned_at).
+    """
+    if existing is None:
+        return op["fields"]
+    if existing.entry_flag is not None:
+        return op["fields"] if _should_apply_ts(existing.scanned_at, op["scanned_at"]) else None
+    fields = dict(op["fields"])
+    if existing.scanned_at is not None and existing.scanned_at >= op["scanned_at"]:
+        fields["status"] = existing.status
+        if existing.status == "EXPIRED":
+            fields["scanned_at"] = existing.scanned_at
+    return fields
+
+
+# ----------------------------------------------------------------------
+# Validation
+# ----------------------------------------------------------------------
+class _HeaderError(Exception):
+    def __init__(self, event_id, error):
+        super().__init__(error)
+        self.rejection = {"eventId": event_id, "error": error}
+
+
+def _check_header(ev):
+    """Returns (raw eventId, parsed eventId) or raises _HeaderError with the rejection."""
+    if not isinstance(ev, dict):
+        raise _HeaderError(None, "Event must be an object")
+    raw_event_id = ev.get("eventId")
+    if not raw_event_id:
+        raise _HeaderError(None, "Missing eventId")
+    try:
+        return raw_event_id, _parse_uuid(raw_event_id)
+    except Exception:
+        raise _HeaderError(str(raw_event_id), "Invalid eventId (must be UUID)")
+
+
+def parse_event(ev) -> dict:
+    """
+    Validate one event body and return its normalized operation.
+
+    Raises ValueError / TypeError for events the gate should not retry.
+    """
+    event_type = ev.get("type")
+
+    if event_type in ("ENTRY", "ENTRY_EXPIRED_SEEN"):
+        entry_id = _parse_uuid(ev.get("entryId"))
+        roll = ev.get("roll")
+        scanned_at = _parse_dt(ev.get("scannedAt")) or timezone.now()
+        created_at = _parse_dt(ev.get("createdAt"))
+        status_val = ev.get("status") or ("EXPIRED" if event_type == "ENTRY_EXPIRED_SEEN" else "ENTERED")
+        extra = ev.get("extra") or []
+        device_meta = ev.get("deviceMeta") or ev.get("deviceMetadata") or {}
+
+        if not entry_id or not roll:
+            raise ValueError("ENTRY requires entryId and roll")
+
+        if not isinstance(extra, list):
+            raise ValueError("ENTRY extra must be a list")
+        if not isinstance(device_meta, dict):
+            raise ValueError("ENTRY deviceMeta must be an object")
+
+        return {
+            "kind": "ENTRY",
+            "entry_id": entry_id,
+            "roll": roll,
+            "scanned_at": scanned_at,
+            "created_at": created_at,
+            "fields": {
+                "roll_id": roll,
+                "scanned_at": scanned_at,
+                "status": status_val,
+                "entry_flag": ev.get("entryFlag") or "NORMAL_ENTRY",
+                "laptop": ev.get("laptop"),
+                "extra": extra,
+                "source": ev.get("source") or None,
+                "os": ev.get("os") or None,
+                "device_id": ev.get("deviceId") or None,
+                "device_meta": device_meta,
+            },
+        }
+
+    if event_type == "ENTRY_STATUS":
+        # Compact status transition for an entry already sent as a full ENTRY snapshot.
+        entry_id = _parse_uuid(ev.get("entryId"))
+        roll = ev.get("roll")
+        status_val = ev.get("status")
+        ts = _parse_dt(ev.get("ts"))
+
+        if not entry_id or not roll or not ts:
+            raise ValueError("ENTRY_STATUS requires entryId, roll and ts")
+        if status_val not in ENTRY_STATUSES:
+            raise ValueError(f"ENTRY_STATUS has invalid status: {status_val}")
+
+        return {"kind": "ENTRY_STATUS", "entry_id": entry_id, "roll": roll, "status": status_val, "ts": ts}
+
+    if event_type == "EXIT":
+        exit_id = _parse_uuid(ev.get("exitId"))
+        raw_entry_id = ev.get("entryId")
+        roll = ev.get("roll")
+        scanned_at = _parse_dt(ev.get("scannedAt")) or timezone.now()
+        created_at = _parse_dt(ev.get("createdAt"))
+        extra = ev.get("extra") or []
+        device_meta = ev.get("deviceMeta") or ev.get("deviceMetadata") or {}
+
+        if not exit_id or not roll:
+            raise ValueError("EXIT requires exitId and roll")
+
+        if not isinstance(extra, list):
+            raise ValueError("EXIT extra must be a list")
+        if not isinstance(device_meta, dict):
+            raise ValueError("EXIT deviceMeta must be an object")
+
+        entry_id = _parse_uuid(raw_entry_id) if raw_entry_id else None
+
+        return {
+            "kind": "EXIT",
+            "exit_id": exit_id,
+            "entry_id": entry_id,
+            "roll": roll,
+            "scanned_at": scanned_at,
+            "created_at": created_at,
+            "fields": {
+                "roll_id": roll,
+                "entry_id_id": entry_id,
+                "scanned_at": scanned_at,
+                "exit_flag": ev.get("exitFlag") or "NORMAL_EXIT",
+                "laptop": ev.get("laptop"),
+                "extra": extra,
+                "device_meta": device_meta,
+                "device_id": ev.get("deviceId") or None,
+                "source": ev.get("source") or None,
+                "os": ev.get("os") or None,
+            },
+        }
+
+    raise ValueError(f"Unknown event type: {event_type}")
+
+
+# ----------------------------------------------------------------------
+# Per-event path
+# ----------------------------------------------------------------------
+def _apply_one(op: dict) -> None:
+    if op["kind"] == "ENTRY":
+        entry_id = op["entry_id"]
+        User.ensure(op["roll"])
+        existing = EntryLog.objects.filter(id=entry_id).only("id", "scanned_at", "status", "entry_flag").first()
+        fields = _snapshot_fields(existing, op)
+        if fields is None:
+            # Older replay; don't overwrite newer data.
+            return
+        EntryLog.objects.update_or_create(id=entry_id, defaults=fields)
+        if op["created_at"]:
+            EntryLog.objects.filter(id=entry_id).update(created_at=op["created_at"])
+
+    elif op["kind"] == "ENTRY_STATUS":
+        entry_id = op["entry_id"]
+        existing = EntryLog.objects.filter(id=entry_id).only("id", "scanned_at", "entry_flag").first()
+        if existing is None:
+            # Snapshot not here (yet, or it was rejected): keep what we know, like EXIT does.
+            # No entry_flag: a snapshot arriving later still fills the row in (_snapshot_fields).
+            User.ensure(op["roll"])
+            EntryLog.objects.create(id=entry_id, roll_id=op["roll"], status=op["status"], scanned_at=op["ts"])
+        elif _should_apply_ts(existing.scanned_at, op["ts"]):
+            updates = {"status": op["status"]}
+            if op["status"] == "EXPIRED" or existing.entry_flag is None:
+                # The gate moves scanned_at to the expiry time; EXITED keeps the entry time.
+                # A placeholder has no entry time, and keeps the ts to compare a late snapshot with.
+                updates["scanned_at"] = op["ts"]
+            EntryLog.objects.filter(id=entry_id).update(**updates)
+
+    else:  # EXIT
+        exit_id = op["exit_id"]
+        User.ensure(op["roll"])
+        if op["entry_id"]:
+            EntryLog.objects.get_or_create(
+                id=op["entry_id"],
+                defaults={"roll_id": op["roll"], "status": "PENDING"},
+            )
+        existing = ExitLog.objects.filter(id=exit_id).only("id", "scanned_at").first()
+        if existing and not _should_apply_ts(existing.scanned_at, op["scanned_at"]):
+            return
+        ExitLog.objects.update_or_create(id=exit_id, defaults=op["fields"])
+        if op["created_at"]:
+            ExitLog.objects.filter(id=exit_id).update(created_at=op["created_at"])
+
+
+def _known_events(id_events: list, seq_cursor=None) -> set:
+    """
+    Ids among (event_id, event) pairs that were processed before. With a gate
+    cursor, events with a seq are settled by it instead of the SELECT.
+    """
+    if seq_cursor is None:
+        return recent_event_ids.known(event_id for event_id, _ in id_events)
+    known = recent_event_ids.known((event_id for event_id, _ in id_events), query=False)
+    rest = [(event_id, parse_seq(ev.get("seq"))) for event_id, ev in id_events if event_id not in known]
+    known |= seq_cursor.durable({event_id: seq for event_id, seq in rest if seq is not None})
+    return known | recent_event_ids.known(event_id for event_id, seq in rest if seq is None)
+
+
+def _settle_on_commit(seq_cursor, acked_events: list) -> None:
+    if seq_cursor is not None:
+        seqs = [seq for ev in acked_events for seq in event_seqs(ev)]
+        if seqs:
+            transaction.on_commit(lambda: seq_cursor.settle(seqs))
+
+
+def ingest_events_one_by_one(events: list, seq_cursor=None) -> tuple[list, list]:
+    """Process events one at a time, each in its own transaction. Returns (acked ids, rejections)."""
+    ensure_partitions(lazy=True)
+    acked = []
+    rejected = []
+    processed = []
+    acked_events = []
+
+    id_events = []
+    for ev in events:
+        try:
+            id_events.append((_check_header(ev)[1], ev))
+        except _HeaderError:
+            pass
+    known = _known_events(id_events, seq_cursor)
+
+    for ev in events:
+        try:
+            raw_event_id, event_id = _check_header(ev)
+        except _HeaderError as e:
+            rejected.append(e.rejection)
+            continue
+
+        if event_id in known:
+            # Processed before (e.g. a batch resent after a timeout): no savepoint needed.
+            acked.append(str(event_id))
+            acked_events.append(ev)
+            continue
+
+        try:
+            # Transaction boundary per-event:
+            # - claiming the eventId acts as our idempotency "lock"
+            # - if processing fails, we rollback the claim so a retry can succeed later
+            with transaction.atomic():
+                if not claim_events([(event_id, ev.get("type") or "")]):
+                    acked.append(str(event_id))
+                    acked_events.append(ev)
+                    continue
+
+                _apply_one(parse_event(ev))
+
+            acked.append(str(event_id))
+            acked_events.append(ev)
+            processed.append(event_id)
+        except (ValueError, TypeError, IntegrityError) as e:
+            # 1) LOGIC ERRORS (Client fault):
+            # The data is invalid or duplicate. Reject it safely.
+            rejected.append({"eventId": str(raw_event_id), "error": str(e)})
+        except OperationalError:
+            # 2) SYSTEM ERRORS (Server fault):
+            # DB is down or locked. Do NOT catch this.
+            # Let it raise 500 so the client retries later.
+            raise
+        except Exception as e:
+            # 3) UNEXPECTED ERRORS:
+            # Safer to crash and retry than to silently lose data.
+            print(f"Critical sync error on event {raw_event_id}: {e}")
+            raise
+
+    transaction.on_commit(lambda: recent_event_ids.remember(processed))
+    _settle_on_commit(seq_cursor, acked_events)
+    return acked, rejected
+
+
+# ----------------------------------------------------------------------
+# Set-based path
+# ----------------------------------------------------------------------
+def _upsert(model, rows: list) -> None:
+    if rows:
+        model.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["id"],
+            update_fields=[f.name for f in model._meta.concrete_fields if not f.primary_key],
+        )
+
+
+def _apply_batch(ops: list[dict]) -> None:
+    """Apply new events (batch order) to EntryLog / ExitLog with one read and one upsert per table."""
+    rolls, entry_ids, exit_ids = set(), set(), set()
+    for op in ops:
+        rolls.add(op["roll"])
+        if op["entry_id"]:
+            entry_ids.add(op["entry_id"])
+        if op["kind"] == "EXIT":
+            exit_ids.add(op["exit_id"])
+
+    User.ensure(*rolls)
+    entries = {e.id: e for e in EntryLog.objects.select_for_update().filter(id__in=entry_ids)} if entry_ids else {}
+    exits = {e.id: e for e in ExitLog.objects.select_for_update().filter(id__in=exit_ids)} if exit_ids else {}
+    changed_entries, changed_exits = {}, {}
+
+    for op in ops:
+        if op["kind"] == "ENTRY":
+            entry = entries.get(op["entry_id"])
+            fields = _snapshot_fields(entry, op)
+            if fields is None:
+                # Older replay; don't overwrite newer data.
+                continue
+            if entry is None:
+                entry = entries[op["entry_id"]] = EntryLog(id=op["entry_id"])
+            for name, value in fields.items():
+                setattr(entry, name, value)
+            if op["created_at"]:
+                entry.created_at = op["created_at"]
+            changed_entries[entry.id] = entry
+
+        elif op["kind"] == "ENTRY_STATUS":
+            entry = entries.get(op["entry_id"])
+            if entry is None:
+                # Snapshot not here (yet, or it was rejected): keep what we know, like EXIT does.
+                entry = entries[op["entry_id"]] = EntryLog(
+                    id=op["entry_id"], roll_id=op["roll"], status=op["status"], scanned_at=op["ts"]
+                )
+            elif _should_apply_ts(entry.scanned_at, op["ts"]):
+                entry.status = op["status"]
+                if op["status"] == "EXPIRED" or entry.entry_flag is None:
+                    # As in _apply_one: expiry time, or the placeholder's ts.
+                    entry.scanned_at = op["ts"]
+            else:
+                continue
+            changed_entries[entry.id] = entry
+
+        else:  # EXIT
+            if op["entry_id"] and op["entry_id"] not in entries:
+                placeholder = entries[op["entry_id"]] = EntryLog(
+                    id=op["entry_id"], roll_id=op["roll"], status="PENDING"
+                )
+                changed_entries[placeholder.id] = placeholder
+            exit_log = exits.get(op["exit_id"])
+            if exit_log is not None and not _should_apply_ts(exit_log.scanned_at, op["scanned_at"]):
+                continue
+            if exit_log is None:
+                exit_log = exits[op["exit_id"]] = ExitLog(id=op["exit_id"])
+            for name, value in op["fields"].items():
+                setattr(exit_log, name, value)
+            if op["created_at"]:
+                exit_log.created_at = op["created_at"]
+            changed_exits[exit_log.id] = exit_log
+
+    # Entries first: exits reference them.
+    _upsert(EntryLog, list(changed_entries.values()))
+    _upsert(ExitLog, list(changed_exits.values()))
+
+
+def _triage(events: list, seq_cursor=None) -> tuple[list, list, list, dict]:
+    """
+    Steps 0 and 1 for a batch. Returns (outcomes, ops, invalid, first_valid):
+
+      outcomes     per event: ("ack", id) / ("reject", rejection), None while undecided
+      ops          (index, event_id, op, event_type) of valid events, first occurrence of each id
+      invalid      (index, event_id, rejection)
+      first_valid  event_id -> index of its first valid occurrence
+    """
+    outcomes = [None] * len(events)
+    ops = []
+    first_valid = {}
+    invalid = []
+
+    headers = []  # (index, raw eventId, parsed eventId)
+    for i, ev in enumerate(events):
+        try:
+            headers.append((i, *_check_header(ev)))
+        except _HeaderError as e:
+            outcomes[i] = ("reject", e.rejection)
+    known = _known_events([(event_id, events[i]) for i, _, event_id in headers], seq_cursor)
+
+    for i, raw_event_id, event_id in headers:
+        ev = events[i]
+        if event_id in known:
+            # An already-processed event is acked without looking at its body, like before.
+            outcomes[i] = ("ack", str(event_id))
+            continue
+        try:
+            op = parse_event(ev)
+        except (ValueError, TypeError) as e:
+            invalid.append((i, event_id, {"eventId": str(raw_event_id), "error": str(e)}))
+            continue
+        if event_id in first_valid:
+            # Same event twice in one batch: the first one is processed, the repeat is a duplicate.
+            outcomes[i] = ("ack", str(event_id))
+            continue
+        first_valid[event_id] = i
+        ops.append((i, event_id, op, ev.get("type") or ""))
+    return outcomes, ops, invalid, first_valid
+
+
+def _finish(events: list, triaged: tuple, seq_cursor=None) -> tuple[list, list]:
+    """Ack the valid events once they are durable, settle the rest; returns (acked ids, rejections)."""
+    outcomes, ops, invalid, first_valid = triaged
+    processed_before = set()
+    if invalid and seq_cursor is not None:
+        # The cursor only vouched for durable seqs; an invalid event may still have been processed before.
+        processed_before = recent_event_ids.known(event_id for _, event_id, _ in invalid)
+    for i, event_id, _, _ in ops:
+        outcomes[i] = ("ack", str(event_id))
+    for i, event_id, rejection in invalid:
+        if event_id in processed_before or first_valid.get(event_id, len(events)) < i:
+            outcomes[i] = ("ack", str(event_id))
+        else:
+            outcomes[i] = ("reject", rejection)
+
+    acked = [value for kind, value in outcomes if kind == "ack"]
+    rejected = [value for kind, value in outcomes if kind == "reject"]
+    _settle_on_commit(seq_cursor, [events[i] for i, (kind, _) in enumerate(outcomes) if kind == "ack"])
+    return acked, rejected
+
+
+def ingest_events(events: list, seq_cursor=None) -> tuple[list, list]:
+    """
+    Process a sync batch set-based. Returns (acked ids, rejections), in event order.
+
+    `seq_cursor` is the sending gate's GateSeqCursor, if it has one.
+    """
+    if connection.vendor not in ("postgresql", "sqlite"):
+        # Needs INSERT ... ON CONFLICT DO NOTHING RETURNING.
+        return ingest_events_one_by_one(events, seq_cursor)
+    ensure_partitions(lazy=True)
+
+    triaged = _triage(events, seq_cursor)
+    ops = triaged[1]
+    if ops:
+        try:
+            with transaction.atomic():
+                new_ids = claim_events([(event_id, event_type) for _, event_id, _, event_type in ops])
+                _apply_batch([op for _, event_id, op, _ in ops if event_id in new_ids])
+        except (IntegrityError, DataError):
+            # Some row violates a constraint; let every event succeed or fail on its own.
+            return ingest_events_one_by_one(events, seq_cursor)
+        transaction.on_commit(lambda: recent_event_ids.remember(event_id for _, event_id, _, _ in ops))
+    return _finish(events, triaged, seq_cursor)
+
+
+def stage_events(events: list, seq_cursor=None) -> tuple[list, list]:
+    """
+    Staged mode (SYNC_INGEST_MODE = "staged", see staged_ingest): validate a batch like
+    ingest_events, queue its new events in sync_staged_events with one INSERT and ack them.
+    """
+    triaged = _triage(events, seq_cursor)
+    by_roll = {}
+    for i, _, op, _ in triaged[1]:
+        by_roll.setdefault(op["roll"], []).append(events[i])
+    if by_roll:
+        StagedGateEvents.objects.bulk_create(
+            [StagedGateEvents(roll=roll, events=roll_events) for roll, roll_events in by_roll.items()]
+        )
+    return _finish(events, triaged, seq_cursor)
@@ -0,0 +1,99 @@
+"""
+Streaming ingest of gate sync events (POST /api/sync/gate/events/stream).
+
+The body is newline-delimited JSON, one event per line (the same events as
+gate_events). Events are ingested in micro-batches of SYNC_STREAM_BATCH_SIZE,
+each committed on its own by the regular batch ingest, and the acks and
+rejections of every micro-batch are written back as one NDJSON line as soon
+as it commits. The gate marks those events sent while it is still uploading
+the rest, so a connection that drops half-way only loses the micro-batch in
+progress. Memory stays at one micro-batch however long the stream is.
+"""
+
+import json
+import time
+import zlib
+
+from django.utils import timezone
+
+from .processed_events import replay_horizon
+
+
+MAX_LINE_BYTES = 64 * 1024
+
+
+def read_events(stream, max_line_bytes: int = MAX_LINE_BYTES):
+    """Yield (line number, event, error) for each non-blank line of `stream`; event is None on error."""
+    number = 0
+    while True:
+        line = stream.readline(max_line_bytes + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > max_line_bytes and not line.endswith(b"\n"):
+            while line and not line.endswith(b"\n"):
+                line = stream.readline(max_line_bytes + 1)  # skip the rest of it
+            yield number, None, f"Line longer than {max_line_bytes} bytes"
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line), None
+        except ValueError as e:
+            yield number, None, f"Invalid JSON: {e}"
+
+
+def _line(message: dict) -> bytes:
+    return (json.dumps(message) + "\n").encode("utf-8")
+
+
+def ingest_stream(stream, ingest, batch_size: int = 100, on_batch=None):
+    """
+    Ingest the NDJSON events of `stream` with `ingest(events) -> (acked, rejected)`.
+
+    Yields one response line per committed micro-batch,
+      {"ackedEventIds": [...], "rejected": [{eventId, error}]}
+    and then {"done": true, "events": n, "acked": n, "rejected": n, "serverTime": "...", "replayHorizon": "..."},
+    or {"error": "..."} if the body could not be read to the end. `on_batch(events,
+    elapsed_s)` is called after each micro-batch (ingest timing for backpressure).
+    """
+    events, unreadable = [], []  # unreadable: rejections of lines that are not events
+    totals = {"events": 0, "acked": 0, "rejected": 0}
+
+    def flush():
+        started = time.perf_counter()
+        acked, rejected = ingest(events) if events else ([], [])
+        if on_batch is not None:
+            on_batch(len(events), time.perf_counter() - started)
+        rejected = unreadable + rejected
+        totals["events"] += len(events) + len(unreadable)
+        totals["acked"] += len(acked)
+        totals["rejected"] += len(rejected)
+        events.clear()
+        unreadable.clear()
+        return _line({"ackedEventIds": acked, "rejected": rejected})
+
+    try:
+        for number, ev, error in read_events(stream):
+            if error:
+                unreadable.append({"eventId": None, "line": number, "error": error})
+            else:
+                events.append(ev)
+            if len(events) + len(unreadable) >= batch_size:
+                yield flush()
+    except (OSError, EOFError, zlib.error) as e:
+        # Truncated/corrupt compressed body or the gate went away: keep what was read whole.
+        if events or unreadable:
+            yield flush()
+        yield _line({"error": f"Could not read the stream to the end: {e}"})
+        return
+
+    if events or unreadable:
+        yield flush()
+    yield _line({
+        "done": True,
+        **totals,
+        "serverTime": timezone.now().isoformat(),
+        "replayHorizon": replay_horizon().isoformat(),
+    })
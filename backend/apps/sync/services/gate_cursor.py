@@ -0,0 +1,195 @@
+"""
+Per-gate API keys and sequence cursors.
+
+Every gate has its own API key (Gate; only the key's SHA-256 is stored). The
+shared GATE_API_KEY still works, for a single gate or an older one, but
+without a cursor.
+
+A gate stamps its outbox rows with a monotonic sequence number (`seq`) that
+belongs to an `epoch`: a gate whose database is recreated starts over at 1
+under a new epoch. Requests carry the epoch (X-Gate-Epoch), events their
+`seq`, and an event that several coalesced events were folded into also the
+`foldedSeqs` of those.
+
+GateCursor records which seqs of the gate's current epoch are durable here:
+every seq from `floor_seq` to `high_water_seq`, except the [start, end]
+ranges in `gaps`. Batches of one gate commit out of order (several
+partitions are in flight at once), and some seqs never arrive (rejected or
+expired events, rolled-back gate transactions). So gaps are kept as at most
+SYNC_GATE_MAX_GAPS ranges; beyond that the oldest are given up by raising
+the floor, and those seqs fall back to processed_gate_events.
+
+The cursor is advanced after a batch commits, in a short transaction of its
+own, so it may lag behind what was committed but never runs ahead of it. A
+resent event whose seq is durable is therefore acked after one integer
+comparison (one primary-key read of the cursor per batch). Every other event
+still goes through its claim in processed_gate_events, which stays the
+authority.
+
+On start the gate asks for its cursor (POST gate/cursor) to mark unsent
+outbox rows the backend already has as sent. It reports its newest seq at
+the same time, so the cursor also shows how far each gate lags behind.
+"""
+
+import bisect
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import Gate, GateCursor
+
+
+def hash_key(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def authenticate(key: str) -> Gate | None:
+    """The active gate whose API key is `key`, or None."""
+    return Gate.objects.filter(key_hash=hash_key(key), is_active=True).first()
+
+
+def parse_epoch(value) -> uuid.UUID | None:
+    try:
+        return uuid.UUID(str(value)) if value else None
+    except ValueError:
+        return None
+
+
+def parse_seq(value) -> int | None:
+    """A positive integer seq, or None (bools and anything else are ignored)."""
+    return value if type(value) is int and value > 0 else None
+
+
+def event_seqs(ev) -> list[int]:
+    """The seqs an acked event settles: its own and those folded into it."""
+    seqs = [parse_seq(ev.get("seq"))]
+    folded = ev.get("foldedSeqs")
+    if isinstance(folded, list):
+        seqs.extend(parse_seq(seq) for seq in folded)
+    return [seq for seq in seqs if seq is not None]
+
+
+class SeqRanges:
+    """Durable seqs of one epoch: floor..high_water minus the sorted, disjoint [start, end] gaps."""
+
+    def __init__(self, high_water: int = 0, floor: int = 1, gaps=()):
+        self.high_water = high_water
+        self.floor = floor
+        self.gaps = [list(gap) for gap in gaps]
+
+    @classmethod
+    def of(cls, cursor: GateCursor) -> "SeqRanges":
+        return cls(cursor.high_water_seq, cursor.floor_seq, cursor.gaps or ())
+
+    def __contains__(self, seq: int) -> bool:
+        if not self.floor <= seq <= self.high_water:
+            return False
+        i = bisect.bisect_right(self.gaps, [seq, float("inf")]) - 1
+        return i < 0 or self.gaps[i][1] < seq
+
+    @property
+    def last_contiguous(self) -> int:
+        """Every seq from the floor up to this one is durable."""
+        return (self.gaps[0][0] if self.gaps else self.high_water + 1) - 1
+
+    @property
+    def missing(self) -> int:
+        """Seqs below the high-water mark that are not durable (yet)."""
+        return sum(end - start + 1 for start, end in self.gaps)
+
+    def add(self, seqs, max_gaps: int) -> bool:
+        """Mark `seqs` durable; returns whether anything changed."""
+        changed = False
+        for seq in sorted(set(seqs)):
+            if seq < self.floor or seq in self:
+                continue
+            changed = True
+            if seq > self.high_water:
+                if seq > self.high_water + 1:
+                    self.gaps.append([self.high_water + 1, seq - 1])
+                self.high_water = seq
+                continue
+            i = bisect.bisect_right(self.gaps, [seq, float("inf")]) - 1
+            start, end = self.gaps[i]
+            replacement = [r for r in ([start, seq - 1], [seq + 1, end]) if r[0] <= r[1]]
+            self.gaps[i:i + 1] = replacement
+        if len(self.gaps) > max(0, max_gaps):
+            # Give up on the oldest gaps; seqs below the new floor are looked up by event id again.
+            dropped = self.gaps[: len(self.gaps) - max(0, max_gaps)]
+            del self.gaps[: len(dropped)]
+            self.floor = dropped[-1][1] + 1
+        return changed
+
+
+def _locked_cursor(gate: Gate, epoch: uuid.UUID) -> GateCursor:
+    """The gate's cursor, locked; reset if the gate has moved to a new epoch. Call inside a transaction."""
+    cursor, _ = GateCursor.objects.select_for_update().get_or_create(gate=gate)
+    if cursor.epoch != epoch:
+        cursor.epoch = epoch
+        cursor.high_water_seq, cursor.floor_seq, cursor.gaps = 0, 1, []
+        cursor.head_seq = cursor.head_reported_at = cursor.advanced_at = None
+    return cursor
+
+
+class GateSeqCursor:
+    """The cursor of one gate epoch, as used while ingesting one request."""
+
+    def __init__(self, gate: Gate, epoch: uuid.UUID):
+        self.gate = gate
+        self.epoch = epoch
+        self._ranges = None  # as last read; seqs durable then are still durable
+
+    def durable(self, seq_by_id: dict) -> set:
+        """The event ids in {event_id: seq} whose seq is durable (one primary-key read)."""
+        if not seq_by_id:
+            return set()
+        cursor = GateCursor.objects.filter(gate=self.gate, epoch=self.epoch).first()
+        self._ranges = SeqRanges.of(cursor) if cursor is not None else SeqRanges()
+        return {event_id for event_id, seq in seq_by_id.items() if seq in self._ranges}
+
+    def settle(self, seqs) -> None:
+        """Mark the seqs of committed events durable (call via transaction.on_commit)."""
+        seqs = [seq for seq in seqs if self._ranges is None or seq not in self._ranges]
+        if not seqs:
+            return
+        with transaction.atomic():
+            cursor = _locked_cursor(self.gate, self.epoch)
+            ranges = SeqRanges.of(cursor)
+            if ranges.add(seqs, getattr(settings, "SYNC_GATE_MAX_GAPS", 256)):
+                cursor.high_water_seq, cursor.floor_seq, cursor.gaps = ranges.high_water, ranges.floor, ranges.gaps
+                cursor.advanced_at = timezone.now()
+                cursor.save()
+
+
+def describe(cursor: GateCursor) -> dict:
+    """Wire form of a cursor, with the gate's lag behind its last reported head."""
+    ranges = SeqRanges.of(cursor)
+    return {
+        "gate": cursor.gate.name,
+        "epoch": str(cursor.epoch) if cursor.epoch else None,
+        "floorSeq": ranges.floor,
+        "highWaterSeq": ranges.high_water,
+        "lastDurableSeq": ranges.last_contiguous,
+        "gaps": ranges.gaps,
+        "headSeq": cursor.head_seq,
+        # Seqs the gate has that haven't arrived beyond the high-water mark, and holes below it
+        # (in flight, retried, or never coming: rejected or expired events).
+        "lagEvents": max(0, cursor.head_seq - ranges.high_water) if cursor.head_seq is not None else None,
+        "missingSeqs": ranges.missing,
+        "advancedAt": cursor.advanced_at.isoformat() if cursor.advanced_at else None,
+        "headReportedAt": cursor.head_reported_at.isoformat() if cursor.head_reported_at else None,
+    }
+
+
+def report(gate: Gate, epoch: uuid.UUID, head_seq: int | None) -> dict:
+    """Record the gate's newest seq and return its cursor (see `describe`)."""
+    with transaction.atomic():
+        cursor = _locked_cursor(gate, epoch)
+        if head_seq is not None:
+            cursor.head_seq = head_seq
+            cursor.head_reported_at = timezone.now()
+        cursor.save()
+    return describe(cursor)
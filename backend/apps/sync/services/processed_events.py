@@ -0,0 +1,347 @@
+"""
+Idempotency store for gate events (processed_gate_events) with a retention horizon.
+
+A gate retries an event id only while the event is unsent in its outbox, and
+it stops sending outbox events older than its replay horizon
+(SYNC_REPLAY_HORIZON_DAYS on the gate, kept below the `replayHorizon` every
+sync response advertises). So ids older than SYNC_PROCESSED_RETENTION_DAYS
+are never asked about again and can be forgotten.
+
+On Postgres the table is partitioned by RANGE (received_at) into
+SYNC_PROCESSED_PARTITION_DAYS-wide partitions (migration sync.0002):
+
+  - an insert only touches the indexes of the current partition, so they stay
+    the size of one partition's worth of ids however old the deployment is
+  - retention drops whole partitions: no DELETE, no dead tuples, no vacuum
+  - partitions are created SYNC_PROCESSED_PARTITIONS_AHEAD ahead by
+    `prune_processed_events`, and before each batch by the ingest path itself
+    (outside its transaction) if that falls behind
+
+A partitioned table's primary key must contain the partition key, so the key
+is (event_id, received_at) and an id alone is no longer unique. Claims
+therefore take a transaction-level advisory lock per id (in id order, so two
+batches can't deadlock), look the ids up in the partitions inside the
+retention horizon, and insert the ones not found.
+
+Other databases (sqlite in development and tests) keep the plain table with
+`INSERT ... ON CONFLICT DO NOTHING RETURNING` and expire rows with batched
+deletes.
+
+A gate resends a whole batch when its request timed out after the backend had
+committed it. `recent_event_ids` lets ingest ack such known duplicates before
+opening a transaction: a bounded LRU of the last SYNC_RECENT_EVENT_IDS
+committed ids per process, optionally shared between processes through the
+Django cache named by SYNC_RECENT_EVENT_IDS_CACHE, and one
+`SELECT ... WHERE event_id IN (...)` for the ids neither knows. A retried
+batch costs that one query, or none when it comes back to the same process.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from ..models import ProcessedGateEvent
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_BOUND_RE = re.compile(r"FROM \((MINVALUE|'[^']*')\) TO \((MAXVALUE|'[^']*')\)")
+
+_lock = threading.Lock()
+_partitioned = {}  # connection alias -> bool
+_covered_until = {}  # connection alias -> end of the newest partition this process has seen
+
+
+def retention() -> timedelta:
+    return timedelta(days=getattr(settings, "SYNC_PROCESSED_RETENTION_DAYS", 30))
+
+
+def replay_horizon(now: datetime | None = None) -> datetime:
+    """Oldest received_at whose ids are still remembered; gates must not replay events older than this."""
+    return (now or timezone.now()) - retention()
+
+
+def _width() -> timedelta:
+    return timedelta(days=max(1, getattr(settings, "SYNC_PROCESSED_PARTITION_DAYS", 1)))
+
+
+def _table() -> str:
+    return ProcessedGateEvent._meta.db_table
+
+
+def is_partitioned() -> bool:
+    """True when processed_gate_events is a partitioned (Postgres) table."""
+    alias = connection.alias
+    if alias not in _partitioned:
+        result = False
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [_table()])
+                row = cursor.fetchone()
+                result = bool(row) and row[0] == "p"
+        _partitioned[alias] = result
+    return _partitioned[alias]
+
+
+# ----------------------------------------------------------------------
+# Recently processed ids
+# ----------------------------------------------------------------------
+class RecentEventIds:
+    CACHE_PREFIX = "sync:processed:"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = OrderedDict()  # event_id -> None, least recently seen first
+
+    @property
+    def capacity(self) -> int:
+        return getattr(settings, "SYNC_RECENT_EVENT_IDS", 50000)
+
+    def _shared(self):
+        alias = getattr(settings, "SYNC_RECENT_EVENT_IDS_CACHE", "")
+        return caches[alias] if alias else None
+
+    def known(self, event_ids, query: bool = True) -> set:
+        """
+        The ids among `event_ids` that were processed before: from this process's
+        LRU, then the shared cache, then (with `query`) one SELECT for the rest.
+        With SYNC_RECENT_EVENT_IDS = 0 only the SELECT is left.
+        """
+        ids = set(event_ids)
+        if not ids:
+            return set()
+        with self._lock:
+            found = {event_id for event_id in ids if event_id in self._ids}
+            for event_id in found:
+                self._ids.move_to_end(event_id)
+        missing = ids - found
+        learned = set()
+
+        shared = self._shared()
+        if missing and shared is not None:
+            keys = {f"{self.CACHE_PREFIX}{event_id}": event_id for event_id in missing}
+            learned |= {keys[key] for key in shared.get_many(list(keys))}
+            missing -= learned
+
+        if missing and query:
+            learned |= set(
+                ProcessedGateEvent.objects.filter(event_id__in=missing, received_at__gte=replay_horizon())
+                .values_list("event_id", flat=True)
+            )
+        self._add(learned)
+        return found | learned
+
+    def remember(self, event_ids) -> None:
+        """Record committed ids (call via transaction.on_commit: a rolled-back id must not be acked later)."""
+        ids = set(event_ids)
+        if not ids:
+            return
+        self._add(ids)
+        shared = self._shared()
+        if shared is not None:
+            shared.set_many(
+                {f"{self.CACHE_PREFIX}{event_id}": 1 for event_id in ids}, timeout=int(retention().total_seconds())
+            )
+
+    def _add(self, ids) -> None:
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            for event_id in ids:
+                self._ids[event_id] = None
+                self._ids.move_to_end(event_id)
+            while len(self._ids) > self.capacity:
+                self._ids.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids.clear()
+
+
+recent_event_ids = RecentEventIds()
+
+
+# ----------------------------------------------------------------------
+# Claims
+# ----------------------------------------------------------------------
+def claim_events(claims: list[tuple]) -> set:
+    """
+    Record (event_id, event_type) pairs as processed, skipping ids that already
+    are. Returns the ids that were recorded (i.e. not processed before).
+    Must run inside the transaction that applies the events.
+    """
+    if not claims:
+        return set()
+    if is_partitioned():
+        return _claim_partitioned(claims)
+    if connection.vendor not in ("postgresql", "sqlite"):
+        # No INSERT ... ON CONFLICT DO NOTHING RETURNING: one insert per id.
+        return _claim_each(claims)
+    pk = connection.ops.quote_name(ProcessedGateEvent._meta.pk.column)
+    return _insert_new(claims, on_conflict=f"ON CONFLICT ({pk}) DO NOTHING")
+
+
+def _claim_each(claims: list[tuple]) -> set:
+    inserted = set()
+    for event_id, event_type in claims:
+        try:
+            with transaction.atomic():
+                ProcessedGateEvent(event_id=event_id, event_type=event_type).save(force_insert=True)
+        except IntegrityError:
+            continue
+        inserted.add(event_id)
+    return inserted
+
+
+def _insert_new(claims: list[tuple], on_conflict: str) -> set:
+    if not claims:
+        return set()
+    meta = ProcessedGateEvent._meta
+    fields = [meta.get_field(name) for name in ("event_id", "event_type", "received_at")]
+    qn = connection.ops.quote_name
+    columns = ", ".join(qn(f.column) for f in fields)
+    pk = qn(meta.pk.column)
+    received_at = timezone.now()
+
+    inserted = set()
+    step = connection.ops.bulk_batch_size(fields, claims)
+    with connection.cursor() as cursor:
+        for i in range(0, len(claims), step):
+            chunk = claims[i:i + step]
+            params = []
+            for event_id, event_type in chunk:
+                for field, value in zip(fields, (event_id, event_type, received_at)):
+                    params.append(field.get_db_prep_save(value, connection))
+            values = ", ".join(["(" + ", ".join(["%s"] * len(fields)) + ")"] * len(chunk))
+            cursor.execute(
+                f"INSERT INTO {qn(meta.db_table)} ({columns}) VALUES {values} {on_conflict} RETURNING {pk}",
+                params,
+            )
+            inserted.update(meta.pk.to_python(row[0]) for row in cursor.fetchall())
+    return inserted
+
+
+def _lock_key(event_id) -> int:
+    return int.from_bytes(event_id.bytes[:8], "big", signed=True)
+
+
+def _claim_partitioned(claims: list[tuple]) -> set:
+    # Serialize concurrent claims of the same ids until the claiming transaction ends.
+    keys = sorted({_lock_key(event_id) for event_id, _ in claims})
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(k) FROM unnest(%s::bigint[]) AS k ORDER BY k", [keys])
+    ids = [event_id for event_id, _ in claims]
+    seen = set(
+        ProcessedGateEvent.objects.filter(event_id__in=ids, received_at__gte=replay_horizon())
+        .values_list("event_id", flat=True)
+    )
+    return _insert_new([c for c in claims if c[0] not in seen], on_conflict="ON CONFLICT DO NOTHING")
+
+
+# ----------------------------------------------------------------------
+# Partitions and retention
+# ----------------------------------------------------------------------
+def _parse_bound(text: str):
+    if text in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(text.strip("'")).astimezone(dt_timezone.utc)
+
+
+def partitions() -> list[tuple[str, datetime | None, datetime | None]]:
+    """(name, start, end) of every partition, oldest first; None stands for MINVALUE/MAXVALUE."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)",
+            [_table()],
+        )
+        rows = cursor.fetchall()
+    found = []
+    for name, bound in rows:
+        match = _BOUND_RE.search(bound or "")
+        if match:
+            found.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    found.sort(key=lambda p: p[1] or _EPOCH)
+    return found
+
+
+def _aligned(ts: datetime) -> datetime:
+    width = _width()
+    return _EPOCH + width * ((ts - _EPOCH) // width)
+
+
+def ensure_partitions(now: datetime | None = None, lazy: bool = False) -> list[str]:
+    """
+    Create partitions so that received_at values up to SYNC_PROCESSED_PARTITIONS_AHEAD
+    partitions past `now` have one. Returns the names created. No-op unless partitioned.
+
+    With `lazy`, only checks the catalog once the partitions this process last
+    saw are about to run out (the ingest path). Call it outside a transaction:
+    a partition created in one that rolls back would still count as seen.
+    """
+    if not is_partitioned():
+        return []
+    now = now or timezone.now()
+    width = _width()
+    alias = connection.alias
+    if lazy and now + width < _covered_until.get(alias, now):
+        return []
+    until = now + width * max(1, getattr(settings, "SYNC_PROCESSED_PARTITIONS_AHEAD", 3))
+
+    created = []
+    with _lock:
+        # New partitions continue from the newest one, so a changed width never overlaps.
+        start = max((end for _, _, end in partitions() if end is not None), default=None) or _aligned(now)
+        qn = connection.ops.quote_name
+        while start < until:
+            end = _aligned(start) + width
+            name = f"{_table()}_p{start:%Y%m%d}"
+            with connection.cursor() as cursor:
+                # DDL takes no bind parameters; both bounds are timestamps computed here.
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {qn(name)} PARTITION OF {qn(_table())} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+            created.append(name)
+            start = end
+        _covered_until[alias] = start
+    return created
+
+
+def purge_expired(now: datetime | None = None, dry_run: bool = False) -> dict:
+    """
+    Forget ids received before the retention horizon.
+
+    Partitioned: drops every partition that ends at or before the horizon
+    ({"partitions": [names], "rows": approximate}). Otherwise deletes rows in
+    batches of SYNC_PROCESSED_PURGE_BATCH_SIZE ({"partitions": [], "rows": n}).
+    """
+    horizon = replay_horizon(now)
+    if is_partitioned():
+        expired = [(name, end) for name, _, end in partitions() if end is not None and end <= horizon]
+        rows = 0
+        with connection.cursor() as cursor:
+            for name, _ in expired:
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", [name])
+                rows += max(0, cursor.fetchone()[0])
+                if not dry_run:
+                    cursor.execute(f"DROP TABLE {connection.ops.quote_name(name)}")
+        return {"partitions": [name for name, _ in expired], "rows": rows}
+
+    qs = ProcessedGateEvent.objects.filter(received_at__lt=horizon)
+    if dry_run:
+        return {"partitions": [], "rows": qs.count()}
+    batch_size = max(1, getattr(settings, "SYNC_PROCESSED_PURGE_BATCH_SIZE", 5000))
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(qs.values_list("event_id", flat=True)[:batch_size])
+            if not ids:
+                break
+            deleted += ProcessedGateEvent.objects.filter(event_id__in=ids).delete()[0]
+    return {"partitions": [], "rows": deleted}
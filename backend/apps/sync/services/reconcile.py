@@ -0,0 +1,76 @@
+"""
+Range-hash reconciliation with a gate (POST /api/sync/gate/reconcile).
+
+The gate sends created_at ranges of EntryLog or ExitLog rows and gets back,
+for each range, either the (count, hash) of its equal-width buckets or, once
+the gate has narrowed a range down to a few rows, the digest of every row.
+Hashing is shared with the gate (shared.apps.entries.range_hash), so equal
+answers mean equal rows; the gate re-sends only rows whose digests differ.
+"""
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from shared.apps.entries.range_hash import KINDS, bucket_hashes, row_digests
+
+
+MAX_RANGES = 256
+MAX_BUCKETS = 64
+
+
+class TooManyRows(Exception):
+    pass
+
+
+def _parse_bound(value):
+    dt = parse_datetime(str(value)) if value else None
+    if dt is None:
+        raise ValueError(f"Invalid range bound: {value!r} (expected ISO-8601)")
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt, timezone=timezone.utc)
+    return dt
+
+
+def parse_request(data) -> dict:
+    """Validated {kind, ranges, buckets, rows, roll} or ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError("Body must be an object")
+    kind = data.get("kind")
+    if kind not in KINDS:
+        raise ValueError(f"'kind' must be one of {', '.join(KINDS)}")
+    ranges = data.get("ranges")
+    if not isinstance(ranges, list) or not 0 < len(ranges) <= MAX_RANGES:
+        raise ValueError(f"'ranges' must be a list of 1-{MAX_RANGES} [start, end] pairs")
+    parsed = []
+    for pair in ranges:
+        if not isinstance(pair, list) or len(pair) != 2:
+            raise ValueError("Each range must be a [start, end] pair")
+        start, end = _parse_bound(pair[0]), _parse_bound(pair[1])
+        if end <= start:
+            raise ValueError(f"Empty range: {pair}")
+        parsed.append((start, end))
+    rows = bool(data.get("rows"))
+    buckets = data.get("buckets")
+    if not rows and (not isinstance(buckets, int) or not 1 <= buckets <= MAX_BUCKETS):
+        raise ValueError(f"'buckets' must be 1-{MAX_BUCKETS} (or set 'rows')")
+    roll = data.get("roll") or None
+    return {"kind": kind, "ranges": parsed, "buckets": buckets, "rows": rows, "roll": roll}
+
+
+def answer(query: dict, max_rows: int) -> dict:
+    """Bucket hashes ({"buckets": [[{count, hash}]]}) or row digests ({"rows": [{id: digest}]}) per range."""
+    if not query["rows"]:
+        return {
+            "buckets": [
+                bucket_hashes(query["kind"], start, end, query["buckets"], query["roll"])
+                for start, end in query["ranges"]
+            ]
+        }
+    rows, total = [], 0
+    for start, end in query["ranges"]:
+        digests = row_digests(query["kind"], start, end, query["roll"])
+        total += len(digests)
+        if total > max_rows:
+            raise TooManyRows(max_rows)
+        rows.append(digests)
+    return {"rows": rows}
@@ -0,0 +1,144 @@
+"""
+Staged sync ingest: queue and ack in the request, apply in worker processes.
+
+With SYNC_INGEST_MODE = "staged", gate_events and the stream endpoint only do
+steps 0-1 of event_ingest (known ids, validation) and then write the new
+events to sync_staged_events with one INSERT and ack them (`stage_events`).
+A slow database then makes the queue grow instead of making gate requests
+time out and back off. Invalid events are still rejected in the response,
+and for a gate with its own key the staged seqs advance its cursor: staged
+events are durable.
+
+The rows are applied by `manage.py apply_staged_events`, a pool of worker
+processes. A worker claims up to SYNC_STAGED_CLAIM_ROWS due rows with
+SELECT ... FOR UPDATE SKIP LOCKED, applies their events with ingest_events
+(claims in processed_gate_events, latest scanned_at wins) and deletes them,
+all in one transaction. Rows are staged per roll, and a row is only claimed
+once no older row of its roll is left: every roll's events are applied in the
+order they were staged (the gate sends them in order), and two workers never
+work on the same roll.
+
+If applying fails, which is the database's doing (invalid events never get
+staged), the rows stay and are retried after SYNC_STAGED_RETRY_SECONDS,
+doubled per failed attempt up to MAX_RETRY_SECONDS; later rows of the same
+rolls wait for them. Events rejected while applying (constraint violations)
+were acked already, so they are only logged.
+
+sqlite ignores FOR UPDATE and SKIP LOCKED; run a single worker there.
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from ..models import StagedGateEvents
+from .event_ingest import ingest_events, ingest_events_one_by_one
+from .processed_events import ensure_partitions
+
+
+MAX_RETRY_SECONDS = 300
+
+
+def is_staged_mode() -> bool:
+    return getattr(settings, "SYNC_INGEST_MODE", "direct") == "staged"
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Backoff before the next apply of rows that failed `attempts` times."""
+    first = max(1, getattr(settings, "SYNC_STAGED_RETRY_SECONDS", 5))
+    return timedelta(seconds=min(MAX_RETRY_SECONDS, first * 2 ** min(attempts - 1, 16)))
+
+
+def queue_stats() -> dict:
+    """{"rows", "oldest" (received_at of the oldest row, or None)} of the staging queue."""
+    oldest = StagedGateEvents.objects.order_by("id").values_list("received_at", flat=True).first()
+    return {"rows": StagedGateEvents.objects.count(), "oldest": oldest}
+
+
+def _claim(limit: int) -> list:
+    """Lock up to `limit` due rows that are the oldest of their roll. Call inside a transaction."""
+    older = StagedGateEvents.objects.filter(roll=OuterRef("roll"), id__lt=OuterRef("id"))
+    return list(
+        StagedGateEvents.objects.select_for_update(skip_locked=True)
+        .filter(available_at__lte=timezone.now())
+        .exclude(Exists(older))
+        .order_by("id")[:limit]
+    )
+
+
+class StagedEventsWorker:
+    """Applies staged rows, one claim per transaction."""
+
+    def __init__(self, claim_rows: int | None = None, log=print):
+        self.claim_rows = claim_rows or getattr(settings, "SYNC_STAGED_CLAIM_ROWS", 100)
+        self.ingest = ingest_events if getattr(settings, "SYNC_BULK_INGEST", True) else ingest_events_one_by_one
+        self.log = log
+
+    def apply_once(self) -> dict | None:
+        """
+        Claim and apply one set of rows. Returns None when no row is due, else
+        {"rows", "events", "acked", "rejected", "lag" (seconds since the oldest was staged), "error"}.
+        """
+        ensure_partitions(lazy=True)  # outside the transaction, see ensure_partitions
+        with transaction.atomic():
+            rows = _claim(self.claim_rows)
+            if not rows:
+                return None
+            events = [ev for row in rows for ev in row.events]
+            result = {
+                "rows": len(rows),
+                "events": len(events),
+                "acked": 0,
+                "rejected": [],
+                "lag": (timezone.now() - min(row.received_at for row in rows)).total_seconds(),
+                "error": None,
+            }
+            try:
+                with transaction.atomic():
+                    acked, result["rejected"] = self.ingest(events)
+                    StagedGateEvents.objects.filter(id__in=[row.id for row in rows]).delete()
+                result["acked"] = len(acked)
+            except Exception as e:
+                # The rows stay (still locked by us) and are retried after a backoff.
+                result["error"] = f"{type(e).__name__}: {e}"
+                now = timezone.now()
+                for row in rows:
+                    row.attempts += 1
+                    row.available_at = now + retry_delay(row.attempts)
+                    row.last_error = result["error"][:2000]
+                StagedGateEvents.objects.bulk_update(rows, ["attempts", "available_at", "last_error"])
+        return result
+
+    def run(self, poll_seconds: float, until_empty: bool = False) -> int:
+        """Apply rows until interrupted (or, with `until_empty`, until none is due). Returns events applied."""
+        applied = 0
+        while True:
+            try:
+                result = self.apply_once()
+            except Exception as e:
+                # Claiming or recording a failure failed: the database is away. Start over on a new connection.
+                if until_empty:
+                    raise
+                self.log(f"error: {type(e).__name__}: {e}")
+                connection.close()
+                time.sleep(max(poll_seconds, 1.0))
+                continue
+            if result is None:
+                if until_empty:
+                    return applied
+                time.sleep(poll_seconds)
+                continue
+            if result["error"]:
+                self.log(f"{result['rows']} rows ({result['events']} events) failed, will retry: {result['error']}")
+                continue
+            applied += result["events"]
+            self.log(
+                f"applied {result['rows']} rows ({result['events']} events, {len(result['rejected'])} rejected), "
+                f"staged {result['lag']:.1f}s ago"
+            )
+            for rejection in result["rejected"]:
+                self.log(f"rejected {rejection['eventId']}: {rejection['error']}")
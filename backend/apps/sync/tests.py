@@ -0,0 +1,671 @@
+import gzip
+import json
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.utils import OperationalError
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from apps.sync.models import Gate, ProcessedGateEvent, StagedGateEvents
+from apps.sync.services.backpressure import IngestLoad, ingest_load
+from apps.sync.services.gate_cursor import SeqRanges, hash_key
+from apps.sync.services.processed_events import purge_expired, recent_event_ids
+from apps.sync.services.staged_ingest import StagedEventsWorker, _claim
+from shared.apps.entries.models import EntryLog, ExitLog
+from shared.apps.entries.range_hash import bucket_hashes, row_digests
+
+
+GATE_KEY = "test-gate-key"
+SYNC_URL = "/api/sync/gate/events"
+
+
+def _entry_event(entry_id, scanned_at, status="ENTERED", roll="24MA10001"):
+    return {
+        "eventId": str(uuid.uuid4()),
+        "type": "ENTRY",
+        "entryId": str(entry_id),
+        "roll": roll,
+        "scannedAt": scanned_at.isoformat(),
+        "createdAt": scanned_at.isoformat(),
+        "status": status,
+        "entryFlag": "NORMAL_ENTRY",
+        "laptop": "Dell",
+        "extra": [],
+        "deviceMeta": {"gateDeviceId": "lane-1"},
+    }
+
+
+def _status_event(entry_id, status, ts, roll="24MA10001"):
+    return {
+        "eventId": str(uuid.uuid4()),
+        "type": "ENTRY_STATUS",
+        "entryId": str(entry_id),
+        "roll": roll,
+        "status": status,
+        "ts": ts.isoformat(),
+    }
+
+
+def _exit_event(exit_id, entry_id, scanned_at, roll="24MA10001"):
+    return {
+        "eventId": str(uuid.uuid4()),
+        "type": "EXIT",
+        "exitId": str(exit_id),
+        "entryId": str(entry_id),
+        "roll": roll,
+        "scannedAt": scanned_at.isoformat(),
+        "exitFlag": "NORMAL_EXIT",
+        "extra": [],
+        "deviceMeta": {},
+    }
+
+
+def _mixed_batches(t0):
+    """Two batches: one event, then a mix of replays, placeholders, invalid events and repeats."""
+    known, orphan, exit_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    first = [_entry_event(known, t0 + timedelta(hours=1))]
+    stale = _entry_event(known, t0, status="EXPIRED")  # older replay: must not win
+    invalid = _status_event(uuid.uuid4(), "BOGUS", t0)
+    second = [
+        first[0],  # already processed
+        stale,
+        _exit_event(exit_id, orphan, t0 + timedelta(hours=2)),  # placeholder entry
+        _entry_event(orphan, t0, roll="24MA10001"),  # fills the placeholder
+        invalid,
+        dict(invalid, status="EXITED", entryId=str(known), ts=(t0 + timedelta(hours=3)).isoformat()),
+        _status_event(known, "EXITED", t0 + timedelta(hours=3)),
+        "not-an-event",
+        {"type": "ENTRY"},
+        {"eventId": "nope", "type": "ENTRY"},
+    ]
+    second.append(dict(second[-4]))  # repeat of an event processed earlier in the batch
+    return first, second
+
+
+@override_settings(GATE_API_KEY=GATE_KEY)
+class GateEventsTestCase(TestCase):
+    """Tests for the /api/sync/gate/events endpoint."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.t0 = datetime(2026, 1, 10, 9, 0, tzinfo=dt_timezone.utc)
+
+    def _post(self, *events):
+        response = self.client.post(
+            SYNC_URL, {"events": list(events)}, format="json", HTTP_X_GATE_API_KEY=GATE_KEY
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_status_event_updates_status_and_keeps_snapshot(self):
+        entry_id = uuid.uuid4()
+        snapshot = _entry_event(entry_id, self.t0)
+        exited = _status_event(entry_id, "EXITED", self.t0 + timedelta(hours=2))
+        data = self._post(snapshot, exited)
+
+        self.assertEqual(data["ackedEventIds"], [snapshot["eventId"], exited["eventId"]])
+        entry = EntryLog.objects.get(id=entry_id)
+        self.assertEqual(entry.status, "EXITED")
+        self.assertEqual(entry.scanned_at, self.t0)  # EXITED keeps the entry time
+        self.assertEqual(entry.laptop, "Dell")
+
+    def test_expired_status_moves_scanned_at(self):
+        entry_id = uuid.uuid4()
+        expired_at = self.t0 + timedelta(hours=1)
+        self._post(_entry_event(entry_id, self.t0), _status_event(entry_id, "EXPIRED", expired_at))
+
+        entry = EntryLog.objects.get(id=entry_id)
+        self.assertEqual((entry.status, entry.scanned_at), ("EXPIRED", expired_at))
+
+    def test_stale_status_event_is_ignored(self):
+        entry_id = uuid.uuid4()
+        expired_at = self.t0 + timedelta(hours=3)
+        self._post(_entry_event(entry_id, self.t0), _status_event(entry_id, "EXPIRED", expired_at))
+        data = self._post(_status_event(entry_id, "EXITED", self.t0 + timedelta(hours=2)))
+
+        self.assertEqual(len(data["ackedEventIds"]), 1)
+        self.assertEqual(EntryLog.objects.get(id=entry_id).status, "EXPIRED")
+
+    def test_status_event_without_snapshot_creates_placeholder(self):
+        entry_id = uuid.uuid4()
+        self._post(_status_event(entry_id, "EXPIRED", self.t0))
+        entry = EntryLog.objects.get(id=entry_id)
+        self.assertEqual((entry.roll_id, entry.status), ("24MA10001", "EXPIRED"))
+
+    def test_invalid_status_is_rejected(self):
+        event = _status_event(uuid.uuid4(), "BOGUS", self.t0)
+        data = self._post(event)
+        self.assertEqual(data["ackedEventIds"], [])
+        self.assertEqual(data["rejected"][0]["eventId"], event["eventId"])
+
+    def _post_encoded(self, body, encoding):
+        return self.client.generic(
+            "POST", SYNC_URL, body, content_type="application/json",
+            HTTP_CONTENT_ENCODING=encoding, HTTP_X_GATE_API_KEY=GATE_KEY,
+        )
+
+    def test_gzip_request_body_is_accepted(self):
+        events = [_entry_event(uuid.uuid4(), self.t0, roll=f"24MA1{i:04d}") for i in range(50)]
+        response = self._post_encoded(gzip.compress(json.dumps({"events": events}).encode()), "gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["ackedEventIds"]), 50)
+        self.assertEqual(EntryLog.objects.count(), 50)
+
+    def test_unsupported_content_encoding_is_refused(self):
+        response = self._post_encoded(b"...", "br")
+        self.assertEqual(response.status_code, 415)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=4096)
+    def test_decompressed_size_is_capped(self):
+        body = gzip.compress(json.dumps({"events": [], "pad": "x" * 100_000}).encode())
+        self.assertEqual(self._post_encoded(body, "gzip").status_code, 413)
+
+
+@override_settings(GATE_API_KEY=GATE_KEY)
+class BulkIngestTestCase(TestCase):
+    """The set-based ingest must ack/reject and store exactly what the per-event loop does."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.t0 = datetime(2026, 1, 10, 9, 0, tzinfo=dt_timezone.utc)
+
+    def _post(self, events):
+        response = self.client.post(
+            SYNC_URL, {"events": events}, format="json", HTTP_X_GATE_API_KEY=GATE_KEY
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return data["ackedEventIds"], data["rejected"]
+
+    def _snapshot(self):
+        entries = sorted(
+            (str(e.id), e.roll_id, e.status, e.scanned_at, e.laptop) for e in EntryLog.objects.all()
+        )
+        exits = sorted((str(e.id), str(e.entry_id_id), e.scanned_at) for e in ExitLog.objects.all())
+        return entries, exits
+
+    def _run(self, bulk):
+        with self.settings(SYNC_BULK_INGEST=bulk):
+            first, second = _mixed_batches(self.t0)
+            self._post(first)
+            acked, rejected = self._post(second)
+        # Event ids are random per run; compare positions instead.
+        ids = [ev.get("eventId") if isinstance(ev, dict) else None for ev in second]
+        result = (
+            [ids.index(a) for a in acked],
+            [(ids.index(r["eventId"]) if r["eventId"] in ids else None, r["error"]) for r in rejected],
+            sorted(row[1:] for row in self._snapshot()[0]),
+        )
+        EntryLog.objects.all().delete()
+        return result
+
+    def test_bulk_matches_per_event_results(self):
+        self.assertEqual(self._run(bulk=True), self._run(bulk=False))
+
+    def test_batch_stores_latest_rows(self):
+        first, second = _mixed_batches(self.t0)
+        self._post(first)
+        acked, rejected = self._post(second)
+
+        self.assertEqual(len(acked), 7)
+        self.assertEqual(len(rejected), 4)
+        known = EntryLog.objects.get(id=first[0]["entryId"])
+        self.assertEqual((known.status, known.scanned_at), ("EXITED", self.t0 + timedelta(hours=1)))
+        orphan = EntryLog.objects.get(id=second[3]["entryId"])
+        self.assertEqual((orphan.status, orphan.laptop), ("ENTERED", "Dell"))
+        self.assertEqual(ExitLog.objects.get().entry_id_id, orphan.id)
+
+    def test_snapshot_after_status_fills_placeholder(self):
+        for bulk in (True, False):
+            with self.subTest(bulk=bulk), self.settings(SYNC_BULK_INGEST=bulk):
+                exited, expired = uuid.uuid4(), uuid.uuid4()
+                snapshot = dict(_entry_event(exited, self.t0), entryFlag="FORCED_ENTRY")
+                self._post([_status_event(exited, "EXITED", self.t0 + timedelta(hours=3))])
+                self._post([_status_event(expired, "EXPIRED", self.t0 + timedelta(hours=4))])
+                self._post([snapshot, _entry_event(expired, self.t0)])
+
+                entry = EntryLog.objects.get(id=exited)
+                self.assertEqual(
+                    (entry.status, entry.entry_flag, entry.laptop, entry.scanned_at, entry.device_meta),
+                    ("EXITED", "FORCED_ENTRY", "Dell", self.t0, {"gateDeviceId": "lane-1"}),
+                )
+                entry = EntryLog.objects.get(id=expired)
+                self.assertEqual(
+                    (entry.status, entry.entry_flag, entry.scanned_at),
+                    ("EXPIRED", "NORMAL_ENTRY", self.t0 + timedelta(hours=4)),
+                )
+                # Filled in: an older replay of the snapshot no longer wins.
+                earlier = (self.t0 - timedelta(hours=1)).isoformat()
+                self._post([dict(snapshot, eventId=str(uuid.uuid4()), scannedAt=earlier)])
+                self.assertEqual(EntryLog.objects.get(id=exited).scanned_at, self.t0)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        def queries(n):
+            events = [_entry_event(uuid.uuid4(), self.t0, roll=f"24MA2{i:04d}") for i in range(n)]
+            with CaptureQueriesContext(connection) as ctx:
+                acked, _ = self._post(events)
+            self.assertEqual(len(acked), n)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(queries(5), queries(200))
+
+
+@override_settings(GATE_API_KEY=GATE_KEY)
+class BackpressureTestCase(TestCase):
+    """The sync endpoint sheds load with Retry-After and suggests smaller batches when ingest is slow."""
+
+    def _post(self, events):
+        return APIClient().post(SYNC_URL, {"events": events}, format="json", HTTP_X_GATE_API_KEY=GATE_KEY)
+
+    @override_settings(SYNC_MAX_CONCURRENT_BATCHES=1, SYNC_RETRY_AFTER_SECONDS=3)
+    def test_busy_endpoint_returns_retry_after(self):
+        self.assertTrue(ingest_load.try_enter(0))  # another batch in progress
+        try:
+            response = self._post([])
+        finally:
+            ingest_load.leave(0, 0)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "3")
+        self.assertEqual(self._post([]).status_code, 200)
+
+    @override_settings(SYNC_MAX_EVENTS=2)
+    def test_too_large_batch_suggests_max(self):
+        response = self._post([{}, {}, {}])
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response["X-Sync-Batch-Size"], "2")
+
+    def test_suggested_batch_size_follows_ingest_rate(self):
+        load = IngestLoad()
+        self.assertIsNone(load.suggested_batch_size(0.5, 500))
+        self.assertTrue(load.try_enter(0))
+        load.leave(100, 1.0)  # 10ms per event
+        self.assertEqual(load.suggested_batch_size(0.5, 500), 50)
+        self.assertTrue(load.try_enter(0))  # a concurrent batch halves the share
+        self.assertEqual(load.suggested_batch_size(0.5, 500), 25)
+        self.assertIsNone(load.suggested_batch_size(10, 500))
+
+
+@override_settings(GATE_API_KEY=GATE_KEY, SYNC_STREAM_BATCH_SIZE=2)
+class StreamIngestTestCase(TestCase):
+    """The NDJSON stream endpoint acks each committed micro-batch as its own response line."""
+
+    def setUp(self):
+        self.t0 = datetime(2026, 1, 10, 9, 0, tzinfo=dt_timezone.utc)
+
+    def _stream(self, lines, encoding=None):
+        body = b"".join(line if isinstance(line, bytes) else json.dumps(line).encode() + b"\n" for line in lines)
+        extra = {}
+        if encoding:
+            body = gzip.compress(body)
+            extra["HTTP_CONTENT_ENCODING"] = encoding
+        response = APIClient().generic(
+            "POST", SYNC_URL + "/stream", body, content_type="application/x-ndjson",
+            HTTP_X_GATE_API_KEY=GATE_KEY, **extra,
+        )
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_events_are_acked_per_micro_batch(self):
+        events = [_entry_event(uuid.uuid4(), self.t0, roll=f"24MA1{i:04d}") for i in range(4)]
+        lines = self._stream([events[0], events[1], b"{not json\n", b"\n", events[2], events[3]])
+
+        self.assertEqual([line["ackedEventIds"] for line in lines[:-1]], [
+            [events[0]["eventId"], events[1]["eventId"]],
+            [events[2]["eventId"]],
+            [events[3]["eventId"]],
+        ])
+        self.assertEqual(lines[1]["rejected"][0]["line"], 3)
+        self.assertEqual(lines[-1]["done"], True)
+        self.assertEqual((lines[-1]["events"], lines[-1]["acked"], lines[-1]["rejected"]), (5, 4, 1))
+        self.assertEqual(EntryLog.objects.count(), 4)
+
+    def test_gzip_stream_is_decoded_incrementally(self):
+        events = [_entry_event(uuid.uuid4(), self.t0, roll=f"24MA1{i:04d}") for i in range(3)]
+        with self.settings(DATA_UPLOAD_MAX_MEMORY_SIZE=64):  # no whole-body buffering
+            lines = self._stream(events, encoding="gzip")
+        self.assertEqual(sum(len(line.get("ackedEventIds", [])) for line in lines), 3)
+        self.assertTrue(lines[-1]["done"])
+
+    def test_truncated_stream_keeps_committed_batches(self):
+        events = [_entry_event(uuid.uuid4(), self.t0, roll=f"24MA1{i:04d}") for i in range(3)]
+        body = gzip.compress(b"".join(json.dumps(ev).encode() + b"\n" for ev in events))
+        response = APIClient().generic(
+            "POST", SYNC_URL + "/stream", body[:-12], content_type="application/x-ndjson",
+            HTTP_CONTENT_ENCODING="gzip", HTTP_X_GATE_API_KEY=GATE_KEY,
+        )
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertIn("error", lines[-1])
+        self.assertEqual(EntryLog.objects.count(), sum(len(line.get("ackedEventIds", [])) for line in lines))
+        self.assertEqual(ingest_load.inflight, 0)
+
+    def test_unread_stream_gives_back_its_slot(self):
+        response = APIClient().generic(
+            "POST", SYNC_URL + "/stream", json.dumps(_entry_event(uuid.uuid4(), self.t0)).encode() + b"\n",
+            content_type="application/x-ndjson", HTTP_X_GATE_API_KEY=GATE_KEY,
+        )
+        self.assertEqual(ingest_load.inflight, 1)
+        response.close()  # the gate went away before reading a line
+        self.assertEqual(ingest_load.inflight, 0)
+
+
+@override_settings(GATE_API_KEY=GATE_KEY)
+class ReconcileTestCase(TestCase):
+    """The reconcile endpoint returns the shared range hashes of the backend's rows."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.t0 = datetime(2026, 1, 10, 9, 0, tzinfo=dt_timezone.utc)
+        self.ids = [uuid.uuid4() for _ in range(3)]
+        events = [_entry_event(entry_id, self.t0 + timedelta(minutes=10 * i)) for i, entry_id in enumerate(self.ids)]
+        self.client.post(SYNC_URL, {"events": events}, format="json", HTTP_X_GATE_API_KEY=GATE_KEY)
+
+    def _reconcile(self, **query):
+        window = [self.t0.isoformat(), (self.t0 + timedelta(hours=1)).isoformat()]
+        return self.client.post(
+            "/api/sync/gate/reconcile", {"kind": "entries", "ranges": [window], **query},
+            format="json", HTTP_X_GATE_API_KEY=GATE_KEY,
+        )
+
+    def test_buckets_and_rows(self):
+        response = self._reconcile(buckets=2)
+        self.assertEqual(response.status_code, 200)
+        buckets = response.json()["buckets"][0]
+        self.assertEqual([b["count"] for b in buckets], [3, 0])
+        self.assertEqual(buckets, bucket_hashes("entries", self.t0, self.t0 + timedelta(hours=1), 2))
+
+        rows = self._reconcile(rows=True).json()["rows"][0]
+        self.assertEqual(set(rows), {str(i) for i in self.ids})
+        self.assertEqual(rows, row_digests("entries", self.t0, self.t0 + timedelta(hours=1)))
+
+        EntryLog.objects.filter(id=self.ids[0]).update(status="EXITED")
+        self.assertNotEqual(self._reconcile(buckets=2).json()["buckets"][0], buckets)
+
+    def test_invalid_query_and_row_limit(self):
+        self.assertEqual(self._reconcile().status_code, 400)  # neither buckets nor rows
+        self.assertEqual(self._reconcile(buckets=2, kind="nope").status_code, 400)
+        with self.settings(SYNC_RECONCILE_MAX_ROWS=2):
+            self.assertEqual(self._reconcile(rows=True).status_code, 413)
+
+
+@override_settings(GATE_API_KEY=GATE_KEY, SYNC_PROCESSED_RETENTION_DAYS=30, SYNC_PROCESSED_PURGE_BATCH_SIZE=2)
+class ProcessedEventRetentionTestCase(TestCase):
+    """Event ids are forgotten after the retention horizon, which every response advertises."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.t0 = datetime(2026, 1, 10, 9, 0, tzinfo=dt_timezone.utc)
+
+    def _post(self, *events):
+        response = self.client.post(
+            SYNC_URL, {"events": list(events)}, format="json", HTTP_X_GATE_API_KEY=GATE_KEY
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_response_advertises_replay_horizon(self):
+        body = self._post(_entry_event(uuid.uuid4(), self.t0))
+        horizon = datetime.fromisoformat(body["replayHorizon"])
+        served = datetime.fromisoformat(body["serverTime"])
+        self.assertAlmostEqual((served - horizon).total_seconds(), 30 * 86400, delta=5)
+
+    def test_expired_ids_are_purged_in_batches(self):
+        events = [_entry_event(uuid.uuid4(), self.t0, roll=f"24MA1{i:04d}") for i in range(5)]
+        self._post(*events)
+        old_ids = [ev["eventId"] for ev in events[:3]]
+        ProcessedGateEvent.objects.filter(event_id__in=old_ids).update(
+            received_at=datetime.now(dt_timezone.utc) - timedelta(days=31)
+        )
+
+        self.assertEqual(purge_expired(dry_run=True)["rows"], 3)
+        self.assertEqual(purge_expired()["rows"], 3)
+        self.assertEqual(
+            set(str(i) for i in ProcessedGateEvent.objects.values_list("event_id", flat=True)),
+            {ev["eventId"] for ev in events[3:]},
+        )
+
+
+@override_settings(GATE_API_KEY=GATE_KEY)
+class DuplicateShortCircuitTestCase(TestCase):
+    """A batch resent after a timeout is acked from known ids: one SELECT at most, no transaction."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.t0 = datetime(2026, 1, 10, 9, 0, tzinfo=dt_timezone.utc)
+        self.events = [_entry_event(uuid.uuid4(), self.t0, roll=f"24MA1{i:04d}") for i in range(20)]
+        recent_event_ids.clear()
+        self.addCleanup(recent_event_ids.clear)
+
+    def _post(self, events):
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                SYNC_URL, {"events": events}, format="json", HTTP_X_GATE_API_KEY=GATE_KEY
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.json()["ackedEventIds"], [q["sql"] for q in ctx.captured_queries]
+
+    def test_resent_batch_costs_one_query(self):
+        self._post(self.events)
+        for bulk in (True, False):
+            recent_event_ids.clear()  # e.g. the retry reached another process
+            with self.subTest(bulk=bulk), self.settings(SYNC_BULK_INGEST=bulk):
+                acked, queries = self._post(self.events)
+                self.assertEqual(len(acked), 20)
+                self.assertEqual(len(queries), 1, queries)
+                self.assertFalse(any("SAVEPOINT" in sql for sql in queries))
+
+    def test_same_process_retry_needs_no_query(self):
+        self._post(self.events)
+        fresh = _entry_event(uuid.uuid4(), self.t0, roll="24MA20000")
+        acked, queries = self._post(self.events)
+        self.assertEqual((len(acked), queries), (20, []))
+
+        acked, _ = self._post(self.events + [fresh])
+        self.assertEqual(len(acked), 21)
+        self.assertTrue(EntryLog.objects.filter(id=fresh["entryId"]).exists())
+
+    def test_lru_is_bounded(self):
+        with self.settings(SYNC_RECENT_EVENT_IDS=5):
+            self._post(self.events)
+            self.assertEqual(len(recent_event_ids._ids), 5)
+
+
+@override_settings(GATE_API_KEY=GATE_KEY)
+class GateCursorTestCase(TestCase):
+    """Per-gate keys, and a seq cursor that acks durable seqs without the idempotency store."""
+
+    KEY = "gate-2-key"
+
+    def setUp(self):
+        self.client = APIClient()
+        self.t0 = datetime(2026, 1, 10, 9, 0, tzinfo=dt_timezone.utc)
+        self.gate = Gate.objects.create(name="gate-2", key_hash=hash_key(self.KEY))
+        self.epoch = str(uuid.uuid4())
+        recent_event_ids.clear()
+        self.addCleanup(recent_event_ids.clear)
+
+    def _events(self, seqs):
+        events = []
+        for seq in seqs:
+            event = _entry_event(uuid.uuid4(), self.t0, roll=f"24MA1{seq:04d}")
+            event["seq"] = seq
+            events.append(event)
+        return events
+
+    def _post(self, events, key=KEY):
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                SYNC_URL, {"events": events}, format="json", HTTP_X_GATE_API_KEY=key, HTTP_X_GATE_EPOCH=self.epoch
+            )
+        return response, [q["sql"] for q in ctx.captured_queries]
+
+    def _cursor(self, **body):
+        response = self.client.post(
+            "/api/sync/gate/cursor", {"epoch": self.epoch, **body}, format="json", HTTP_X_GATE_API_KEY=self.KEY
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_seq_ranges_track_gaps(self):
+        ranges = SeqRanges()
+        self.assertTrue(ranges.add([1, 2, 6, 9], max_gaps=8))
+        self.assertEqual((ranges.high_water, ranges.gaps, ranges.last_contiguous), (9, [[3, 5], [7, 8]], 2))
+        ranges.add([4, 3, 8], max_gaps=8)
+        self.assertEqual(ranges.gaps, [[5, 5], [7, 7]])
+        self.assertFalse(ranges.add([1, 9], max_gaps=8))
+        self.assertEqual([seq for seq in range(11) if seq in ranges], [1, 2, 3, 4, 6, 8, 9])
+
+        ranges.add([12, 15], max_gaps=2)  # gaps 5, 7, 10-11, 13-14: the two oldest are given up
+        self.assertEqual((ranges.floor, ranges.gaps), (8, [[10, 11], [13, 14]]))
+        self.assertNotIn(6, ranges)
+
+    def test_resent_batch_is_acked_by_seq(self):
+        events = self._events(range(1, 21))
+        response, _ = self._post(events)
+        self.assertEqual(len(response.json()["ackedEventIds"]), 20)
+        cursor = self._cursor(headSeq=25)
+        self.assertEqual((cursor["highWaterSeq"], cursor["lastDurableSeq"], cursor["lagEvents"]), (20, 20, 5))
+
+        recent_event_ids.clear()  # e.g. the retry reached another process
+        response, queries = self._post(events)
+        self.assertEqual(len(response.json()["ackedEventIds"]), 20)
+        self.assertEqual(len(queries), 2, queries)  # the key, the cursor
+        self.assertFalse(any("processed_gate_events" in sql for sql in queries))
+
+    def test_out_of_order_batches_and_folded_seqs(self):
+        later = self._events([4, 5])
+        later[1]["foldedSeqs"] = [3]
+        self._post(later)
+        self.assertEqual(self._cursor()["gaps"], [[1, 2]])
+        self._post(self._events([1, 2]))
+        cursor = self._cursor()
+        self.assertEqual((cursor["gaps"], cursor["lastDurableSeq"]), ([], 5))
+
+        # A recreated gate database starts a new epoch, and a new cursor.
+        self.epoch = str(uuid.uuid4())
+        self.assertEqual(self._cursor()["highWaterSeq"], 0)
+
+    def test_keys(self):
+        response, _ = self._post(self._events([1]), key="wrong")
+        self.assertEqual(response.status_code, 403)
+        self.gate.is_active = False
+        self.gate.save()
+        response, _ = self._post(self._events([1]))
+        self.assertEqual(response.status_code, 403)
+        response, _ = self._post(self._events([1]), key=GATE_KEY)  # shared key: ingested, no cursor
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(
+            "/api/sync/gate/cursor", {"epoch": self.epoch}, format="json", HTTP_X_GATE_API_KEY=GATE_KEY
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(GATE_API_KEY=GATE_KEY, SYNC_INGEST_MODE="staged")
+class StagedIngestTestCase(TestCase):
+    """Staged mode acks after one INSERT; the workers store what a direct request would have."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.t0 = datetime(2026, 1, 10, 9, 0, tzinfo=dt_timezone.utc)
+        self.worker = StagedEventsWorker(log=lambda message: None)
+        recent_event_ids.clear()
+        self.addCleanup(recent_event_ids.clear)
+
+    def _post(self, events):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                SYNC_URL, {"events": events}, format="json", HTTP_X_GATE_API_KEY=GATE_KEY
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.json(), [q["sql"] for q in ctx.captured_queries]
+
+    def _apply_all(self):
+        while self.worker.apply_once() is not None:
+            pass
+
+    def test_request_only_queues(self):
+        events = [_entry_event(uuid.uuid4(), self.t0, roll=f"24MA1{i:04d}") for i in range(20)]
+        events.append(_status_event(uuid.uuid4(), "BOGUS", self.t0))
+        body, queries = self._post(events)
+
+        self.assertEqual((len(body["ackedEventIds"]), len(body["rejected"])), (20, 1))
+        self.assertEqual(len(queries), 2, queries)  # known ids, the staging INSERT
+        self.assertEqual(StagedGateEvents.objects.count(), 20)
+        self.assertFalse(EntryLog.objects.exists())
+
+        self._apply_all()
+        self.assertEqual(EntryLog.objects.count(), 20)
+        self.assertFalse(StagedGateEvents.objects.exists())
+        body, _ = self._post(events[:20])  # resent after they were applied: known
+        self.assertEqual(len(body["ackedEventIds"]), 20)
+        self.assertFalse(StagedGateEvents.objects.exists())
+
+    def test_workers_store_what_direct_ingest_does(self):
+        def run(mode):
+            first, second = _mixed_batches(self.t0)
+            with self.settings(SYNC_INGEST_MODE=mode):
+                self._post(first)
+                body, _ = self._post(second)
+            self._apply_all()
+            ids = [ev.get("eventId") if isinstance(ev, dict) else None for ev in second]
+            result = (
+                [ids.index(a) for a in body["ackedEventIds"]],
+                [r["error"] for r in body["rejected"]],
+                sorted((e.roll_id, e.status, e.scanned_at, e.laptop) for e in EntryLog.objects.all()),
+                ExitLog.objects.count(),
+            )
+            ExitLog.objects.all().delete()
+            EntryLog.objects.all().delete()
+            return result
+
+        self.assertEqual(run("staged"), run("direct"))
+
+    def test_snapshot_after_status_fills_placeholder(self):
+        for bulk in (True, False):
+            with self.subTest(bulk=bulk), self.settings(SYNC_BULK_INGEST=bulk):
+                self.worker = StagedEventsWorker(log=lambda message: None)
+                apart, together = uuid.uuid4(), uuid.uuid4()
+                self._post([_status_event(apart, "EXITED", self.t0 + timedelta(hours=3))])
+                self._post([dict(_entry_event(apart, self.t0), entryFlag="FORCED_ENTRY")])
+                self._post([
+                    _status_event(together, "EXITED", self.t0 + timedelta(hours=2), roll="24MA20000"),
+                    _entry_event(together, self.t0, roll="24MA20000"),
+                ])
+                self._apply_all()
+
+                entry = EntryLog.objects.get(id=apart)
+                self.assertEqual(
+                    (entry.status, entry.entry_flag, entry.laptop, entry.scanned_at),
+                    ("EXITED", "FORCED_ENTRY", "Dell", self.t0),
+                )
+                entry = EntryLog.objects.get(id=together)
+                self.assertEqual(
+                    (entry.status, entry.entry_flag, entry.laptop, entry.scanned_at),
+                    ("EXITED", "NORMAL_ENTRY", "Dell", self.t0),
+                )
+
+    def test_roll_order_and_retry(self):
+        entry_id = uuid.uuid4()
+        self._post([_entry_event(entry_id, self.t0)])
+        self._post([_status_event(entry_id, "EXITED", self.t0 + timedelta(hours=1))])
+        self._post([_entry_event(uuid.uuid4(), self.t0, roll="24MA20000")])
+        with transaction.atomic():
+            # The roll's second row waits for its first.
+            self.assertEqual([row.roll for row in _claim(10)], ["24MA10001", "24MA20000"])
+
+        def fail(events):
+            raise OperationalError("database is down")
+
+        self.worker.ingest = fail
+        result = self.worker.apply_once()
+        self.assertEqual((result["rows"], result["error"]), (2, "OperationalError: database is down"))
+        self.assertIsNone(self.worker.apply_once())  # backing off
+        self.assertEqual(set(StagedGateEvents.objects.values_list("attempts", flat=True)), {1, 0})
+
+        StagedGateEvents.objects.update(available_at=self.t0)
+        self.worker.ingest = StagedEventsWorker().ingest
+        self._apply_all()
+        self.assertEqual(EntryLog.objects.get(id=entry_id).status, "EXITED")
+        self.assertFalse(StagedGateEvents.objects.exists())
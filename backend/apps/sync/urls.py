@@ -6,5 +6,8 @@ from . import views
 urlpatterns = [
     # Gate sync endpoint will be defined here
     path("gate/events", views.gate_events, name="gate_events"),
+    path("gate/events/stream", views.gate_events_stream, name="gate_events_stream"),
+    path("gate/reconcile", views.gate_reconcile, name="gate_reconcile"),
+    path("gate/cursor", views.gate_cursor, name="gate_cursor"),
 ]
 
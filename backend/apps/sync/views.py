@@ -1,73 +1,81 @@
-import uuid
-
 from django.conf import settings
-from django.db import IntegrityError, transaction
-from django.db.utils import OperationalError
+from django.http import StreamingHttpResponse
 from django.utils import timezone
-from django.utils.dateparse import parse_datetime
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
-from shared.apps.entries.models import EntryLog
-from shared.apps.entries.models import ExitLog
-from shared.apps.users.models import User
+from core.middleware import NDJSON_CONTENT_TYPE, open_request_stream
 
-from .models import ProcessedGateEvent
+from .models import Gate
+from .services.backpressure import ingest_load
+from .services.event_ingest import ingest_events, ingest_events_one_by_one, stage_events
+from .services.event_stream import ingest_stream
+from .services.gate_cursor import GateSeqCursor, authenticate, parse_epoch, parse_seq, report
+from .services.processed_events import replay_horizon
+from .services.reconcile import TooManyRows, answer, parse_request
+from .services.staged_ingest import is_staged_mode
 
 
-def _require_gate_api_key(request):
+def _authenticate_gate(request):
+    """
+    Returns (gate, None) for a gate's own API key, (None, None) for the shared
+    GATE_API_KEY, or (None, error response).
+    """
     expected = getattr(settings, "GATE_API_KEY", None)
     provided = request.headers.get("X-GATE-API-KEY")
 
-    if not expected:
-        return Response(
-            {"detail": "Server misconfigured: GATE_API_KEY is not set"},
+    if expected and provided == expected:
+        return None, None
+
+    gate = authenticate(provided) if provided else None
+    if gate is not None:
+        return gate, None
+
+    if not expected and not Gate.objects.filter(is_active=True).exists():
+        return None, Response(
+            {"detail": "Server misconfigured: GATE_API_KEY is not set and no gate has a key"},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR,
         )
 
     if not provided:
-        return Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
-
-    if provided != expected:
-        return Response({"detail": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
+        return None, Response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
 
-    return None
+    return None, Response({"detail": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
 
 
-def _parse_dt(val):
-    if not val:
-        return None
-    if hasattr(val, "tzinfo"):
-        # Already a datetime
-        dt = val
-    else:
-        dt = parse_datetime(str(val))
-    if not dt:
+def _seq_cursor(request, gate):
+    """The gate's sequence cursor for this request (None without a gate key or X-Gate-Epoch)."""
+    epoch = parse_epoch(request.headers.get("X-Gate-Epoch"))
+    if gate is None or epoch is None:
         return None
-    if timezone.is_naive(dt):
-        dt = timezone.make_aware(dt, timezone=timezone.utc)
-    return dt
+    return GateSeqCursor(gate, epoch)
 
 
-def _parse_uuid(val):
-    if not val:
-        return None
-    if isinstance(val, uuid.UUID):
-        return val
-    return uuid.UUID(str(val))
+def _ingest_function():
+    """How this process ingests a batch: (events, seq_cursor) -> (acked ids, rejections)."""
+    if is_staged_mode():
+        return stage_events
+    return ingest_events if getattr(settings, "SYNC_BULK_INGEST", True) else ingest_events_one_by_one
 
 
-def _should_apply_ts(existing_ts, incoming_ts):
-    """
-    Returns True if we should apply incoming data to the record.
-    Latest scanned_at wins; if incoming is missing, we don't overwrite.
-    """
-    if incoming_ts is None:
-        return False
-    if existing_ts is None:
-        return True
-    return incoming_ts >= existing_ts
+def _busy_response():
+    retry_after = getattr(settings, "SYNC_RETRY_AFTER_SECONDS", 2)
+    return Response(
+        {"detail": "Sync is busy, retry later"},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+class _IngestSlotResponse(StreamingHttpResponse):
+    """Streaming response that gives back its SYNC_MAX_CONCURRENT_BATCHES slot when closed."""
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            ingest_load.leave(0, 0)
 
 
 @api_view(["POST"])
@@ -77,12 +85,23 @@ def gate_events(request):
 
     Body:
       { "events": [ {eventId, type, ...}, ... ] }
+      (with a gate's own key and X-Gate-Epoch, events may carry "seq" / "foldedSeqs"; see gate_cursor)
+
+    Event types: ENTRY / ENTRY_EXPIRED_SEEN (full entry snapshot), ENTRY_STATUS
+    (compact {entryId, roll, status, ts} transition) and EXIT.
 
     Response:
-      { "ackedEventIds": [...], "rejected": [{eventId, error}], "serverTime": "..." }
+      { "ackedEventIds": [...], "rejected": [{eventId, error}], "serverTime": "...", "replayHorizon": "..." }
+      (events created before replayHorizon must not be sent again: their ids may be forgotten)
+      (+ "suggestedBatchSize" / X-Sync-Batch-Size when smaller batches would be ingested faster)
+
+    503 + Retry-After when too many batches are being ingested already.
+
+    With SYNC_INGEST_MODE = "staged", acked events are queued and applied by
+    `manage.py apply_staged_events` (see staged_ingest).
     """
 
-    auth_resp = _require_gate_api_key(request)
+    gate, auth_resp = _authenticate_gate(request)
     if auth_resp is not None:
         return auth_resp
 
@@ -97,172 +116,162 @@ def gate_events(request):
     max_events = getattr(settings, "SYNC_MAX_EVENTS", 500)
     if len(events) > max_events:
         return Response(
-            {"detail": f"Too many events in one request (max {max_events})"},
+            {"detail": f"Too many events in one request (max {max_events})", "suggestedBatchSize": max_events},
             status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            headers={"X-Sync-Batch-Size": str(max_events)},
         )
 
-    acked = []
-    rejected = []
+    if not ingest_load.try_enter(getattr(settings, "SYNC_MAX_CONCURRENT_BATCHES", 4)):
+        return _busy_response()
 
-    for ev in events:
-        if not isinstance(ev, dict):
-            rejected.append({"eventId": None, "error": "Event must be an object"})
-            continue
+    seq_cursor = _seq_cursor(request, gate)
+    with ingest_load.batch(len(events)):
+        acked, rejected = _ingest_function()(events, seq_cursor)
 
-        raw_event_id = ev.get("eventId")
-        event_type = ev.get("type")
+    body = {
+        "ackedEventIds": acked,
+        "rejected": rejected,
+        "serverTime": timezone.now().isoformat(),
+        "replayHorizon": replay_horizon().isoformat(),
+    }
+    headers = {}
+    suggested = ingest_load.suggested_batch_size(getattr(settings, "SYNC_TARGET_BATCH_MS", 500) / 1000, max_events)
+    if suggested is not None:
+        body["suggestedBatchSize"] = suggested
+        headers["X-Sync-Batch-Size"] = str(suggested)
 
-        if not raw_event_id:
-            rejected.append({"eventId": None, "error": "Missing eventId"})
-            continue
+    return Response(body, status=status.HTTP_200_OK, headers=headers)
 
-        try:
-            event_id = _parse_uuid(raw_event_id)
-        except Exception:
-            rejected.append({"eventId": str(raw_event_id), "error": "Invalid eventId (must be UUID)"})
-            continue
 
-        try:
-            # Transaction boundary per-event:
-            # - inserting ProcessedGateEvent acts as our idempotency "lock"
-            # - if processing fails, we rollback the insert so a retry can succeed later
-            with transaction.atomic():
-                try:
-                    ProcessedGateEvent(event_id=event_id, event_type=event_type or "").save(force_insert=True)
-                except IntegrityError:
-                    acked.append(str(event_id))
-                    continue
-
-                if event_type in ("ENTRY", "ENTRY_EXPIRED_SEEN"):
-                    entry_id = _parse_uuid(ev.get("entryId"))
-                    roll = ev.get("roll")
-                    scanned_at = _parse_dt(ev.get("scannedAt")) or timezone.now()
-                    created_at = _parse_dt(ev.get("createdAt"))
-                    status_val = ev.get("status") or ("EXPIRED" if event_type == "ENTRY_EXPIRED_SEEN" else "ENTERED")
-                    entry_flag = ev.get("entryFlag") or "NORMAL_ENTRY"
-                    laptop = ev.get("laptop")
-                    extra = ev.get("extra") or []
-                    device_meta = ev.get("deviceMeta") or ev.get("deviceMetadata") or {}
-                    device_id = ev.get("deviceId") or None
-                    source = ev.get("source") or None
-                    os_name = ev.get("os") or None
-
-                    if not entry_id or not roll:
-                        raise ValueError("ENTRY requires entryId and roll")
-
-                    if not isinstance(extra, list):
-                        raise ValueError("ENTRY extra must be a list")
-                    if not isinstance(device_meta, dict):
-                        raise ValueError("ENTRY deviceMeta must be an object")
-
-                    user, _ = User.objects.get_or_create(roll=roll)
-
-                    existing = EntryLog.objects.filter(id=entry_id).only("id", "scanned_at").first()
-                    if existing and not _should_apply_ts(existing.scanned_at, scanned_at):
-                        # Older replay; don't overwrite newer data.
-                        pass
-                    else:
-                        defaults = {
-                            "roll": user,
-                            "scanned_at": scanned_at,
-                            "status": status_val,
-                            "entry_flag": entry_flag,
-                            "laptop": laptop,
-                            "extra": extra,
-                            "source": source,
-                            "os": os_name,
-                            "device_id": device_id,
-                            "device_meta": device_meta,
-                        }
-                        obj, created = EntryLog.objects.update_or_create(
-                            id=entry_id,
-                            defaults=defaults,
-                        )
-                        # Apply created_at after save (bypasses auto_now_add)
-                        if created_at:
-                            EntryLog.objects.filter(id=entry_id).update(created_at=created_at)
-
-                elif event_type == "EXIT":
-                    exit_id = _parse_uuid(ev.get("exitId"))
-                    entry_id = ev.get("entryId")
-                    roll = ev.get("roll")
-                    scanned_at = _parse_dt(ev.get("scannedAt")) or timezone.now()
-                    created_at = _parse_dt(ev.get("createdAt"))
-                    exit_flag = ev.get("exitFlag") or "NORMAL_EXIT"
-                    laptop = ev.get("laptop")
-                    extra = ev.get("extra") or []
-                    device_meta = ev.get("deviceMeta") or ev.get("deviceMetadata") or {}
-                    device_id = ev.get("deviceId") or None
-                    source = ev.get("source") or None
-                    os_name = ev.get("os") or None
-
-                    if not exit_id or not roll:
-                        raise ValueError("EXIT requires exitId and roll")
-
-                    if not isinstance(extra, list):
-                        raise ValueError("EXIT extra must be a list")
-                    if not isinstance(device_meta, dict):
-                        raise ValueError("EXIT deviceMeta must be an object")
-
-                    user, _ = User.objects.get_or_create(roll=roll)
-                    entry_obj = None
-                    if entry_id:
-                        entry_uuid = _parse_uuid(entry_id)
-                        if entry_uuid:
-                            entry_obj, _ = EntryLog.objects.get_or_create(
-                                id=entry_uuid,
-                                defaults={"roll": user, "status": "PENDING"},
-                            )
-
-                    existing = ExitLog.objects.filter(id=exit_id).only("id", "scanned_at").first()
-                    if existing and not _should_apply_ts(existing.scanned_at, scanned_at):
-                        pass
-                    else:
-                        defaults = {
-                            "roll": user,
-                            "entry_id": entry_obj,
-                            "scanned_at": scanned_at,
-                            "exit_flag": exit_flag,
-                            "laptop": laptop,
-                            "extra": extra,
-                            "device_meta": device_meta,
-                            "device_id": device_id,
-                            "source": source,
-                            "os": os_name,
-                        }
-                        obj, created = ExitLog.objects.update_or_create(
-                            id=exit_id,
-                            defaults=defaults,
-                        )
-                        # Apply created_at after save (bypasses auto_now_add)
-                        if created_at:
-                            ExitLog.objects.filter(id=exit_id).update(created_at=created_at)
-
-                else:
-                    raise ValueError(f"Unknown event type: {event_type}")
-
-            acked.append(str(event_id))
-        except (ValueError, TypeError, IntegrityError) as e:
-            # 1) LOGIC ERRORS (Client fault):
-            # The data is invalid or duplicate. Reject it safely.
-            rejected.append({"eventId": str(raw_event_id), "error": str(e)})
-        except OperationalError:
-            # 2) SYSTEM ERRORS (Server fault):
-            # DB is down or locked. Do NOT catch this.
-            # Let it raise 500 so the client retries later.
-            raise
-        except Exception as e:
-            # 3) UNEXPECTED ERRORS:
-            # Safer to crash and retry than to silently lose data.
-            print(f"Critical sync error on event {raw_event_id}: {e}")
-            raise
+@api_view(["POST"])
+def gate_events_stream(request):
+    """
+    Streaming Gate -> Backend sync endpoint (API-key protected).
 
-    return Response(
-        {
-            "ackedEventIds": acked,
-            "rejected": rejected,
-            "serverTime": timezone.now().isoformat(),
-        },
-        status=status.HTTP_200_OK,
+    Body (Content-Type: application/x-ndjson, optionally gzip/zstd encoded):
+      one event per line, the same events as gate_events, any number of them
+
+    Response (application/x-ndjson), one line per committed micro-batch of
+    SYNC_STREAM_BATCH_SIZE events, written as soon as it commits:
+      { "ackedEventIds": [...], "rejected": [{eventId, error}] }
+    then { "done": true, "events": n, "acked": n, "rejected": n, "serverTime": "...", "replayHorizon": "..." },
+    or { "error": "..." } if the body could not be read to the end.
+
+    The stream takes one of the SYNC_MAX_CONCURRENT_BATCHES slots until it ends
+    (503 + Retry-After when none is free). In staged mode an ack line means the
+    micro-batch was queued, as with gate_events.
+    """
+
+    gate, auth_resp = _authenticate_gate(request)
+    if auth_resp is not None:
+        return auth_resp
+
+    django_request = request._request
+    if django_request.content_type != NDJSON_CONTENT_TYPE:
+        return Response(
+            {"detail": f"Content-Type must be {NDJSON_CONTENT_TYPE}"},
+            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        )
+    if "CONTENT_LENGTH" not in django_request.META and not django_request.META.get("wsgi.input_terminated"):
+        # The server hands chunked bodies to Django as empty; make the gate send a length instead.
+        return Response(
+            {"detail": "Chunked request bodies are not supported by this server; send Content-Length"},
+            status=status.HTTP_411_LENGTH_REQUIRED,
+        )
+    body = open_request_stream(django_request)
+    if body is None:
+        return Response(
+            {"detail": f"Unsupported Content-Encoding: {django_request.META.get('HTTP_CONTENT_ENCODING')}"},
+            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        )
+
+    if not ingest_load.try_enter(getattr(settings, "SYNC_MAX_CONCURRENT_BATCHES", 4)):
+        return _busy_response()
+
+    ingest = _ingest_function()
+    seq_cursor = _seq_cursor(request, gate)
+    # The slot is released when the response is closed, also if the gate disconnects mid-stream.
+    response = _IngestSlotResponse(
+        ingest_stream(
+            body,
+            lambda events: ingest(events, seq_cursor),
+            batch_size=getattr(settings, "SYNC_STREAM_BATCH_SIZE", 100),
+            on_batch=ingest_load.record,
+        ),
+        content_type=NDJSON_CONTENT_TYPE,
     )
+    response["X-Accel-Buffering"] = "no"  # let each ack line through a buffering proxy (nginx) right away
+    return response
+
+
+@api_view(["POST"])
+def gate_reconcile(request):
+    """
+    Range-hash reconciliation for the gate (API-key protected).
+
+    Body:
+      { "kind": "entries" | "exits", "ranges": [[start, end], ...], "buckets": 16, "roll": optional }
+      or with "rows": true instead of "buckets" for per-row digests
+
+    Response:
+      { "buckets": [[{count, hash}, ...] per range] }  or  { "rows": [{id: digest} per range] }
+
+    413 when "rows" would return more than SYNC_RECONCILE_MAX_ROWS digests.
+    """
+
+    _, auth_resp = _authenticate_gate(request)
+    if auth_resp is not None:
+        return auth_resp
+
+    try:
+        query = parse_request(request.data)
+    except ValueError as e:
+        return Response({"detail": f"Invalid payload: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    max_rows = getattr(settings, "SYNC_RECONCILE_MAX_ROWS", 5000)
+    try:
+        body = answer(query, max_rows)
+    except TooManyRows:
+        return Response(
+            {"detail": f"Too many rows in the requested ranges (max {max_rows}); ask for buckets instead"},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+    return Response(body, status=status.HTTP_200_OK)
+
+
+@api_view(["POST"])
+def gate_cursor(request):
+    """
+    The calling gate's sequence cursor (needs the gate's own API key).
+
+    Body:
+      { "epoch": "<uuid>", "headSeq": 1234 }   (headSeq: the gate's newest seq, optional)
+
+    Response:
+      { "gate", "epoch", "floorSeq", "highWaterSeq", "lastDurableSeq", "gaps": [[start, end], ...],
+        "headSeq", "lagEvents", "missingSeqs", "advancedAt", "headReportedAt", "serverTime" }
+      (seqs floorSeq..highWaterSeq outside the gaps are durable; a new epoch starts an empty cursor)
+    """
+
+    gate, auth_resp = _authenticate_gate(request)
+    if auth_resp is not None:
+        return auth_resp
+    if gate is None:
+        return Response(
+            {"detail": "The shared GATE_API_KEY has no cursor; use a per-gate key (manage.py gate_keys add)"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    data = request.data or {}
+    epoch = parse_epoch(data.get("epoch"))
+    if epoch is None:
+        return Response({"detail": "Invalid payload: 'epoch' must be a UUID"}, status=status.HTTP_400_BAD_REQUEST)
+    head_seq = data.get("headSeq")
+    if head_seq is not None and parse_seq(head_seq) is None:
+        return Response(
+            {"detail": "Invalid payload: 'headSeq' must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST
+        )
 
+    body = report(gate, epoch, head_seq)
+    body["serverTime"] = timezone.now().isoformat()
+    return Response(body, status=status.HTTP_200_OK)
@@ -55,6 +55,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.RequestDecompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -128,9 +129,40 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [],
 }
 
-# Gate sync (single gate + single backend) API key
+# Gate sync: shared API key (single gate, no cursor); gates can also have their own keys (manage.py gate_keys)
 GATE_API_KEY = os.environ.get("GATE_API_KEY")
+# Per-gate sequence cursors: gap ranges kept below the high-water mark before the oldest are given up
+SYNC_GATE_MAX_GAPS = int(os.environ.get("SYNC_GATE_MAX_GAPS", "256"))
 SYNC_MAX_EVENTS = int(os.environ.get("SYNC_MAX_EVENTS", "500"))
+# Set-based batch ingest (0 = process events one at a time)
+SYNC_BULK_INGEST = os.environ.get("SYNC_BULK_INGEST", "1") == "1"
+# "direct" applies sync batches in the request; "staged" only queues them (one INSERT) and acks,
+# and `manage.py apply_staged_events` applies them: worker processes, rows (one per roll) claimed
+# per transaction, idle poll interval, first retry delay after a failed apply (doubled per attempt)
+SYNC_INGEST_MODE = os.environ.get("SYNC_INGEST_MODE", "direct")
+SYNC_STAGED_WORKERS = int(os.environ.get("SYNC_STAGED_WORKERS", "2"))
+SYNC_STAGED_CLAIM_ROWS = int(os.environ.get("SYNC_STAGED_CLAIM_ROWS", "100"))
+SYNC_STAGED_POLL_MS = int(os.environ.get("SYNC_STAGED_POLL_MS", "500"))
+SYNC_STAGED_RETRY_SECONDS = int(os.environ.get("SYNC_STAGED_RETRY_SECONDS", "5"))
+# Backpressure (per process): 503 + Retry-After above this many concurrent sync batches (0 = no limit),
+# and suggest smaller batches to gates when a full one takes longer than SYNC_TARGET_BATCH_MS to ingest
+SYNC_MAX_CONCURRENT_BATCHES = int(os.environ.get("SYNC_MAX_CONCURRENT_BATCHES", "4"))
+SYNC_RETRY_AFTER_SECONDS = int(os.environ.get("SYNC_RETRY_AFTER_SECONDS", "2"))
+SYNC_TARGET_BATCH_MS = int(os.environ.get("SYNC_TARGET_BATCH_MS", "500"))
+# Streaming sync (gate/events/stream): events per committed micro-batch, i.e. per ack line
+SYNC_STREAM_BATCH_SIZE = int(os.environ.get("SYNC_STREAM_BATCH_SIZE", "100"))
+# Range-hash reconciliation (gate/reconcile): most row digests returned by one request
+SYNC_RECONCILE_MAX_ROWS = int(os.environ.get("SYNC_RECONCILE_MAX_ROWS", "5000"))
+# Idempotency store (processed_gate_events): days an event id is remembered (gates stop replaying
+# events before then), partition width and partitions created ahead (Postgres), delete batch (others)
+SYNC_PROCESSED_RETENTION_DAYS = int(os.environ.get("SYNC_PROCESSED_RETENTION_DAYS", "30"))
+SYNC_PROCESSED_PARTITION_DAYS = int(os.environ.get("SYNC_PROCESSED_PARTITION_DAYS", "1"))
+SYNC_PROCESSED_PARTITIONS_AHEAD = int(os.environ.get("SYNC_PROCESSED_PARTITIONS_AHEAD", "3"))
+SYNC_PROCESSED_PURGE_BATCH_SIZE = int(os.environ.get("SYNC_PROCESSED_PURGE_BATCH_SIZE", "5000"))
+# Recently processed event ids kept per process to ack resent batches without a transaction
+# (0 = off), and an optional CACHES alias (e.g. Redis) to share them between processes
+SYNC_RECENT_EVENT_IDS = int(os.environ.get("SYNC_RECENT_EVENT_IDS", "50000"))
+SYNC_RECENT_EVENT_IDS_CACHE = os.environ.get("SYNC_RECENT_EVENT_IDS_CACHE", "")
 
 # Cache configuration (in-memory for summary API)
 CACHES = {
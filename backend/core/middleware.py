@@ -2,12 +2,78 @@
 Custom middleware for the PALE application.
 """
 
+import gzip
+import io
 import logging
+import zlib
+
+from django.conf import settings
+from django.http import JsonResponse
 from django.utils.deprecation import MiddlewareMixin
 
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    zstd = None
+
 logger = logging.getLogger(__name__)
 
 
+class _BodyTooLarge(Exception):
+    pass
+
+
+def _gunzip(data, limit):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if limit is None:
+        return decompressor.decompress(data) + decompressor.flush()
+    body = decompressor.decompress(data, limit + 1)
+    if len(body) > limit or decompressor.unconsumed_tail:
+        raise _BodyTooLarge
+    return body
+
+
+def _unzstd(data, limit):
+    if limit is None:
+        return zstd.decompress(data)
+    decompressor = zstd.ZstdDecompressor()
+    body = decompressor.decompress(data, max_length=limit + 1)
+    if len(body) > limit or not decompressor.needs_input:
+        raise _BodyTooLarge
+    return body
+
+
+REQUEST_DECODERS = {"gzip": _gunzip}
+if zstd is not None:
+    REQUEST_DECODERS["zstd"] = _unzstd
+
+# Streamed bodies (the NDJSON sync stream) are decoded while they are read.
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+STREAM_DECODERS = {"gzip": lambda stream: gzip.GzipFile(fileobj=stream, mode="rb")}
+if zstd is not None:
+    STREAM_DECODERS["zstd"] = lambda stream: zstd.ZstdFile(stream, mode="rb")
+
+
+def open_request_stream(request):
+    """
+    File-like (decompressed) body of a streamed request, read incrementally.
+
+    Chunked bodies are only readable when the server decodes them and marks
+    wsgi.input as terminated (gunicorn, uWSGI); Django otherwise reads a body
+    without Content-Length as empty. Returns None for an unsupported
+    Content-Encoding.
+    """
+    stream = request._stream
+    if "CONTENT_LENGTH" not in request.META and request.META.get("wsgi.input_terminated"):
+        stream = request.META["wsgi.input"]
+    encoding = request.META.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+    if not encoding or encoding == "identity":
+        return stream
+    decoder = STREAM_DECODERS.get(encoding)
+    return decoder(stream) if decoder is not None else None
+
+
 class RequestLoggingMiddleware(MiddlewareMixin):
     """
     Middleware to log incoming requests and responses.
@@ -43,3 +109,38 @@ class ConcurrentRequestMiddleware(MiddlewareMixin):
         # Can be extended with Redis-based locking or rate limiting
         return None
 
+
+class RequestDecompressionMiddleware(MiddlewareMixin):
+    """
+    Decompress request bodies sent with Content-Encoding (gzip; zstd on Python 3.14+).
+
+    The gate sync client compresses event batches. The decompressed size is
+    capped at DATA_UPLOAD_MAX_MEMORY_SIZE so a small payload can't expand
+    into an unbounded body. NDJSON streams are left alone: their view reads
+    them through open_request_stream, one line at a time.
+    """
+
+    def process_request(self, request):
+        encoding = request.META.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+        if not encoding or encoding == "identity":
+            return None
+        if request.content_type == NDJSON_CONTENT_TYPE:
+            return None
+
+        decoder = REQUEST_DECODERS.get(encoding)
+        if decoder is None:
+            return JsonResponse({"detail": f"Unsupported Content-Encoding: {encoding}"}, status=415)
+
+        try:
+            body = decoder(request.body, settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+        except _BodyTooLarge:
+            return JsonResponse({"detail": "Request body too large after decompression"}, status=413)
+        except (zlib.error, EOFError, ValueError) as e:
+            return JsonResponse({"detail": f"Invalid {encoding} request body: {e}"}, status=400)
+
+        # Downstream parsers (DRF) read the decompressed body as if it had been sent plain.
+        request._body = body
+        request._stream = io.BytesIO(body)
+        request.META["CONTENT_LENGTH"] = str(len(body))
+        del request.META["HTTP_CONTENT_ENCODING"]
+        return None
@@ -41,4 +41,68 @@ BACKEND_SYNC_URL = os.environ.get("BACKEND_SYNC_URL", "").strip()
 GATE_API_KEY = os.environ.get("GATE_API_KEY", "").strip()
 SYNC_BATCH_SIZE = int(os.environ.get("SYNC_BATCH_SIZE", "200"))
 SYNC_INTERVAL_SECONDS = int(os.environ.get("SYNC_INTERVAL_SECONDS", "5"))
-SYNC_TIMEOUT_SECONDS = int(os.environ.get("SYNC_TIMEOUT_SECONDS", "10"))
\ No newline at end of file
+SYNC_TIMEOUT_SECONDS = int(os.environ.get("SYNC_TIMEOUT_SECONDS", "10"))
+# Adaptive batch size (AIMD): grow while batches are acked within SYNC_TARGET_RTT_MS, halve on slow/failed
+# batches; SYNC_BATCH_SIZE is the starting size. Keep SYNC_BATCH_MAX <= the backend's SYNC_MAX_EVENTS.
+SYNC_ADAPTIVE_BATCH = os.environ.get("SYNC_ADAPTIVE_BATCH", "1") == "1"
+SYNC_BATCH_MIN = int(os.environ.get("SYNC_BATCH_MIN", "20"))
+SYNC_BATCH_MAX = int(os.environ.get("SYNC_BATCH_MAX", "500"))
+SYNC_TARGET_RTT_MS = int(os.environ.get("SYNC_TARGET_RTT_MS", "1000"))
+# Concurrent in-flight batches while draining; events are partitioned by roll so each roll stays in order.
+SYNC_INFLIGHT_BATCHES = int(os.environ.get("SYNC_INFLIGHT_BATCHES", "4"))
+# Postgres: wake sync on NOTIFY from the outbox trigger; poll only every SYNC_NOTIFY_FALLBACK_SECONDS as a fallback.
+SYNC_LISTEN = os.environ.get("SYNC_LISTEN", "1") == "1"
+SYNC_NOTIFY_DEBOUNCE_MS = int(os.environ.get("SYNC_NOTIFY_DEBOUNCE_MS", "50"))
+SYNC_NOTIFY_FALLBACK_SECONDS = int(os.environ.get("SYNC_NOTIFY_FALLBACK_SECONDS", "60"))
+# Fold superseded events of one entry (snapshot + status changes) into one event per batch
+SYNC_COALESCE = os.environ.get("SYNC_COALESCE", "1") == "1"
+# Request body compression for sync batches: gzip | zstd (Python 3.14+) | none. Small batches go uncompressed.
+SYNC_COMPRESSION = os.environ.get("SYNC_COMPRESSION", "gzip").strip().lower()
+SYNC_COMPRESS_MIN_BYTES = int(os.environ.get("SYNC_COMPRESS_MIN_BYTES", "1024"))
+# sync_to_backend --stream: events per NDJSON request to BACKEND_SYNC_URL + "/stream"
+SYNC_STREAM_MAX_EVENTS = int(os.environ.get("SYNC_STREAM_MAX_EVENTS", "50000"))
+# Outbox events older than this are expired instead of sent (0 = off); keep it below the backend's
+# SYNC_PROCESSED_RETENTION_DAYS, after which the backend no longer recognizes a replayed event id
+SYNC_REPLAY_HORIZON_DAYS = int(os.environ.get("SYNC_REPLAY_HORIZON_DAYS", "28"))
+# Ask the backend for this gate's seq cursor (needs a per-gate GATE_API_KEY) when sync_to_backend starts
+# and after each drained backlog: reports the lag and skips events the backend already has
+SYNC_REPORT_CURSOR = os.environ.get("SYNC_REPORT_CURSOR", "1") == "1"
+# repair_sync_full: concurrent replay requests, and where an interrupted repair keeps its position (--resume)
+REPAIR_WORKERS = int(os.environ.get("REPAIR_WORKERS", "4"))
+REPAIR_CHECKPOINT_PATH = os.environ.get("REPAIR_CHECKPOINT_PATH", str(BASE_DIR / "data" / "repair-checkpoint.json")).strip()
+# reconcile_sync: default window, buckets per range, and rows per bucket below which rows are compared one by one
+RECONCILE_DAYS = int(os.environ.get("RECONCILE_DAYS", "30"))
+RECONCILE_FANOUT = int(os.environ.get("RECONCILE_FANOUT", "16"))
+RECONCILE_LEAF_ROWS = int(os.environ.get("RECONCILE_LEAF_ROWS", "64"))
+
+# Warm scan service (scan_server) socket, and seconds a client may take to send its request
+SCAN_SOCKET_PATH = os.environ.get("SCAN_SOCKET_PATH", "/tmp/pale-gate-scan.sock")
+SCAN_REQUEST_TIMEOUT_SECONDS = int(os.environ.get("SCAN_REQUEST_TIMEOUT_SECONDS", "5"))
+# Threads serving scans concurrently (about one per lane), each with its own DB connection
+SCAN_SERVER_WORKERS = int(os.environ.get("SCAN_SERVER_WORKERS", "4"))
+
+# scan_server --index: resident open-entry index (single-writer gate only)
+OPEN_ENTRY_INDEX_WINDOW_HOURS = int(os.environ.get("OPEN_ENTRY_INDEX_WINDOW_HOURS", "48"))
+OPEN_ENTRY_INDEX_VERIFY_SECONDS = int(os.environ.get("OPEN_ENTRY_INDEX_VERIFY_SECONDS", "300"))
+
+# Per-stage scan latency stats (process_token / scan_server -> scan_stats). Empty path disables.
+SCAN_STATS_PATH = os.environ.get("SCAN_STATS_PATH", "/tmp/pale-gate-scan-stats.json").strip()
+SCAN_STATS_FLUSH_SECONDS = int(os.environ.get("SCAN_STATS_FLUSH_SECONDS", "10"))
+
+# Identifies this gate in deviceMeta["gateDeviceId"] (a per-lane id from watch_qr.py takes precedence)
+GATE_DEVICE_ID = os.environ.get("GATE_DEVICE_ID", "").strip() or None
+
+# scan_server --write-behind: journal scans locally, group-commit them to the DB in the background.
+# Keep the journal on persistent storage (not tmpfs): until committed it is the only copy of a scan.
+WRITE_BEHIND_JOURNAL_PATH = os.environ.get("WRITE_BEHIND_JOURNAL_PATH", str(BASE_DIR / "data" / "scan-journal.jsonl"))
+WRITE_BEHIND_FSYNC = os.environ.get("WRITE_BEHIND_FSYNC", "1") == "1"
+WRITE_BEHIND_COMMIT_MS = int(os.environ.get("WRITE_BEHIND_COMMIT_MS", "20"))
+WRITE_BEHIND_MAX_BATCH = int(os.environ.get("WRITE_BEHIND_MAX_BATCH", "500"))
+
+# compact_outbox: sent outbox events are archived (gzip JSONL; empty dir = just delete) and
+# deleted after OUTBOX_RETENTION_DAYS, in batches; table/index sizes are appended to the history file.
+OUTBOX_RETENTION_DAYS = int(os.environ.get("OUTBOX_RETENTION_DAYS", "7"))
+OUTBOX_ARCHIVE_DIR = os.environ.get("OUTBOX_ARCHIVE_DIR", str(BASE_DIR / "data" / "outbox-archive")).strip()
+OUTBOX_PURGE_BATCH_SIZE = int(os.environ.get("OUTBOX_PURGE_BATCH_SIZE", "500"))
+OUTBOX_PURGE_PAUSE_MS = int(os.environ.get("OUTBOX_PURGE_PAUSE_MS", "20"))
+OUTBOX_SIZE_HISTORY_PATH = os.environ.get("OUTBOX_SIZE_HISTORY_PATH", str(BASE_DIR / "data" / "outbox-size.jsonl")).strip()
@@ -2,7 +2,7 @@
 Midnight auto-exit management command.
 
 This command closes stale ENTERED entries by creating AUTO_EXIT logs
-and emitting sync events. Run daily at 00:05 via cron/scheduler.
+and emitting sync events (EXIT + ENTRY_STATUS). Run daily at 00:05 via cron/scheduler.
 
 Usage:
     python manage.py auto_exit_midnight
@@ -17,6 +17,7 @@ from django.utils import timezone
 
 from shared.apps.entries.models import EntryLog, ExitLog
 from scanner.models import OutboxEvent
+from scanner.services.scan_service import entry_status_event
 
 
 class Command(BaseCommand):
@@ -102,21 +103,8 @@ class Command(BaseCommand):
                 entry.scanned_at = ts
                 entry.save(update_fields=["status", "scanned_at"])
 
-                # Emit ENTRY_EXPIRED_SEEN event for sync
-                OutboxEvent.objects.create(
-                    event_type="ENTRY_EXPIRED_SEEN",
-                    payload={
-                        "eventId": None,
-                        "type": "ENTRY_EXPIRED_SEEN",
-                        "entryId": str(entry.id),
-                        "roll": entry.roll_id,
-                        "scannedAt": ts.isoformat(),
-                        "status": "EXPIRED",
-                        "entryFlag": entry.entry_flag,
-                        "laptop": entry.laptop,
-                        "extra": entry.extra or [],
-                    },
-                )
+                # Emit compact ENTRY_STATUS event for sync (the entry snapshot was sent at creation)
+                entry_status_event(entry.id, entry.roll_id, "EXPIRED", ts).save()
 
                 exits_created += 1
                 entries_expired += 1
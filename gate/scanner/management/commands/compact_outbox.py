@@ -0,0 +1,115 @@
+"""
+Outbox retention: archive and delete sent outbox events, report outbox size.
+
+Sent rows older than OUTBOX_RETENTION_DAYS are appended to a gzip JSONL file
+in OUTBOX_ARCHIVE_DIR and deleted in small batches; unsent rows are kept.
+Every run records the table/index size to OUTBOX_SIZE_HISTORY_PATH and prints
+the recent history. Run daily via cron/scheduler (e.g. after auto_exit_midnight).
+
+Usage:
+    python manage.py compact_outbox
+    python manage.py compact_outbox --days 30 --no-archive
+    python manage.py compact_outbox --dry-run
+    python manage.py compact_outbox --report      # size history only
+    python manage.py compact_outbox --vacuum      # Postgres: VACUUM (ANALYZE) afterwards
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from scanner.models import OutboxEvent
+from scanner.services.outbox_retention import (
+    OutboxArchive,
+    append_size_history,
+    outbox_size,
+    purge_sent_events,
+    read_size_history,
+)
+
+
+def _kb(value) -> str:
+    return "-" if value is None else f"{value / 1024:.0f}kB"
+
+
+class Command(BaseCommand):
+    help = "Archive and delete sent outbox events older than the retention window; report outbox size."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None, help="Override OUTBOX_RETENTION_DAYS.")
+        parser.add_argument("--batch-size", type=int, default=None, help="Override OUTBOX_PURGE_BATCH_SIZE.")
+        parser.add_argument(
+            "--pause-ms",
+            type=int,
+            default=None,
+            help="Pause between delete batches. Override OUTBOX_PURGE_PAUSE_MS.",
+        )
+        parser.add_argument("--archive-dir", default=None, help="Override OUTBOX_ARCHIVE_DIR.")
+        parser.add_argument("--no-archive", action="store_true", help="Delete without writing an archive file.")
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be purged.")
+        parser.add_argument("--report", action="store_true", help="Only record and show the size history.")
+        parser.add_argument("--vacuum", action="store_true", help="Postgres: VACUUM (ANALYZE) the outbox afterwards.")
+
+    def handle(self, *args, **options):
+        days = options.get("days")
+        if days is None:
+            days = getattr(settings, "OUTBOX_RETENTION_DAYS", 7)
+        if days < 0:
+            raise CommandError("--days must be >= 0")
+        batch_size = int(options.get("batch_size") or getattr(settings, "OUTBOX_PURGE_BATCH_SIZE", 500))
+        pause_ms = options.get("pause_ms")
+        if pause_ms is None:
+            pause_ms = getattr(settings, "OUTBOX_PURGE_PAUSE_MS", 20)
+        archive_dir = options.get("archive_dir") or getattr(settings, "OUTBOX_ARCHIVE_DIR", "")
+        history_path = getattr(settings, "OUTBOX_SIZE_HISTORY_PATH", "")
+
+        if not options.get("report"):
+            cutoff = timezone.now() - timedelta(days=days)
+            if options.get("dry_run"):
+                count = OutboxEvent.objects.filter(sent_at__lt=cutoff).count()
+                self.stdout.write(f"compact_outbox: {count} sent events older than {days}d would be purged (DRY RUN)")
+                return
+
+            archive = None
+            if archive_dir and not options.get("no_archive"):
+                archive = OutboxArchive(archive_dir)
+            try:
+                purged = purge_sent_events(cutoff, batch_size=batch_size, archive=archive, pause_s=pause_ms / 1000)
+            finally:
+                if archive is not None:
+                    archive.close()
+
+            msg = f"compact_outbox: purged {purged} sent events older than {days}d"
+            if archive is not None:
+                msg += f", archived to {archive.path}" if archive.rows else " (nothing to archive)"
+            self.stdout.write(self.style.SUCCESS(msg))
+
+            if options.get("vacuum"):
+                if connection.vendor == "postgresql":
+                    with connection.cursor() as cursor:
+                        cursor.execute(f"VACUUM (ANALYZE) {connection.ops.quote_name(OutboxEvent._meta.db_table)}")
+                    self.stdout.write("compact_outbox: vacuumed")
+                else:
+                    self.stdout.write("compact_outbox: --vacuum only applies to Postgres, skipped")
+
+        report = outbox_size()
+        if history_path:
+            append_size_history(history_path, report)
+            history = read_size_history(history_path)
+        else:
+            history = [report]
+
+        self.stdout.write(
+            f"{'measured at':<20} {'rows':>9} {'unsent':>8} {'table':>10} {'indexes':>10} {'dead rows':>10}"
+        )
+        for entry in history:
+            self.stdout.write(
+                f"{entry['at'][:19].replace('T', ' '):<20} {entry['rows']:>9} {entry['unsent']:>8} "
+                f"{_kb(entry.get('tableBytes')):>10} {_kb(entry.get('indexBytes')):>10} "
+                f"{entry.get('deadRows') if entry.get('deadRows') is not None else '-':>10}"
+            )
+        for name, size in sorted(report["indexes"].items()):
+            self.stdout.write(f"  index {name}: {_kb(size)}")
@@ -0,0 +1,134 @@
+"""
+Reconcile gate and backend EntryLog/ExitLog by range hashes; re-send only rows that differ.
+
+Both sides hash created_at buckets of the window; differing buckets are split
+until they are small enough to compare row by row (see
+scanner.services.reconcile). Rows missing on the backend or different there
+are re-sent as sync events; rows only the backend has are reported.
+
+Re-sent events get an eventId derived from the row id and its digest: the
+backend has already processed the row's original (id-based) event, and would
+ack it again without applying it. A given row state still maps to one eventId.
+
+Usage:
+    python manage.py reconcile_sync                     # last RECONCILE_DAYS days
+    python manage.py reconcile_sync --days 7 --dry-run
+    python manage.py reconcile_sync --since 2026-01-01T00:00:00Z --until 2026-02-01T00:00:00Z
+    python manage.py reconcile_sync --kind exits --roll 24MA10001
+"""
+
+import http.client
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from shared.apps.entries.models import EntryLog, ExitLog
+from scanner.services.reconcile import RangeReconciler
+from scanner.services.repair_replay import entry_event, exit_event
+from scanner.services.sync_client import SyncHTTPError, sync_client_from_settings
+
+
+KINDS = {
+    "entries": (EntryLog, entry_event),
+    "exits": (ExitLog, exit_event),
+}
+
+
+def _parse_dt(val: str | None):
+    if not val:
+        return None
+    dt = parse_datetime(val)
+    if not dt:
+        raise CommandError(f"Invalid datetime: {val} (expected ISO-8601)")
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt, timezone=timezone.utc)
+    return dt
+
+
+def _kb(n: int) -> str:
+    return f"{n / 1024:.1f}kB"
+
+
+class Command(BaseCommand):
+    help = "Compare gate and backend logs by range hashes and re-send only the rows that differ."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None, help="Window ending now. Override RECONCILE_DAYS.")
+        parser.add_argument("--since", default=None, help="ISO datetime window start (created_at); overrides --days.")
+        parser.add_argument("--until", default=None, help="ISO datetime window end (created_at). Default: now.")
+        parser.add_argument("--roll", default=None, help="Limit to a single roll number.")
+        parser.add_argument("--kind", choices=["entries", "exits", "all"], default="all", help="Which logs to compare.")
+        parser.add_argument("--fanout", type=int, default=None, help="Buckets per range. Override RECONCILE_FANOUT.")
+        parser.add_argument(
+            "--leaf-rows",
+            type=int,
+            default=None,
+            help="Compare row by row below this many rows per bucket. Override RECONCILE_LEAF_ROWS.",
+        )
+        parser.add_argument("--batch-size", type=int, default=None, help="Override SYNC_BATCH_SIZE for re-sending.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report differing rows; don't re-send.")
+
+    def handle(self, *args, **options):
+        if not getattr(settings, "BACKEND_SYNC_URL", ""):
+            raise CommandError("BACKEND_SYNC_URL is not set")
+        if not getattr(settings, "GATE_API_KEY", ""):
+            raise CommandError("GATE_API_KEY is not set")
+
+        until = _parse_dt(options.get("until")) or timezone.now()
+        days = options.get("days")
+        if days is None:
+            days = getattr(settings, "RECONCILE_DAYS", 30)
+        since = _parse_dt(options.get("since")) or until - timedelta(days=days)
+        if since >= until:
+            raise CommandError("The window is empty (--since must be before --until)")
+        roll = options.get("roll")
+        fanout = int(options.get("fanout") or getattr(settings, "RECONCILE_FANOUT", 16))
+        leaf_rows = int(options.get("leaf_rows") or getattr(settings, "RECONCILE_LEAF_ROWS", 64))
+        batch_size = int(options.get("batch_size") or getattr(settings, "SYNC_BATCH_SIZE", 200))
+        kinds = ["entries", "exits"] if options["kind"] == "all" else [options["kind"]]
+
+        try:
+            client = sync_client_from_settings()
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"reconcile: {since.isoformat()} .. {until.isoformat()} (fanout={fanout}, leaf={leaf_rows})")
+        try:
+            for kind in kinds:
+                model, to_event = KINDS[kind]
+                sent_before, received_before = client.sent_bytes, client.received_bytes
+                result = RangeReconciler(client, kind, fanout=fanout, leaf_rows=leaf_rows, roll=roll).run(since, until)
+                self.stdout.write(
+                    f"reconcile {kind}: {result.buckets_differing}/{result.buckets_compared} buckets differ "
+                    f"in {result.rounds} rounds; {len(result.stale)} rows to re-send, "
+                    f"{len(result.backend_only)} only on backend; hashes sent={_kb(client.sent_bytes - sent_before)} "
+                    f"received={_kb(client.received_bytes - received_before)}"
+                )
+                if result.backend_only:
+                    self.stderr.write(f"reconcile {kind}: only on backend (showing first 5): {result.backend_only[:5]}")
+                if options.get("dry_run") or not result.stale:
+                    continue
+
+                resent = 0
+                stale = list(result.stale)
+                for i in range(0, len(stale), batch_size):
+                    events = []
+                    for row in model.objects.filter(id__in=stale[i:i + batch_size]).order_by("created_at"):
+                        event = to_event(row)
+                        event["eventId"] = str(uuid.uuid5(row.id, result.stale[str(row.id)]))
+                        events.append(event)
+                    resp = client.post_events(events)
+                    resent += len(resp.get("ackedEventIds") or [])
+                    rejected = resp.get("rejected") or []
+                    if rejected:
+                        self.stderr.write(f"reconcile {kind}: rejected {len(rejected)} (showing first): {rejected[:1]}")
+                self.stdout.write(self.style.SUCCESS(f"reconcile {kind}: re-sent {resent} rows"))
+        except (SyncHTTPError, OSError, http.client.HTTPException) as e:
+            raise CommandError(f"reconcile: backend request failed ({e})")
+        finally:
+            client.close()
+            self.stdout.write(f"reconcile: {client.summary()}")
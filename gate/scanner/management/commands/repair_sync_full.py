@@ -1,5 +1,20 @@
-import json
-import urllib.request
+"""
+Manual repair: replay local EntryLog/ExitLog rows to the backend (idempotent).
+
+Rows are read in (created_at, id) order on a server-side cursor and posted by
+--workers concurrent clients (see scanner.services.repair_replay). Progress is
+checkpointed to REPAIR_CHECKPOINT_PATH; after an interruption, --resume
+continues from there with the same filters.
+
+Usage:
+    python manage.py repair_sync_full
+    python manage.py repair_sync_full --since 2026-01-01T00:00:00Z --roll 24MA10001
+    python manage.py repair_sync_full --workers 8 --batch-size 500
+    python manage.py repair_sync_full --resume
+"""
+
+import http.client
+import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
@@ -7,6 +22,14 @@ from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 
 from shared.apps.entries.models import EntryLog, ExitLog
+from scanner.services.repair_replay import (
+    ParallelReplayer,
+    RepairCheckpoint,
+    after_key,
+    entry_event,
+    exit_event,
+)
+from scanner.services.sync_client import SyncHTTPError, sync_client_from_settings
 
 
 def _parse_dt(val: str | None):
@@ -20,20 +43,10 @@ def _parse_dt(val: str | None):
     return dt
 
 
-def _post_events(url: str, api_key: str, events: list[dict], timeout_s: int) -> dict:
-    body = json.dumps({"events": events}).encode("utf-8")
-    req = urllib.request.Request(
-        url=url,
-        method="POST",
-        data=body,
-        headers={
-            "Content-Type": "application/json",
-            "X-GATE-API-KEY": api_key,
-        },
-    )
-    with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-        raw = resp.read().decode("utf-8")
-    return json.loads(raw or "{}")
+PHASES = (
+    ("entries", EntryLog, entry_event),
+    ("exits", ExitLog, exit_event),
+)
 
 
 class Command(BaseCommand):
@@ -44,6 +57,13 @@ class Command(BaseCommand):
         parser.add_argument("--until", default=None, help="ISO datetime upper bound (scanned_at/created_at).")
         parser.add_argument("--roll", default=None, help="Limit to a single roll number.")
         parser.add_argument("--batch-size", type=int, default=None, help="Override SYNC_BATCH_SIZE.")
+        parser.add_argument("--workers", type=int, default=None, help="Concurrent requests. Override REPAIR_WORKERS.")
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue an interrupted repair from its checkpoint (same --since/--until/--roll).",
+        )
+        parser.add_argument("--checkpoint", default=None, help="Override REPAIR_CHECKPOINT_PATH.")
 
     def handle(self, *args, **options):
         url = getattr(settings, "BACKEND_SYNC_URL", "")
@@ -57,102 +77,80 @@ class Command(BaseCommand):
         until = _parse_dt(options.get("until"))
         roll = options.get("roll")
         batch_size = int(options.get("batch_size") or getattr(settings, "SYNC_BATCH_SIZE", 200))
-        timeout_s = int(getattr(settings, "SYNC_TIMEOUT_SECONDS", 10))
-
-        # Entry logs
-        entry_qs = EntryLog.objects.all().order_by("created_at")
-        if roll:
-            entry_qs = entry_qs.filter(roll_id=roll)
-        if since:
-            entry_qs = entry_qs.filter(created_at__gte=since)
-        if until:
-            entry_qs = entry_qs.filter(created_at__lte=until)
-
-        total_entries = entry_qs.count()
-        self.stdout.write(f"repair: replaying EntryLog rows={total_entries}")
-        self._replay_entries(url, api_key, entry_qs, batch_size, timeout_s)
-
-        # Exit logs
-        exit_qs = ExitLog.objects.all().order_by("created_at")
-        if roll:
-            exit_qs = exit_qs.filter(roll_id=roll)
-        if since:
-            exit_qs = exit_qs.filter(created_at__gte=since)
-        if until:
-            exit_qs = exit_qs.filter(created_at__lte=until)
-
-        total_exits = exit_qs.count()
-        self.stdout.write(f"repair: replaying ExitLog rows={total_exits}")
-        self._replay_exits(url, api_key, exit_qs, batch_size, timeout_s)
-
-        self.stdout.write("repair: done")
-
-    def _replay_entries(self, url: str, api_key: str, qs, batch_size: int, timeout_s: int) -> None:
-        offset = 0
-        while True:
-            batch = list(qs[offset : offset + batch_size])
-            if not batch:
-                return
-            events = []
-            for e in batch:
-                ts = e.scanned_at or e.created_at or timezone.now()
-                events.append(
-                    {
-                        "eventId": str(e.id),  # deterministic per-entry
-                        "type": "ENTRY",
-                        "entryId": str(e.id),
-                        "roll": e.roll_id,
-                        "scannedAt": ts.isoformat(),
-                        "status": e.status,
-                        "entryFlag": e.entry_flag,
-                        "laptop": e.laptop,
-                        "extra": e.extra or [],
-                        "deviceMeta": e.device_meta or {},
-                        "deviceId": e.device_id,
-                        "source": e.source,
-                        "os": e.os,
-                    }
+        workers = int(options.get("workers") or getattr(settings, "REPAIR_WORKERS", 4))
+        try:
+            # Read once here: replay worker threads then build clients without a DB connection of their own.
+            epoch = sync_client_from_settings().epoch
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        checkpoint = RepairCheckpoint(options.get("checkpoint") or getattr(settings, "REPAIR_CHECKPOINT_PATH", ""))
+        filters = {
+            "since": since.isoformat() if since else None,
+            "until": until.isoformat() if until else None,
+            "roll": roll,
+        }
+        state = {"filters": filters, "phase": PHASES[0][0], "after": None, "rows": {}}
+        saved = checkpoint.load() if checkpoint.path else None
+        if options.get("resume"):
+            if saved is None:
+                raise CommandError(f"repair: no checkpoint at {checkpoint.path} to resume from")
+            if saved.get("filters") != filters:
+                raise CommandError(f"repair: checkpoint was written for other filters: {saved.get('filters')}")
+            state = saved
+            self.stdout.write(f"repair: resuming {state['phase']} after {state['after']}")
+        elif saved is not None:
+            self.stdout.write(f"repair: starting over; replacing the checkpoint at {checkpoint.path}")
+
+        replayer = ParallelReplayer(
+            lambda: sync_client_from_settings(epoch),
+            workers=workers,
+            batch_size=batch_size,
+            stdout=self.stdout,
+            stderr=self.stderr,
+        )
+        started, rows_before = time.monotonic(), sum(state["rows"].values())
+        try:
+            phase_names = [name for name, _, _ in PHASES]
+            for name, model, to_event in PHASES[phase_names.index(state["phase"]):]:
+                if state["phase"] != name:
+                    state.update(phase=name, after=None)
+                qs = model.objects.all()
+                if roll:
+                    qs = qs.filter(roll_id=roll)
+                if since:
+                    qs = qs.filter(created_at__gte=since)
+                if until:
+                    qs = qs.filter(created_at__lte=until)
+
+                done_before = state["rows"].get(name, 0)
+                self.stdout.write(
+                    f"repair: replaying {model.__name__} rows={after_key(qs, state['after']).count()} "
+                    f"(workers={replayer.workers}, batch={replayer.batch_size})"
                 )
-            resp = _post_events(url, api_key, events, timeout_s=timeout_s)
-            acked = len(resp.get("ackedEventIds") or [])
-            rejected = resp.get("rejected") or []
-            if rejected:
-                self.stderr.write(f"repair entries: rejected {len(rejected)} (showing first): {rejected[:1]}")
-            self.stdout.write(f"repair entries: sent={len(batch)} acked={acked}")
-            offset += len(batch)
-
-    def _replay_exits(self, url: str, api_key: str, qs, batch_size: int, timeout_s: int) -> None:
-        offset = 0
-        while True:
-            batch = list(qs[offset : offset + batch_size])
-            if not batch:
-                return
-            events = []
-            for x in batch:
-                ts = x.scanned_at or x.created_at or timezone.now()
-                events.append(
-                    {
-                        "eventId": str(x.id),  # deterministic per-exit
-                        "type": "EXIT",
-                        "exitId": str(x.id),
-                        "entryId": str(x.entry_id_id) if x.entry_id_id else None,
-                        "roll": x.roll_id,
-                        "scannedAt": ts.isoformat(),
-                        "exitFlag": x.exit_flag,
-                        "laptop": x.laptop,
-                        "extra": x.extra or [],
-                        "deviceMeta": x.device_meta or {},
-                        "deviceId": x.device_id,
-                        "source": x.source,
-                        "os": x.os,
-                    }
-                )
-            resp = _post_events(url, api_key, events, timeout_s=timeout_s)
-            acked = len(resp.get("ackedEventIds") or [])
-            rejected = resp.get("rejected") or []
-            if rejected:
-                self.stderr.write(f"repair exits: rejected {len(rejected)} (showing first): {rejected[:1]}")
-            self.stdout.write(f"repair exits: sent={len(batch)} acked={acked}")
-            offset += len(batch)
-
 
+                def save(key, rows, name=name, done_before=done_before):
+                    state["after"] = key
+                    state["rows"][name] = done_before + rows
+                    if checkpoint.path:
+                        checkpoint.save(state)
+
+                replayer.replay(qs, to_event, name, after=state["after"], on_progress=save)
+        except (SyncHTTPError, OSError, http.client.HTTPException, KeyboardInterrupt) as e:
+            where = f"; resume with --resume (checkpoint {checkpoint.path})" if checkpoint.path else ""
+            if isinstance(e, KeyboardInterrupt):
+                self.stderr.write(f"repair: interrupted{where}")
+                return
+            raise CommandError(f"repair: stopped: {e}{where}")
+        finally:
+            for i, client in enumerate(replayer.clients):
+                if client.requests:
+                    self.stdout.write(f"repair: client {i}: {client.summary()}")
+
+        if checkpoint.path:
+            checkpoint.clear()
+        elapsed = time.monotonic() - started
+        sent = sum(state["rows"].values()) - rows_before
+        self.stdout.write(
+            f"repair: done, {sent} rows in {elapsed:.1f}s ({sent / elapsed if elapsed else 0:.0f} rows/s)"
+        )
@@ -0,0 +1,465 @@
+"""
+Long-running gate scan service.
+
+Keeps Django, the parsed public key and the gate DB connection warm so a scan
+only pays for JWT verification + the DB writes, instead of a full
+`manage.py process_token` process start per QR.
+
+Requests are handled on a pool of SCAN_SERVER_WORKERS threads (--workers),
+so lanes are served concurrently, each thread with its own warm DB
+connection. JWT verification always runs in parallel. Applying a scan is
+serialized per roll with the default DB writer; with --index or
+--write-behind the index is shared state, so scans are applied one at a
+time and only verification overlaps.
+
+Protocol (one request per connection):
+    Unix socket (default): send one JSON line, read one JSON line back.
+    Loopback HTTP (--http): POST /scan with a JSON body, GET /health,
+    GET /metrics (Prometheus text, per-stage scan latency).
+
+Request:   {"token": "<jwt>", "mode": "entry" | "exit", "lane": "<optional lane id>"}
+Response:  {"decision": "ALLOW" | "DENY", "mode", "roll", "flag", "id", "reason", "notes", "elapsedMs"}
+
+`lane` identifies the camera/lane that read the QR (multi-lane watch_qr.py)
+and is stored as deviceMeta["gateDeviceId"] instead of GATE_DEVICE_ID.
+
+The QR payload produced by the frontend is already in the request shape, so
+scripts/watch_qr.py forwards it unchanged.
+
+With --index (single-gate deployments only: this process must be the sole
+writer of entry state), FORCED/DUPLICATE/ORPHAN decisions are served from a
+resident OpenEntryIndex that is cross-checked against the DB every
+OPEN_ENTRY_INDEX_VERIFY_SECONDS.
+
+With --write-behind (implies --index) a scan is answered as soon as its writes
+are fsync'ed to a local journal (WRITE_BEHIND_JOURNAL_PATH); a background
+thread group-commits the journal to the gate DB. Journaled scans that were not
+committed when the process died are replayed on the next start.
+
+Per-stage scan timings are aggregated in memory and merged into
+SCAN_STATS_PATH every SCAN_STATS_FLUSH_SECONDS (see `manage.py scan_stats`).
+
+Usage:
+    python manage.py scan_server
+    python manage.py scan_server --socket /run/pale/gate-scan.sock
+    python manage.py scan_server --http 127.0.0.1:8765
+    python manage.py scan_server --workers 8
+    python manage.py scan_server --index
+    python manage.py scan_server --write-behind
+"""
+
+import json
+import os
+import signal
+import socketserver
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, InterfaceError, OperationalError, connection
+
+from scanner.services.key_manager import MissingPublicKeyError, PublicKeyManager
+from scanner.services.open_entry_index import OpenEntryIndex
+from scanner.services.scan_metrics import ScanMetrics, ScanTimer, scan_outcome, stats_store_from_settings
+from scanner.services.scan_service import ScanDenied, ScanProcessor
+from scanner.services.write_behind import JournalCommitter, JournalScanWriter, ScanJournal
+
+
+LOOPBACK_HOSTS = {"127.0.0.1", "localhost", "::1"}
+MAX_LANE_ID_LENGTH = 64
+ROLL_LOCK_STRIPES = 64
+
+
+def _stop_on_sigterm(signum, frame):
+    # Treat `systemctl stop` like Ctrl-C so the socket is removed and stats are flushed.
+    raise KeyboardInterrupt
+
+
+class _ApplyLocks:
+    """
+    Which lock a scan is applied under: one per roll (striped), or a single one
+    when scans share in-memory state (the open-entry index).
+    """
+
+    def __init__(self, shared_state: bool):
+        self.shared = threading.Lock() if shared_state else None
+        self._stripes = [threading.Lock() for _ in range(ROLL_LOCK_STRIPES)]
+
+    def __call__(self, payload: dict):
+        if self.shared is not None:
+            return self.shared
+        roll = str(payload.get("roll") or "")
+        return self._stripes[zlib.crc32(roll.encode("utf-8")) % ROLL_LOCK_STRIPES]
+
+    def exclusive(self):
+        """Held while the shared state is rebuilt (index verify)."""
+        return self.shared if self.shared is not None else nullcontext()
+
+
+class _PooledServerMixIn:
+    """
+    Handle each connection on a fixed pool of threads instead of the serving
+    thread. Unlike ThreadingMixIn's thread per request, pool threads live on,
+    and so does each one's DB connection (Django connections are per thread).
+    """
+
+    def __init__(self, *args, workers: int = 1, **kwargs):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="scan")
+        super().__init__(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_in_pool, request, client_address)
+
+    def _process_in_pool(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+
+class _UnixScanHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        # A client that connects and then stalls must not hold up the other lanes.
+        self.timeout = self.server.request_timeout
+        super().setup()
+
+    def handle(self):
+        try:
+            line = self.rfile.readline()
+        except (TimeoutError, ConnectionError):
+            return
+        if not line.strip():
+            return
+        resp = self.server.dispatch(line)
+        self.wfile.write(json.dumps(resp).encode("utf-8") + b"\n")
+
+
+class _HTTPScanHandler(BaseHTTPRequestHandler):
+    def setup(self):
+        # Read timeouts are caught by handle_one_request, which drops the connection.
+        self.timeout = self.server.request_timeout
+        super().setup()
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        if path == "/metrics":
+            raw = self.server.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+            return
+        if path != "/health":
+            self._send(404, {"detail": "Not found"})
+            return
+        self._send(200, self.server.health())
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/scan":
+            self._send(404, {"detail": "Not found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        resp = self.server.dispatch(self.rfile.read(length))
+        self._send(200, resp)
+
+    def _send(self, code: int, body: dict) -> None:
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):
+        # Scan results are already logged by the command; keep stderr quiet.
+        pass
+
+
+class _ScanUnixServer(_PooledServerMixIn, socketserver.UnixStreamServer):
+    def __init__(self, path, dispatch, periodic, request_timeout, workers=1):
+        self.dispatch = dispatch
+        self.periodic = periodic
+        self.request_timeout = request_timeout
+        super().__init__(path, _UnixScanHandler, workers=workers)
+
+    def service_actions(self):
+        self.periodic()
+
+
+class _ScanHTTPServer(_PooledServerMixIn, HTTPServer):
+    def __init__(self, address, dispatch, periodic, prometheus, health, request_timeout, workers=1):
+        self.dispatch = dispatch
+        self.periodic = periodic
+        self.request_timeout = request_timeout
+        self.prometheus = prometheus
+        self.health = health
+        super().__init__(address, _HTTPScanHandler, workers=workers)
+
+    def service_actions(self):
+        self.periodic()
+
+
+class Command(BaseCommand):
+    help = "Run a warm gate scan service (Unix socket or loopback HTTP) that returns ALLOW/DENY as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--socket",
+            default=None,
+            help="Unix socket path. Default: SCAN_SOCKET_PATH from settings.",
+        )
+        parser.add_argument(
+            "--http",
+            default=None,
+            help="Serve loopback HTTP on HOST:PORT instead of a Unix socket (e.g. 127.0.0.1:8765).",
+        )
+        parser.add_argument(
+            "--key",
+            default=None,
+            help="Path to public key PEM. Default: gate/keys/public.pem",
+        )
+        parser.add_argument(
+            "--index",
+            action="store_true",
+            help="Serve scan decisions from a resident open-entry index (single-writer gates only).",
+        )
+        parser.add_argument(
+            "--write-behind",
+            action="store_true",
+            help="Answer once the scan is journaled locally; commit to the DB in the background (implies --index).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Threads serving scans concurrently. Default: SCAN_SERVER_WORKERS from settings.",
+        )
+
+    def handle(self, *args, **options):
+        key_manager = PublicKeyManager(options.get("key"))
+        try:
+            # Parse the key up-front; later scans only re-read it if the file changes.
+            key_manager.get()
+        except MissingPublicKeyError as e:
+            raise CommandError(str(e))
+
+        # Open the DB connection up-front so the first scan doesn't pay for it.
+        connection.ensure_connection()
+
+        self.committer = None
+        writer = None
+        if options.get("write_behind"):
+            journal = ScanJournal(settings.WRITE_BEHIND_JOURNAL_PATH, fsync=settings.WRITE_BEHIND_FSYNC)
+            self.committer = JournalCommitter(
+                journal, commit_ms=settings.WRITE_BEHIND_COMMIT_MS, max_batch=settings.WRITE_BEHIND_MAX_BATCH
+            )
+            try:
+                replayed = self.committer.replay()
+            except (OperationalError, InterfaceError) as e:
+                raise CommandError(f"Cannot replay the scan journal, database unavailable ({e})")
+            self.stdout.write(f"scan_server: write-behind journal {journal.path} ({replayed} scans replayed)")
+        self.reported_commit_errors = 0
+
+        self.index = None
+        if options.get("index") or self.committer is not None:
+            self.index = OpenEntryIndex(window_hours=getattr(settings, "OPEN_ENTRY_INDEX_WINDOW_HOURS", 48))
+            count = self.index.warm()
+            self.stdout.write(f"scan_server: open-entry index warmed with {count} entries")
+        self.verify_every_s = getattr(settings, "OPEN_ENTRY_INDEX_VERIFY_SECONDS", 300)
+        self.last_verify = time.monotonic()
+        if self.committer is not None:
+            writer = JournalScanWriter(self.index, self.committer.journal, self.committer)
+            self.committer.run_in_thread()
+        self.apply_locks = _ApplyLocks(shared_state=self.index is not None)
+        self.processor = ScanProcessor(key_manager, index=self.index, writer=writer, apply_lock=self.apply_locks)
+        workers = options.get("workers") or getattr(settings, "SCAN_SERVER_WORKERS", 4)
+        if workers < 1:
+            raise CommandError("--workers must be at least 1")
+        self.stats_store = stats_store_from_settings()
+        self.stats_flush_s = getattr(settings, "SCAN_STATS_FLUSH_SECONDS", 10)
+        self.metrics = ScanMetrics()          # not yet flushed to stats_store
+        self.metrics_total = ScanMetrics()    # since start, for /metrics
+        self.metrics_lock = threading.Lock()
+        self.last_stats_flush = time.monotonic()
+
+        request_timeout = getattr(settings, "SCAN_REQUEST_TIMEOUT_SECONDS", 5)
+        http_addr = options.get("http")
+        if http_addr:
+            host, _, port = http_addr.rpartition(":")
+            host = host.strip("[]") or "127.0.0.1"
+            if host not in LOOPBACK_HOSTS:
+                raise CommandError(f"--http must bind a loopback address, got {host}")
+            try:
+                server = _ScanHTTPServer(
+                    (host, int(port)), self.dispatch, self.periodic, self.prometheus, self.health, request_timeout,
+                    workers=workers,
+                )
+            except ValueError:
+                raise CommandError(f"Invalid --http address: {http_addr} (expected HOST:PORT)")
+            where = f"http://{host}:{port}/scan"
+        else:
+            sock_path = options.get("socket") or getattr(settings, "SCAN_SOCKET_PATH", "/tmp/pale-gate-scan.sock")
+            if os.path.exists(sock_path):
+                os.unlink(sock_path)
+            server = _ScanUnixServer(sock_path, self.dispatch, self.periodic, request_timeout, workers=workers)
+            os.chmod(sock_path, 0o660)
+            where = sock_path
+
+        signal.signal(signal.SIGTERM, _stop_on_sigterm)
+        self.stdout.write(f"scan_server: listening on {where} ({workers} workers)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.flush_stats()
+            self.stop_committer()
+            if not http_addr and os.path.exists(where):
+                os.unlink(where)
+            self.stdout.write("scan_server: stopped")
+
+    def periodic(self) -> None:
+        """Runs between requests: flush scan stats, cross-check the open-entry index against the DB."""
+        if time.monotonic() - self.last_stats_flush >= self.stats_flush_s:
+            self.flush_stats()
+        if self.committer is not None and self.committer.errors > self.reported_commit_errors:
+            self.reported_commit_errors = self.committer.errors
+            self.stderr.write(
+                f"scan_server: journal commit failed, {self.committer.pending()} scans queued "
+                f"({self.committer.last_error})"
+            )
+        if self.index is None or time.monotonic() - self.last_verify < self.verify_every_s:
+            return
+        self.last_verify = time.monotonic()
+        if self.committer is not None:
+            # The DB is the reference for verify(); let it catch up with journaled scans first.
+            self.committer.wait_idle()
+        try:
+            with self.apply_locks.exclusive():
+                mismatches = self.index.verify()
+        except (OperationalError, InterfaceError) as e:
+            connection.close()
+            self.last_verify = 0  # retry on the next tick
+            self.stderr.write(f"scan_server: index verify skipped, database unavailable ({e})")
+            return
+        if mismatches:
+            self.stderr.write(
+                f"scan_server: index drift corrected ({len(mismatches)} entries), first: {mismatches[:3]}"
+            )
+
+    def flush_stats(self) -> None:
+        self.last_stats_flush = time.monotonic()
+        with self.metrics_lock:
+            if self.stats_store is None or not self.metrics:
+                return
+            metrics, self.metrics = self.metrics, ScanMetrics()
+        try:
+            self.stats_store.add(metrics)
+        except OSError as e:
+            self.stderr.write(f"scan_server: scan stats not flushed ({e})")
+            with self.metrics_lock:
+                metrics.merge(self.metrics)
+                self.metrics = metrics
+
+    def stop_committer(self) -> None:
+        if self.committer is None:
+            return
+        self.committer.stop()
+        self.committer.journal.close()
+        left = self.committer.pending()
+        if left:
+            self.stderr.write(f"scan_server: {left} journaled scans not committed, replayed on next start")
+
+    def health(self) -> dict:
+        body = {"status": "ok"}
+        if self.committer is not None:
+            body["writeBehind"] = {
+                "pending": self.committer.pending(),
+                "committed": self.committer.committed,
+                "groups": self.committer.groups,
+                "errors": self.committer.errors,
+            }
+        return body
+
+    def prometheus(self) -> str:
+        with self.metrics_lock:
+            return self.metrics_total.prometheus()
+
+    def dispatch(self, raw: bytes) -> dict:
+        """Decode one request, run the scan and build the JSON response."""
+        started = time.monotonic()
+        timer = ScanTimer()
+        result = None
+        lane = None
+        try:
+            with timer.stage("token_read"):
+                try:
+                    req = json.loads(raw)
+                except ValueError:
+                    raise ScanDenied("DENY: invalid request (expected JSON object)")
+            if not isinstance(req, dict):
+                raise ScanDenied("DENY: invalid request (expected JSON object)")
+
+            mode = req.get("mode") or "entry"
+            if mode not in ("entry", "exit"):
+                raise ScanDenied(f"DENY: invalid mode '{mode}'")
+
+            lane = req.get("lane")
+            if lane is not None and (not isinstance(lane, str) or not 0 < len(lane) <= MAX_LANE_ID_LENGTH):
+                raise ScanDenied(f"DENY: invalid lane id (expected a string of up to {MAX_LANE_ID_LENGTH} chars)")
+
+            result = self.processor.process(req.get("token"), mode=mode, timer=timer, gate_device_id=lane)
+            resp = {
+                "decision": "ALLOW",
+                "mode": result["mode"],
+                "roll": result["roll"],
+                "flag": result["flag"],
+                "id": result["id"],
+                "notes": result["notes"],
+            }
+        except ScanDenied as e:
+            resp = {"decision": "DENY", "reason": str(e), "notes": e.notes}
+        except (OperationalError, InterfaceError) as e:
+            # Drop the broken connection; the next scan reconnects.
+            connection.close()
+            if self.index is not None:
+                # The write may or may not have landed; re-sync before trusting the index again.
+                self.last_verify = 0
+            resp = {"decision": "DENY", "reason": f"DENY: gate database unavailable ({e})", "notes": []}
+        except DatabaseError as e:
+            # The scan's transaction was rolled back (e.g. a roll too long for its column).
+            if self.index is not None:
+                self.last_verify = 0
+            resp = {"decision": "DENY", "reason": f"DENY: scan could not be recorded ({e})", "notes": []}
+        except (ValueError, KeyError, TypeError) as e:
+            # A verified token whose payload doesn't have the expected shape.
+            resp = {"decision": "DENY", "reason": f"DENY: invalid token payload ({type(e).__name__}: {e})", "notes": []}
+        except OSError as e:
+            # Write-behind: the scan could not be journaled, so it must not be allowed.
+            resp = {"decision": "DENY", "reason": f"DENY: scan journal unavailable ({e})", "notes": []}
+
+        with timer.stage("output"):
+            resp["elapsedMs"] = round((time.monotonic() - started) * 1000, 2)
+            self.stdout.write(
+                f"scan_server: {resp['decision']} lane={lane or '-'} mode={resp.get('mode', '-')} roll={resp.get('roll', '-')} "
+                f"flag={resp.get('flag') or resp.get('reason')} in {resp['elapsedMs']}ms"
+            )
+        timer.finish()
+        outcome = scan_outcome(result if resp["decision"] == "ALLOW" else None)
+        with self.metrics_lock:
+            self.metrics.record(timer, outcome)
+            self.metrics_total.record(timer, outcome)
+        return resp
@@ -0,0 +1,67 @@
+"""
+Show per-stage scan latency (p50/p95/p99) recorded by process_token and scan_server.
+
+Reads the aggregated histograms from SCAN_STATS_PATH. Use --reset after a
+deploy to start a fresh window and compare against the previous numbers.
+
+Usage:
+    python manage.py scan_stats
+    python manage.py scan_stats --stage total
+    python manage.py scan_stats --format prometheus > /var/lib/node_exporter/textfile/gate_scan.prom
+    python manage.py scan_stats --reset
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from scanner.services.scan_metrics import stats_store_from_settings
+
+
+class Command(BaseCommand):
+    help = "Show per-stage scan latency percentiles (p50/p95/p99) per outcome."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            choices=["table", "json", "prometheus"],
+            default="table",
+            help="Output format (default: table). 'prometheus' prints the text exposition format.",
+        )
+        parser.add_argument("--stage", default=None, help="Only show this stage (e.g. total, jwt_decode).")
+        parser.add_argument("--reset", action="store_true", help="Clear the recorded stats.")
+
+    def handle(self, *args, **options):
+        store = stats_store_from_settings()
+        if store is None:
+            raise CommandError("Scan stats are disabled (SCAN_STATS_PATH is empty).")
+
+        if options["reset"]:
+            store.reset()
+            self.stdout.write(self.style.SUCCESS(f"scan_stats: cleared {store.path}"))
+            return
+
+        metrics = store.load()
+        if options["format"] == "prometheus":
+            self.stdout.write(metrics.prometheus(), ending="")
+            return
+
+        rows = metrics.rows()
+        if options["stage"]:
+            rows = [r for r in rows if r["stage"] == options["stage"]]
+
+        if options["format"] == "json":
+            self.stdout.write(json.dumps({"since": metrics.since, "stages": rows}, indent=2))
+            return
+
+        if not rows:
+            self.stdout.write(f"scan_stats: no scans recorded in {store.path}")
+            return
+
+        self.stdout.write(f"Scan latency since {metrics.since} (ms)")
+        self.stdout.write(f"{'stage':<13} {'outcome':<15} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+        for r in rows:
+            self.stdout.write(
+                f"{r['stage']:<13} {r['outcome']:<15} {r['count']:>7} "
+                f"{r['p50'] * 1000:>9.2f} {r['p95'] * 1000:>9.2f} {r['p99'] * 1000:>9.2f} {r['max'] * 1000:>9.2f}"
+            )
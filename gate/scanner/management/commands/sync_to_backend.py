@@ -1,42 +1,12 @@
-import json
-import random
-import time
-import urllib.error
-import urllib.request
 from datetime import timedelta
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db import models, transaction
-from django.utils import timezone
 
-from scanner.models import OutboxEvent
-
-
-def _compute_next_retry(attempt_count: int) -> int:
-    """
-    Exponential backoff with jitter.
-    Returns seconds to wait until next retry.
-    """
-    base = 2 ** min(attempt_count, 10)  # caps at ~1024s
-    jitter = random.random()  # 0..1
-    return int(min(300, base + jitter * 2))  # cap at 5 minutes
-
-
-def _post_events(url: str, api_key: str, events: list[dict], timeout_s: int) -> dict:
-    body = json.dumps({"events": events}).encode("utf-8")
-    req = urllib.request.Request(
-        url=url,
-        method="POST",
-        data=body,
-        headers={
-            "Content-Type": "application/json",
-            "X-GATE-API-KEY": api_key,
-        },
-    )
-    with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-        raw = resp.read().decode("utf-8")
-    return json.loads(raw or "{}")
+from scanner.services.batch_sizer import BatchSizer
+from scanner.services.outbox_drain import OutboxDrainer
+from scanner.services.outbox_notify import OutboxListener
+from scanner.services.sync_client import sync_client_from_settings
 
 
 class Command(BaseCommand):
@@ -45,8 +15,40 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("--once", action="store_true", help="Run a single batch and exit.")
         parser.add_argument("--loop", action="store_true", help="Run forever (default).")
-        parser.add_argument("--batch-size", type=int, default=None, help="Override SYNC_BATCH_SIZE.")
+        parser.add_argument("--drain", action="store_true", help="Drain the outbox until nothing is due, then exit.")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Override SYNC_BATCH_SIZE (the starting size when batch sizing is adaptive).",
+        )
+        parser.add_argument(
+            "--fixed-batch",
+            action="store_true",
+            help="Always send --batch-size events per request (SYNC_ADAPTIVE_BATCH=0); a 413 still shrinks it.",
+        )
         parser.add_argument("--sleep", type=int, default=None, help="Override SYNC_INTERVAL_SECONDS.")
+        parser.add_argument(
+            "--inflight",
+            type=int,
+            default=None,
+            help="Concurrent in-flight batches (roll partitions). Override SYNC_INFLIGHT_BATCHES.",
+        )
+        parser.add_argument(
+            "--no-listen",
+            action="store_true",
+            help="Poll every --sleep seconds instead of waiting for outbox NOTIFY (Postgres).",
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="Catch up through the streaming endpoint, SYNC_STREAM_MAX_EVENTS events per request, then exit.",
+        )
+        parser.add_argument(
+            "--no-coalesce",
+            action="store_true",
+            help="Send every outbox event as-is instead of folding superseded events of an entry (SYNC_COALESCE).",
+        )
 
     def handle(self, *args, **options):
         url = getattr(settings, "BACKEND_SYNC_URL", "")
@@ -56,95 +58,82 @@ class Command(BaseCommand):
         if not api_key:
             raise CommandError("GATE_API_KEY is not set")
 
+        try:
+            sync_client_from_settings()
+        except ValueError as e:
+            raise CommandError(str(e))
+
         batch_size = int(options.get("batch_size") or getattr(settings, "SYNC_BATCH_SIZE", 200))
         sleep_s = int(options.get("sleep") or getattr(settings, "SYNC_INTERVAL_SECONDS", 5))
-        timeout_s = int(getattr(settings, "SYNC_TIMEOUT_SECONDS", 10))
+        inflight = int(options.get("inflight") or getattr(settings, "SYNC_INFLIGHT_BATCHES", 4))
 
         run_once = bool(options.get("once"))
         # run_loop = bool(options.get("loop")) or not run_once
 
-        while True:
-            now = timezone.now()
-            with transaction.atomic():
-                qs = (
-                    OutboxEvent.objects.select_for_update(skip_locked=True)
-                    .filter(sent_at__isnull=True)
-                    .filter(models.Q(next_retry_at__isnull=True) | models.Q(next_retry_at__lte=now))
-                    .order_by("created_at")[:batch_size]
-                )
-                batch = list(qs)
-
-            if not batch:
-                if run_once:
-                    return
-                time.sleep(sleep_s)
-                continue
+        run_stream = bool(options.get("stream"))
+        if run_once and run_stream:
+            raise CommandError("--once and --stream are mutually exclusive")
 
-            events = []
-            for row in batch:
-                payload = dict(row.payload or {})
-                payload["eventId"] = str(row.event_id)
-                payload["type"] = row.event_type
-                events.append(payload)
-
-            try:
-                resp = _post_events(url, api_key, events, timeout_s=timeout_s)
-                acked_ids = set(resp.get("ackedEventIds") or [])
-                rejected = resp.get("rejected") or []
-                rejected_map = {str(r.get("eventId")): str(r.get("error")) for r in rejected if r.get("eventId")}
-
-                sent_ts = timezone.now()
-                with transaction.atomic():
-                    if acked_ids:
-                        OutboxEvent.objects.filter(event_id__in=acked_ids).update(
-                            sent_at=sent_ts, last_error=""
-                        )
-                    if rejected_map:
-                        # Treat rejects as permanently failed (mark sent) to avoid infinite retry loops.
-                        for ev_id, err in rejected_map.items():
-                            OutboxEvent.objects.filter(event_id=ev_id).update(
-                                sent_at=sent_ts,
-                                last_error=f"rejected: {err}",
-                                last_attempt_at=sent_ts,
-                            )
-
-                self.stdout.write(
-                    f"{timezone.now().strftime('%Y-%m-%d %H:%M:%S')} | synced batch={len(batch)} acked={len(acked_ids)} rejected={len(rejected_map)}"
-                )
-
-            except urllib.error.HTTPError as e:
-                # 4xx/5xx with body
-                err_body = ""
+        listener = None
+        if not run_once and not run_stream and getattr(settings, "SYNC_LISTEN", True) and not options.get("no_listen"):
+            if OutboxListener.supported():
+                listener = OutboxListener(debounce_ms=getattr(settings, "SYNC_NOTIFY_DEBOUNCE_MS", 50))
                 try:
-                    err_body = e.read().decode("utf-8")
-                except Exception:
-                    pass
-                msg = f"HTTPError {e.code}: {err_body or str(e)}"
-                self._mark_batch_retry(batch, msg)
-            except Exception as e:
-                self._mark_batch_retry(batch, str(e))
-
-            if run_once:
-                return
-
-            time.sleep(sleep_s)
-
-    def _mark_batch_retry(self, batch: list[OutboxEvent], err: str) -> None:
-        now = timezone.now()
-    
-        # Update objects in memory first
-        for row in batch:
-            row.attempt_count = (row.attempt_count or 0) + 1
-            delay_s = _compute_next_retry(row.attempt_count)
-            row.last_attempt_at = now
-            row.next_retry_at = now + timedelta(seconds=delay_s)
-            row.last_error = err[:2000]
-
-        # Push all changes to DB in one go
-        OutboxEvent.objects.bulk_update(
-            batch, 
-            fields=["attempt_count", "last_attempt_at", "next_retry_at", "last_error"]
+                    listener.connect()
+                    self.stdout.write("sync: waiting for outbox NOTIFY (polling fallback every "
+                                      f"{getattr(settings, 'SYNC_NOTIFY_FALLBACK_SECONDS', 60)}s)")
+                except Exception as e:
+                    # wait() retries the LISTEN connection on the next idle cycle.
+                    self.stderr.write(f"sync: outbox LISTEN unavailable, will retry ({e})")
+
+        coalesce = getattr(settings, "SYNC_COALESCE", True) and not options.get("no_coalesce")
+        sizer = BatchSizer(
+            batch_size,
+            min_size=getattr(settings, "SYNC_BATCH_MIN", 20),
+            max_size=getattr(settings, "SYNC_BATCH_MAX", 500),
+            target_rtt_ms=getattr(settings, "SYNC_TARGET_RTT_MS", 1000),
+            adaptive=getattr(settings, "SYNC_ADAPTIVE_BATCH", True) and not options.get("fixed_batch"),
         )
-        self.stderr.write(f"{timezone.now().strftime('%Y-%m-%d %H:%M:%S')} | sync failed; scheduled retry for {len(batch)} events: {err}")
-    
 
+        horizon_days = getattr(settings, "SYNC_REPLAY_HORIZON_DAYS", 28)
+        drainer = OutboxDrainer(
+            sync_client_from_settings,
+            inflight=inflight,
+            coalesce=coalesce,
+            sizer=sizer,
+            replay_horizon=timedelta(days=horizon_days) if horizon_days > 0 else None,
+            report_cursor=getattr(settings, "SYNC_REPORT_CURSOR", True),
+            stdout=self.stdout,
+            stderr=self.stderr,
+        )
+        try:
+            if run_once:
+                drainer.run_once()
+            elif run_stream:
+                drainer.drain_stream(int(getattr(settings, "SYNC_STREAM_MAX_EVENTS", 50000)))
+            else:
+                # Sleeps only when nothing is due; a backlog is sent back-to-back.
+                drainer.drain(
+                    sleep_s,
+                    until_empty=bool(options.get("drain")),
+                    listener=listener,
+                    listen_fallback_s=getattr(settings, "SYNC_NOTIFY_FALLBACK_SECONDS", 60),
+                )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if listener is not None:
+                listener.close()
+                self.stdout.write(f"sync: woken by NOTIFY {listener.notifications}x, idle polls={drainer.idle_polls}")
+            for i, client in enumerate(drainer.clients):
+                if client.requests:
+                    self.stdout.write(f"sync: client {i}: {client.summary()}")
+            self.stdout.write(f"sync: {sizer.describe()}")
+            if drainer.deferrals:
+                self.stdout.write(f"sync: backend asked to back off {drainer.deferrals}x")
+            if drainer.coalesced:
+                self.stdout.write(f"sync: coalesced {drainer.coalesced} superseded events into newer ones")
+            if drainer.expired:
+                self.stdout.write(f"sync: expired {drainer.expired} events older than the replay horizon")
+            if drainer.already_durable:
+                self.stdout.write(f"sync: {drainer.already_durable} unsent events were already durable on the backend")
@@ -0,0 +1,42 @@
+# Postgres only: NOTIFY gate_outbox after rows are inserted into the outbox,
+# so sync_to_backend can wake up instead of polling (see services/outbox_notify.py).
+
+from django.db import migrations
+
+
+CREATE_SQL = """
+CREATE OR REPLACE FUNCTION gate_outbox_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('gate_outbox', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS gate_outbox_events_notify ON gate_outbox_events;
+CREATE TRIGGER gate_outbox_events_notify
+    AFTER INSERT ON gate_outbox_events
+    FOR EACH STATEMENT EXECUTE FUNCTION gate_outbox_notify();
+"""
+
+DROP_SQL = """
+DROP TRIGGER IF EXISTS gate_outbox_events_notify ON gate_outbox_events;
+DROP FUNCTION IF EXISTS gate_outbox_notify();
+"""
+
+
+def _run_on_postgres(sql):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == "postgresql":
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scanner", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(_run_on_postgres(CREATE_SQL), _run_on_postgres(DROP_SQL)),
+    ]
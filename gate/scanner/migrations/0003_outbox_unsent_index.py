@@ -0,0 +1,61 @@
+# Replace the three full outbox indexes with one partial index on unsent rows.
+# Sent rows are purged by compact_outbox, so the claim query only needs unsent ones.
+# Postgres only: leave room on each page for HOT retry updates and vacuum the
+# (churning) outbox sooner than the defaults would.
+
+from django.db import migrations, models
+
+
+STORAGE_SQL = """
+ALTER TABLE gate_outbox_events SET (
+    fillfactor = 90,
+    autovacuum_vacuum_scale_factor = 0.05,
+    autovacuum_analyze_scale_factor = 0.05
+);
+"""
+
+RESET_STORAGE_SQL = """
+ALTER TABLE gate_outbox_events RESET (
+    fillfactor,
+    autovacuum_vacuum_scale_factor,
+    autovacuum_analyze_scale_factor
+);
+"""
+
+
+def _run_on_postgres(sql):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == "postgresql":
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scanner", "0002_outbox_notify_trigger"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="outboxevent",
+            name="outbox_sent_at_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="outboxevent",
+            name="outbox_next_retry_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="outboxevent",
+            name="outbox_created_at_idx",
+        ),
+        migrations.AddIndex(
+            model_name="outboxevent",
+            index=models.Index(
+                condition=models.Q(("sent_at__isnull", True)),
+                fields=["created_at"],
+                name="outbox_unsent_idx",
+            ),
+        ),
+        migrations.RunPython(_run_on_postgres(STORAGE_SQL), _run_on_postgres(RESET_STORAGE_SQL)),
+    ]
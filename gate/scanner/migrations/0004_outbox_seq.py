@@ -0,0 +1,74 @@
+# Number outbox rows with a monotonic per-gate `seq` (see services/outbox_seq.py).
+# A trigger assigns it from the gate_outbox_seq sequence on insert, so every
+# writer (bulk_create, create, raw SQL) gets one. Postgres only; on other
+# databases, and for existing rows, seq stays NULL and events are synced by
+# event id alone. The epoch of this numbering is created here, so a recreated
+# database starts a new epoch.
+
+import uuid
+
+from django.db import migrations, models
+
+
+POSTGRES_CREATE_SQL = """
+CREATE SEQUENCE IF NOT EXISTS gate_outbox_seq;
+
+CREATE OR REPLACE FUNCTION gate_outbox_set_seq() RETURNS trigger AS $$
+BEGIN
+    IF NEW.seq IS NULL THEN
+        NEW.seq := nextval('gate_outbox_seq');
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS gate_outbox_events_seq ON gate_outbox_events;
+CREATE TRIGGER gate_outbox_events_seq
+    BEFORE INSERT ON gate_outbox_events
+    FOR EACH ROW EXECUTE FUNCTION gate_outbox_set_seq();
+"""
+
+POSTGRES_DROP_SQL = """
+DROP TRIGGER IF EXISTS gate_outbox_events_seq ON gate_outbox_events;
+DROP FUNCTION IF EXISTS gate_outbox_set_seq();
+DROP SEQUENCE IF EXISTS gate_outbox_seq;
+"""
+
+
+def install(apps, schema_editor):
+    apps.get_model("scanner", "OutboxSequence").objects.get_or_create(id=1, defaults={"epoch": uuid.uuid4()})
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(POSTGRES_CREATE_SQL)
+
+
+def uninstall(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(POSTGRES_DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scanner", "0003_outbox_unsent_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxevent",
+            name="seq",
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name="OutboxSequence",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("epoch", models.UUIDField(default=uuid.uuid4, editable=False)),
+            ],
+            options={
+                "db_table": "gate_outbox_sequence",
+            },
+        ),
+        migrations.RunPython(install, uninstall),
+    ]
@@ -6,11 +6,14 @@ from django.db import models
 class OutboxEvent(models.Model):
     """
     Durable outbox table for gate -> backend incremental sync.
+
+    `seq` is set by a database trigger on insert (see services.outbox_seq).
     """
 
     event_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     event_type = models.CharField(max_length=32)
     payload = models.JSONField(default=dict)
+    seq = models.BigIntegerField(null=True, blank=True, editable=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
     sent_at = models.DateTimeField(null=True, blank=True)
@@ -23,12 +26,33 @@ class OutboxEvent(models.Model):
     class Meta:
         db_table = "gate_outbox_events"
         indexes = [
-            models.Index(fields=["sent_at"], name="outbox_sent_at_idx"),
-            models.Index(fields=["next_retry_at"], name="outbox_next_retry_idx"),
-            models.Index(fields=["created_at"], name="outbox_created_at_idx"),
+            # Only unsent rows are ever looked up (claim query, next retry); sent rows are
+            # purged by compact_outbox. next_retry_at is deliberately not indexed so retry
+            # bookkeeping updates can be HOT on Postgres.
+            models.Index(
+                fields=["created_at"],
+                name="outbox_unsent_idx",
+                condition=models.Q(sent_at__isnull=True),
+            ),
         ]
 
     def __str__(self) -> str:
         return f"OutboxEvent(event_id={self.event_id}, event_type={self.event_type})"
 
 
+class OutboxSequence(models.Model):
+    """
+    Single row: the epoch of this database's outbox `seq` numbering.
+
+    Created with the database (migration 0004), so a recreated database starts
+    a new epoch and its seqs are never taken for the old ones. The seqs
+    themselves come from the gate_outbox_seq sequence (Postgres only).
+    """
+
+    epoch = models.UUIDField(default=uuid.uuid4, editable=False)
+
+    class Meta:
+        db_table = "gate_outbox_sequence"
+
+    def __str__(self) -> str:
+        return f"OutboxSequence(epoch={self.epoch})"
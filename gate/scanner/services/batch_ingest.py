@@ -0,0 +1,202 @@
+"""
+Batch scan ingestion (process_token --batch).
+
+Replays many scans in one process, for example after the gate was offline or
+when importing scans captured on a handheld:
+
+  1. verify every JWT, in a process pool when there is enough work
+  2. order the scans by scannedAt (per roll the state machine must see them in
+     capture order)
+  3. apply the entry/exit state machine in memory, chunk by chunk, using the
+     normal ScanProcessor with an OpenEntryIndex + BatchScanWriter
+  4. write each chunk with bulk_create / bulk_update in one transaction
+
+Input is JSONL, one scan per line:
+
+    {"token": "<jwt>", "mode": "entry" | "exit", "scannedAt": "2026-01-10T09:00:00Z"}
+
+A line that isn't a JSON object is taken as a bare token (mode from --mode).
+Without scannedAt a scan counts as scanned now.
+"""
+
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connections
+from django.utils import timezone
+
+from scanner.services.key_manager import PublicKeyManager
+from scanner.services.open_entry_index import OpenEntryIndex
+from scanner.services.scan_service import (
+    BatchScanWriter,
+    ScanDenied,
+    ScanProcessor,
+    _parse_entry_id,
+    decode_token,
+    parse_iso_datetime,
+)
+
+
+# Below this many tokens per worker, forking a pool costs more than it saves.
+MIN_TOKENS_PER_WORKER = 200
+
+_worker_key = None
+
+
+def _init_verify_worker(key_path):
+    global _worker_key
+    _worker_key = PublicKeyManager(key_path).get()
+
+
+def _verify(args):
+    """Pool task: (token, test_mode, scanned_ts) -> (payload, is_expired, deny_reason)."""
+    token, test_mode, scanned_ts = args
+    try:
+        payload, is_expired = decode_token(token, _worker_key, test_mode=test_mode, now=scanned_ts)
+    except ScanDenied as e:
+        return None, False, str(e)
+    return payload, is_expired, None
+
+
+def parse_batch_line(line: str, default_mode: str = "entry") -> dict:
+    """Parse one input line into {"token", "mode", "scanned_at"}; raises ScanDenied if unusable."""
+    line = line.strip()
+    if line.startswith("{"):
+        try:
+            req = json.loads(line)
+        except ValueError:
+            raise ScanDenied("DENY: invalid batch line (expected JSON object)")
+        if not isinstance(req, dict):
+            raise ScanDenied("DENY: invalid batch line (expected JSON object)")
+    else:
+        req = {"token": line}
+
+    token = (req.get("token") or "").strip()
+    if not token:
+        raise ScanDenied("DENY: no token provided")
+    mode = req.get("mode") or default_mode
+    if mode not in ("entry", "exit"):
+        raise ScanDenied(f"DENY: invalid mode '{mode}'")
+    try:
+        scanned_at = parse_iso_datetime(req.get("scannedAt"))
+    except ValueError:
+        raise ScanDenied(f"DENY: invalid scannedAt '{req.get('scannedAt')}'")
+    return {"token": token, "mode": mode, "scanned_at": scanned_at}
+
+
+class BatchIngest:
+    """Verifies, orders and applies a batch of scans; see module docstring."""
+
+    def __init__(self, key_path=None, workers: int | None = None, chunk_size: int = 1000, test_mode: bool = False):
+        self.key_manager = PublicKeyManager(key_path)
+        self.key_path = self.key_manager.path
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.chunk_size = max(1, chunk_size)
+        self.test_mode = test_mode
+        self.timings = {"verify": 0.0, "apply": 0.0, "write": 0.0}
+
+    def run(self, lines, default_mode: str = "entry") -> list[dict]:
+        """Process all input lines. Returns one result dict per non-blank line, in input order."""
+        results = {}
+        scans = []
+        for line_no, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                scan = parse_batch_line(line, default_mode)
+            except ScanDenied as e:
+                results[line_no] = {"line": line_no, "decision": "DENY", "reason": str(e)}
+                continue
+            scan["line"] = line_no
+            scans.append(scan)
+
+        started = time.monotonic()
+        self._verify_all(scans, results)
+        self.timings["verify"] = time.monotonic() - started
+
+        # Capture order; ties (and scans without scannedAt) keep input order.
+        now = timezone.now()
+        scans = [s for s in scans if s["line"] not in results]
+        scans.sort(key=lambda s: (s["scanned_at"] or now, s["line"]))
+
+        for i in range(0, len(scans), self.chunk_size):
+            self._apply_chunk(scans[i:i + self.chunk_size], results)
+
+        return [results[line_no] for line_no in sorted(results)]
+
+    def _verify_all(self, scans, results):
+        key = self.key_manager.get()  # fail fast (MissingPublicKeyError) before forking
+        tasks = [
+            (s["token"], self.test_mode, s["scanned_at"].timestamp() if s["scanned_at"] else None)
+            for s in scans
+        ]
+        workers = min(self.workers, len(tasks) // MIN_TOKENS_PER_WORKER)
+        if workers > 1:
+            # Forked workers must not share the parent's DB socket; Django reconnects lazily.
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_verify_worker,
+                initargs=(str(self.key_path),),
+            ) as pool:
+                verified = list(pool.map(_verify, tasks, chunksize=64))
+        else:
+            global _worker_key
+            _worker_key = key
+            verified = [_verify(task) for task in tasks]
+
+        for scan, (payload, is_expired, reason) in zip(scans, verified):
+            if reason:
+                results[scan["line"]] = {"line": scan["line"], "decision": "DENY", "reason": reason}
+            else:
+                scan["payload"], scan["is_expired"] = payload, is_expired
+
+    def _apply_chunk(self, scans, results):
+        started = time.monotonic()
+        entry_ids, rolls = set(), set()
+        for scan in scans:
+            try:
+                entry_id = _parse_entry_id(scan["payload"].get("entryId"))
+            except ScanDenied:
+                entry_id = None  # denied again (with the same reason) when applied
+            if entry_id:
+                entry_ids.add(entry_id)
+            if scan["payload"].get("roll"):
+                rolls.add(scan["payload"]["roll"])
+
+        index = OpenEntryIndex()
+        index.load_for(entry_ids, rolls)
+        writer = BatchScanWriter(index)
+        processor = ScanProcessor(self.key_manager, index=index, writer=writer)
+
+        for scan in scans:
+            line_no = scan["line"]
+            try:
+                result = processor.apply(
+                    scan["payload"],
+                    scan["is_expired"],
+                    mode=scan["mode"],
+                    test_mode=self.test_mode,
+                    override_scanned_at=scan["scanned_at"],
+                )
+            except ScanDenied as e:
+                results[line_no] = {"line": line_no, "decision": "DENY", "reason": str(e), "notes": e.notes}
+                continue
+            results[line_no] = {
+                "line": line_no,
+                "decision": "ALLOW",
+                "mode": result["mode"],
+                "roll": result["roll"],
+                "flag": result["flag"],
+                "id": result["id"],
+                "notes": result["notes"],
+            }
+        applied = time.monotonic()
+        self.timings["apply"] += applied - started
+
+        writer.flush(batch_size=self.chunk_size)
+        self.timings["write"] += time.monotonic() - applied
@@ -0,0 +1,102 @@
+"""
+Adaptive (AIMD) sync batch size for sync_to_backend.
+
+One BatchSizer is shared by all drain partitions. Like TCP congestion control:
+
+  - additive increase: every full batch acked within SYNC_TARGET_RTT_MS grows
+    the size by `step` events
+  - multiplicative decrease: a slow batch, a timeout/5xx, or a busy response
+    (429/503) halves it; a 413 cuts it below the batch that was refused
+
+A decrease only counts for batches sent at the current size, so several
+partitions reporting the same overload (their batches were already in
+flight) shrink it once, not once each.
+
+The backend can send X-Sync-Batch-Size (on any response) when it is under
+load; that caps the size until a response comes without it.
+"""
+
+import threading
+
+
+class BatchSizer:
+    def __init__(
+        self,
+        initial: int,
+        min_size: int = 20,
+        max_size: int = 500,
+        target_rtt_ms: int = 1000,
+        step: int | None = None,
+        adaptive: bool = True,
+    ):
+        self.min_size = max(1, min(min_size, initial))
+        self.max_size = max(initial, max_size)
+        self.target_rtt_s = target_rtt_ms / 1000
+        self.step = step or max(1, self.min_size // 2)
+        self.adaptive = adaptive
+        self._size = initial
+        self._ceiling = self.max_size
+        self._lock = threading.Lock()
+        self.increases = 0
+        self.decreases = 0
+        self.smallest = self.largest = initial
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _set(self, size: int) -> None:
+        self._size = max(self.min_size, min(self._ceiling, size))
+        self.smallest = min(self.smallest, self._size)
+        self.largest = max(self.largest, self._size)
+
+    def _hint(self, suggested: int | None) -> None:
+        self._ceiling = self.max_size if not suggested else max(self.min_size, min(self.max_size, suggested))
+
+    def on_success(self, rows: int, rtt_s: float, sent_at_size: int, suggested: int | None = None) -> None:
+        if not self.adaptive:
+            return
+        with self._lock:
+            self._hint(suggested)
+            if rtt_s > self.target_rtt_s:
+                self._decrease(sent_at_size)
+            elif rows >= self._size:
+                # Only a full batch says anything about whether a larger one would fit.
+                self.increases += 1
+                self._set(self._size + self.step)
+            else:
+                self._set(self._size)  # apply a lowered ceiling
+
+    def on_overload(self, sent_at_size: int, suggested: int | None = None) -> None:
+        if not self.adaptive:
+            return
+        with self._lock:
+            self._hint(suggested)
+            self._decrease(sent_at_size)
+
+    def on_too_large(self, rows: int, suggested: int | None = None) -> None:
+        """The backend refused a batch of `rows` events (413). Applies even with a fixed size."""
+        with self._lock:
+            self.decreases += 1
+            if suggested:
+                # The backend's hard limit (SYNC_MAX_EVENTS): never grow past it again.
+                self.max_size = max(1, min(self.max_size, suggested))
+            target = max(1, min(self._size, suggested or rows // 2))
+            self.min_size = min(self.min_size, target)
+            self._ceiling = min(self._ceiling, self.max_size)
+            self._set(target)
+
+    def _decrease(self, sent_at_size: int) -> None:
+        if sent_at_size > self._size:
+            self._set(self._size)  # sent before the last decrease: already shrunk for this overload
+            return
+        self.decreases += 1
+        self._set(self._size // 2)
+
+    def describe(self) -> str:
+        if not self.adaptive:
+            return f"batch size {self._size} (fixed)"
+        return (
+            f"batch size {self._size} (range {self.smallest}-{self.largest}, "
+            f"+{self.increases}/-{self.decreases} adjustments)"
+        )
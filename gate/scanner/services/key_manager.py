@@ -0,0 +1,54 @@
+"""
+Gate public key manager.
+
+Parses the backend's public key PEM once and keeps the key object in memory.
+The file is only re-read when its mtime changes (key rotation), so a warm
+process pays a single stat() per scan instead of a read + PEM parse.
+"""
+
+import threading
+from pathlib import Path
+
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from django.conf import settings
+
+
+MISSING_KEY_MESSAGE = (
+    "DENY: missing gate public key at gate/keys/public.pem\n"
+    "Dev setup:\n"
+    "  cp backend/keys/public.pem gate/keys/public.pem\n"
+    "Prod setup:\n"
+    "  mount gate/keys/public.pem into the container/host"
+)
+
+
+class MissingPublicKeyError(FileNotFoundError):
+    """Raised when the gate public key PEM does not exist."""
+
+
+def default_public_key_path() -> Path:
+    return Path(settings.BASE_DIR) / "keys" / "public.pem"
+
+
+class PublicKeyManager:
+    """Caches the parsed RSA public key, reloading it when the PEM file changes."""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else default_public_key_path()
+        self._key = None
+        self._mtime_ns = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the parsed public key, reloading if the file was replaced."""
+        try:
+            mtime_ns = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            raise MissingPublicKeyError(MISSING_KEY_MESSAGE)
+
+        if self._key is None or mtime_ns != self._mtime_ns:
+            with self._lock:
+                if self._key is None or mtime_ns != self._mtime_ns:
+                    self._key = load_pem_public_key(self.path.read_bytes())
+                    self._mtime_ns = mtime_ns
+        return self._key
@@ -0,0 +1,167 @@
+"""
+Resident open-entry index for single-gate deployments.
+
+When the gate process is the only writer of the gate DB, scan decisions
+(FORCED_ENTRY / DUPLICATE_SCAN / DUPLICATE_EXIT / ORPHAN_EXIT) can be made from
+memory instead of asking Postgres on every scan. The index holds:
+
+  - every entry created within the last OPEN_ENTRY_INDEX_WINDOW_HOURS
+  - every ENTERED entry regardless of age
+
+keyed by entryId (status + exit-seen bit + the snapshot fields the outbox
+events need) and by roll (open entry ids). It is warmed from the DB at startup,
+updated write-through after each committed scan, and periodically rebuilt from
+the DB (`verify`) so drift from other writers (auto_exit_midnight, manual
+fixes) is corrected.
+
+`load_for` instead loads just the rows a known set of scans can touch
+(process_token --batch), which makes every lookup for that set authoritative.
+"""
+
+import copy
+from datetime import timedelta
+
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from shared.apps.entries.models import EntryLog, ExitLog
+
+
+class OpenEntryIndex:
+    def __init__(self, window_hours: int = 48):
+        self.window = timedelta(hours=window_hours)
+        self.horizon = None      # every entry created at/after this is indexed
+        self.complete = False    # loaded with load_for(): every lookup is authoritative
+        self._entries = {}       # entry_id (UUID) -> EntryLog (annotated with has_exit)
+        self._open_by_roll = {}  # roll -> set(entry_id) with status ENTERED
+        self.hits = 0
+        self.fallbacks = 0
+
+    # ------------------------------------------------------------------
+    # Loading / verification
+    # ------------------------------------------------------------------
+    def _load(self):
+        horizon = timezone.now() - self.window
+        return (horizon, *self._collect(Q(created_at__gte=horizon) | Q(status="ENTERED")))
+
+    def _collect(self, lookup):
+        rows = EntryLog.objects.filter(lookup).annotate(
+            has_exit=Exists(ExitLog.objects.filter(entry_id=OuterRef("pk")))
+        )
+        entries = {}
+        open_by_roll = {}
+        for row in rows.iterator(chunk_size=2000):
+            entries[row.id] = row
+            if row.status == "ENTERED":
+                open_by_roll.setdefault(row.roll_id, set()).add(row.id)
+        return entries, open_by_roll
+
+    def warm(self) -> int:
+        """Load the index from the DB. Returns the number of indexed entries."""
+        self.horizon, self._entries, self._open_by_roll = self._load()
+        return len(self._entries)
+
+    def load_for(self, entry_ids, rolls) -> int:
+        """
+        Load only the given entries and the open entries of the given rolls.
+
+        Callers must only look up those ids/rolls afterwards. Returns the number
+        of indexed entries.
+        """
+        self._entries, self._open_by_roll = self._collect(
+            Q(id__in=list(entry_ids)) | Q(roll_id__in=list(rolls), status="ENTERED")
+        )
+        self.complete = True
+        return len(self._entries)
+
+    def verify(self) -> list[str]:
+        """
+        Cross-check against the DB and adopt the DB state.
+
+        Also acts as pruning: closed entries older than the window drop out and
+        the horizon moves forward. Returns human-readable mismatches.
+        """
+        horizon, entries, open_by_roll = self._load()
+        mismatches = []
+        for entry_id, row in entries.items():
+            cached = self._entries.get(entry_id)
+            if cached is None:
+                mismatches.append(f"{entry_id}: missing from index")
+            elif (cached.status, cached.has_exit) != (row.status, row.has_exit):
+                mismatches.append(
+                    f"{entry_id}: index={cached.status}/exit={cached.has_exit} db={row.status}/exit={row.has_exit}"
+                )
+        for entry_id, cached in self._entries.items():
+            if entry_id not in entries and cached.status == "ENTERED":
+                mismatches.append(f"{entry_id}: open in index but not in DB")
+
+        self.horizon, self._entries, self._open_by_roll = horizon, entries, open_by_roll
+        return mismatches
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+    def can_answer(self, entry_id, issued_at) -> bool:
+        """
+        True if a lookup for `entry_id` is authoritative.
+
+        Open entries are always indexed. A specific entryId is only guaranteed
+        to be indexed if its token was issued after the horizon (the gate
+        creates entry rows at scan time, which is after the token's iat).
+        """
+        if self.complete:
+            return True
+        if self.horizon is None:
+            return False
+        if entry_id is None:
+            return True
+        return issued_at is not None and issued_at >= self.horizon.timestamp()
+
+    def get(self, entry_id):
+        row = self._entries.get(entry_id)
+        return copy.copy(row) if row is not None else None
+
+    def open_for_roll(self, roll) -> list:
+        """ENTERED entries for `roll`, most recent first."""
+        rows = [self._entries[i] for i in self._open_by_roll.get(roll, ())]
+        rows.sort(key=lambda r: r.created_at, reverse=True)
+        return [copy.copy(r) for r in rows]
+
+    # ------------------------------------------------------------------
+    # Write-through updates (call after the scan transaction commits)
+    # ------------------------------------------------------------------
+    def record_entry(self, entry):
+        entry = copy.copy(entry)
+        entry.has_exit = False
+        self._entries[entry.id] = entry
+        if entry.status == "ENTERED":
+            self._open_by_roll.setdefault(entry.roll_id, set()).add(entry.id)
+
+    def set_status(self, entry_ids, status, scanned_at=None):
+        for entry_id in entry_ids:
+            row = self._entries.get(entry_id)
+            if row is None:
+                continue
+            row.status = status
+            if scanned_at is not None:
+                row.scanned_at = scanned_at
+            if status != "ENTERED":
+                open_ids = self._open_by_roll.get(row.roll_id)
+                if open_ids:
+                    open_ids.discard(entry_id)
+                    if not open_ids:
+                        del self._open_by_roll[row.roll_id]
+
+    def mark_exited(self, entry_id):
+        self.set_status([entry_id], "EXITED")
+        row = self._entries.get(entry_id)
+        if row is not None:
+            row.has_exit = True
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "openRolls": len(self._open_by_roll),
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+        }
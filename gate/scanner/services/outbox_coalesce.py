@@ -0,0 +1,105 @@
+"""
+Coalescing of superseded outbox events before a sync batch is sent.
+
+Between two sync cycles one entry can collect several events: its ENTRY
+snapshot, then ENTRY_STATUS EXITED / EXPIRED, or (older outbox rows) repeated
+full snapshots. The backend applies them in order with latest-scanned_at-wins,
+so only the resulting snapshot matters. `coalesce_events` folds every later
+snapshot / status event of an entry into the snapshot of that entry earlier in
+the batch, applying the same rules the backend does:
+
+  - a later snapshot replaces the current one if its scannedAt is not older
+    (a missing createdAt keeps the current one)
+  - a status change applies if its ts is not older than the snapshot's
+    scannedAt; EXPIRED also moves scannedAt to ts
+
+The merged event keeps the position of that snapshot (so EXIT events
+after it still find the entry) and travels under the eventId of the newest
+event folded into it: that id was never sent with an older payload, so the
+backend's idempotency check can't skip the merged state. The other ids are
+returned per carrier so the caller acks (or rejects) them with it.
+
+Events that can't be folded without changing the outcome are sent as they
+are: status events without a snapshot earlier in the batch, invalid status
+events (the backend rejects those) and EXIT events, which are rows of their own.
+"""
+
+from scanner.services.scan_service import parse_iso_datetime
+
+
+SNAPSHOT_TYPES = ("ENTRY", "ENTRY_EXPIRED_SEEN")
+ENTRY_STATUSES = ("PENDING", "ENTERED", "EXITED", "EXPIRED")
+
+
+def _ts(value):
+    try:
+        return parse_iso_datetime(value)
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def _merge_snapshot(current: dict, incoming: dict) -> dict | None:
+    """Snapshot after applying `incoming` on top of `current`, or None if it can't be folded."""
+    current_ts = _ts(current.get("scannedAt"))
+    incoming_ts = _ts(incoming.get("scannedAt"))
+    if current_ts is None or incoming_ts is None:
+        # The backend stamps a missing scannedAt with its own clock; keep such events separate.
+        return None
+    if incoming_ts < current_ts:
+        return dict(current)  # older replay: ignored by the backend
+    merged = dict(incoming)
+    if not merged.get("createdAt"):
+        merged["createdAt"] = current.get("createdAt")
+    return merged
+
+
+def _merge_status(current: dict, incoming: dict) -> dict | None:
+    """Snapshot after applying the ENTRY_STATUS `incoming`, or None if it can't be folded."""
+    current_ts = _ts(current.get("scannedAt"))
+    ts = _ts(incoming.get("ts"))
+    status = incoming.get("status")
+    if current_ts is None or ts is None or not incoming.get("roll") or status not in ENTRY_STATUSES:
+        return None
+    if ts < current_ts:
+        return dict(current)
+    merged = dict(current, status=status)
+    if status == "EXPIRED":
+        # The gate moves scanned_at to the expiry time; EXITED keeps the entry time.
+        merged["scannedAt"] = incoming["ts"]
+    return merged
+
+
+def coalesce_events(events: list[dict]) -> tuple[list[dict], dict[str, list[str]]]:
+    """
+    Fold superseded events of the same entry into one snapshot.
+
+    `events` are wire events (with eventId and type) in outbox order. Returns the
+    events to send and {carrier eventId: [eventIds folded into it]}.
+    """
+    out = []
+    snapshot_at = {}  # entryId -> index in `out` of its (merged) snapshot
+    folded = {}
+
+    for event in events:
+        entry_id = event.get("entryId")
+        index = snapshot_at.get(entry_id) if entry_id else None
+        merged = None
+        if index is not None:
+            if event.get("type") in SNAPSHOT_TYPES:
+                merged = _merge_snapshot(out[index], event)
+            elif event.get("type") == "ENTRY_STATUS":
+                merged = _merge_status(out[index], event)
+
+        if merged is None:
+            if entry_id and event.get("type") in SNAPSHOT_TYPES:
+                # Later events fold into the newest snapshot, so they stay behind it.
+                snapshot_at[entry_id] = len(out)
+            out.append(event)
+            continue
+
+        previous_id = out[index]["eventId"]
+        merged["eventId"] = event["eventId"]
+        folded[event["eventId"]] = folded.pop(previous_id, []) + [previous_id]
+        out[index] = merged
+
+    return out, folded
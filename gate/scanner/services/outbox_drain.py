@@ -0,0 +1,622 @@
+"""
+Outbox draining for sync_to_backend.
+
+Due OutboxEvent rows are split into `inflight` partitions by roll (falling back
+to entryId, then eventId), so all events of one roll travel in one ordered
+stream. Each partition has a worker thread with its own keep-alive SyncClient
+and DB connection; a partition sends its next batch only after the previous
+one was acknowledged, while up to `inflight` partitions have a batch in flight
+at the same time. When a batch fails, the partition's queued rows go back to
+the outbox and later rows of the batch's rolls are held back until its retry
+is due, so a roll's events never overtake a failed one. Before a batch is sent, superseded events of the same entry
+are folded into one snapshot (outbox_coalesce); the folded ids are acked with it.
+
+The coordinator (caller's thread) keeps the partition queues topped up from the
+outbox and only sleeps when nothing is due, or after a failed batch so a
+backend outage doesn't burn through the retry schedule of the whole backlog.
+With an OutboxListener (Postgres) an idle coordinator blocks on LISTEN instead
+of sleeping, until new events are committed, the next retry is due or the
+polling fallback expires.
+
+Batch size comes from a shared BatchSizer (AIMD on round-trip time, errors and
+413s, capped by the backend's X-Sync-Batch-Size hint). A 413 splits the batch
+and resends it right away; a busy backend (429/503 + Retry-After) defers the
+batch and pauses all partitions for that long without counting an attempt.
+
+`drain_stream` is the catch-up alternative: up to `max_events` due events go
+out as one NDJSON request to the streaming endpoint, and each micro-batch the
+backend commits is marked sent as its ack line arrives. If the stream breaks,
+what was acked stays sent and the rest stays due for the next run.
+
+Events older than the replay horizon are never sent: the backend forgets
+event ids after its retention (SYNC_PROCESSED_RETENTION_DAYS), so a late
+replay could be applied twice. The horizon is `replay_horizon` ago, or the
+`replayHorizon` the backend last advertised plus a margin, whichever is later.
+Such events are marked sent with an "expired" error (like rejects) and left to
+reconcile_sync.
+
+Every event goes out with its outbox `seq`, and a carrier of folded events
+with their `foldedSeqs`, so the backend can advance this gate's cursor (see
+outbox_seq). With `report_cursor`, the drainer reports its newest seq when it
+starts and after each drained backlog, logs the lag, and marks events the
+backend already has as sent (an ack lost to a crash or a timeout).
+"""
+
+import json
+import random
+import threading
+import time
+import zlib
+from datetime import timedelta
+
+from django.db import connection, models, transaction
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from scanner.models import OutboxEvent
+from scanner.services.batch_sizer import BatchSizer
+from scanner.services.outbox_coalesce import coalesce_events
+from scanner.services.outbox_seq import head_seq, mark_durable
+from scanner.services.sync_client import SyncHTTPError
+
+
+def compute_next_retry(attempt_count: int) -> int:
+    """
+    Exponential backoff with jitter.
+    Returns seconds to wait until next retry.
+    """
+    base = 2 ** min(attempt_count, 10)  # caps at ~1024s
+    jitter = random.random()  # 0..1
+    return int(min(300, base + jitter * 2))  # cap at 5 minutes
+
+
+def partition_key(row: OutboxEvent) -> str:
+    payload = row.payload or {}
+    return str(payload.get("roll") or payload.get("entryId") or row.event_id)
+
+
+HORIZON_MARGIN = timedelta(hours=1)  # on top of the backend's horizon, for clock skew
+
+
+def _stamp() -> str:
+    return timezone.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class _Partition:
+    def __init__(self, index: int):
+        self.index = index
+        self.rows = []  # fetched, not yet sent; created_at order
+
+
+class OutboxDrainer:
+    def __init__(
+        self,
+        client_factory,
+        batch_size: int = 200,
+        inflight: int = 1,
+        coalesce: bool = True,
+        sizer: BatchSizer | None = None,
+        replay_horizon: timedelta | None = None,
+        report_cursor: bool = False,
+        stdout=None,
+        stderr=None,
+    ):
+        self.client_factory = client_factory
+        self.report_cursor = report_cursor
+        self._cursor_client = None
+        self.replay_horizon = replay_horizon
+        self._backend_horizon = None  # last replayHorizon the backend advertised
+        self.sizer = sizer or BatchSizer(max(1, batch_size), adaptive=False)
+        self.inflight = max(1, inflight)
+        self.coalesce = coalesce
+        self.stdout = stdout
+        self.stderr = stderr
+        self.clients = []
+        self._cond = threading.Condition()
+        self._pending = set()  # event ids queued in a partition or in flight
+        self._held = {}  # partition key -> (retry time of its failed batch, ids of later rows held back)
+        self._failed = False
+        self._stopping = False
+        self._resume_at = 0.0  # time.monotonic() before which no batch is sent (backend Retry-After)
+        self.idle_polls = 0  # fetches that found nothing due
+        self.coalesced = 0  # events folded into a newer event of the same entry instead of being sent
+        self.deferrals = 0  # batches put back because the backend asked to retry later
+        self.expired = 0  # events older than the replay horizon, marked sent without sending
+        self.already_durable = 0  # unsent events the backend's cursor showed it had, marked sent
+
+    @property
+    def batch_size(self) -> int:
+        return self.sizer.size
+
+    def _out(self, msg: str) -> None:
+        if self.stdout is not None:
+            self.stdout.write(msg)
+
+    def _err(self, msg: str) -> None:
+        if self.stderr is not None:
+            self.stderr.write(msg)
+
+    # ------------------------------------------------------------------
+    # Replay horizon
+    # ------------------------------------------------------------------
+    def horizon(self):
+        """created_at before which events must not be sent, or None."""
+        bounds = []
+        if self.replay_horizon is not None:
+            bounds.append(timezone.now() - self.replay_horizon)
+        if self._backend_horizon is not None:
+            bounds.append(self._backend_horizon + HORIZON_MARGIN)
+        return max(bounds) if bounds else None
+
+    def _unexpired(self, qs):
+        horizon = self.horizon()
+        return qs if horizon is None else qs.filter(created_at__gte=horizon)
+
+    def expire_stale(self) -> int:
+        """Mark unsent events older than the horizon sent with an "expired" error. Returns how many."""
+        horizon = self.horizon()
+        if horizon is None:
+            return 0
+        now = timezone.now()
+        count = OutboxEvent.objects.filter(sent_at__isnull=True, created_at__lt=horizon).update(
+            sent_at=now,
+            last_error=f"expired: older than the replay horizon {horizon.isoformat()}; use reconcile_sync",
+            last_attempt_at=now,
+        )
+        if count:
+            self.expired += count
+            self._err(f"{_stamp()} | {count} unsent events older than {horizon.isoformat()} expired without sending")
+        return count
+
+    # ------------------------------------------------------------------
+    # Sequence cursor
+    # ------------------------------------------------------------------
+    def check_cursor(self) -> dict | None:
+        """
+        Report the newest outbox seq, mark unsent events the backend already has
+        as sent and log the lag. Returns the backend's cursor, or None (no
+        report_cursor, no per-gate key or an older backend, or the request failed).
+        """
+        if not self.report_cursor:
+            return None
+        if self._cursor_client is None:
+            self._cursor_client = self.client_factory()
+            self.clients.append(self._cursor_client)
+        head = head_seq()
+        try:
+            cursor = self._cursor_client.post_cursor(head)
+        except SyncHTTPError as e:
+            if e.code in (400, 404):
+                # Shared GATE_API_KEY or a backend without cursors: events are deduplicated by id alone.
+                self.report_cursor = False
+                self._err(f"{_stamp()} | no sequence cursor on the backend for this gate: {e}")
+            else:
+                self._err(f"{_stamp()} | sequence cursor unavailable: {e}")
+            return None
+        except Exception as e:
+            self._err(f"{_stamp()} | sequence cursor unavailable: {e}")
+            return None
+        finally:
+            self._cursor_client.close()
+
+        marked = mark_durable(cursor)
+        self.already_durable += marked
+        self._out(
+            f"{_stamp()} | cursor: backend durable up to seq {cursor.get('lastDurableSeq')} "
+            f"(high water {cursor.get('highWaterSeq')}, {len(cursor.get('gaps') or ())} gaps), "
+            f"local head {head}, lag {cursor.get('lagEvents')} events"
+            + (f"; {marked} unsent events already there, marked sent" if marked else "")
+        )
+        return cursor
+
+    # ------------------------------------------------------------------
+    # One batch
+    # ------------------------------------------------------------------
+    def fetch(self, limit: int, exclude=()) -> list[OutboxEvent]:
+        now = timezone.now()
+        with transaction.atomic():
+            qs = self._unexpired(
+                OutboxEvent.objects.select_for_update(skip_locked=True)
+                .filter(sent_at__isnull=True)
+                .filter(models.Q(next_retry_at__isnull=True) | models.Q(next_retry_at__lte=now))
+            )
+            if exclude:
+                qs = qs.exclude(event_id__in=list(exclude))
+            return list(qs.order_by("created_at")[:limit])
+
+    @staticmethod
+    def _events(rows: list[OutboxEvent]) -> list[dict]:
+        events = []
+        for row in rows:
+            payload = dict(row.payload or {})
+            payload["eventId"] = str(row.event_id)
+            payload["type"] = row.event_type
+            events.append(payload)
+        return events
+
+    @staticmethod
+    def _add_seqs(events: list[dict], folded: dict, rows: list[OutboxEvent]) -> None:
+        """Put each event's outbox seq on it, and on a carrier the seqs of the events folded into it."""
+        seqs = {str(row.event_id): row.seq for row in rows if row.seq is not None}
+        for event in events:
+            seq = seqs.get(event["eventId"])
+            if seq is not None:
+                event["seq"] = seq
+            folded_seqs = sorted(seqs[ev_id] for ev_id in folded.get(event["eventId"], ()) if ev_id in seqs)
+            if folded_seqs:
+                event["foldedSeqs"] = folded_seqs
+
+    def record_results(self, resp: dict, folded: dict) -> tuple[set, dict]:
+        """Mark the acked and rejected events of a backend response sent. Returns (acked ids, {id: error})."""
+        acked_ids = set(resp.get("ackedEventIds") or [])
+        rejected = resp.get("rejected") or []
+        rejected_map = {str(r.get("eventId")): str(r.get("error")) for r in rejected if r.get("eventId")}
+        if resp.get("replayHorizon"):
+            self._backend_horizon = parse_datetime(resp["replayHorizon"])
+        # Folded events share the fate of the event that carried their merged state.
+        for carrier_id in list(acked_ids) + list(rejected_map):
+            folded_ids = folded.pop(carrier_id, ())
+            if carrier_id in acked_ids:
+                acked_ids.update(folded_ids)
+            else:
+                for ev_id in folded_ids:
+                    rejected_map[ev_id] = f"coalesced into {carrier_id}: {rejected_map[carrier_id]}"
+
+        sent_ts = timezone.now()
+        with transaction.atomic():
+            if acked_ids:
+                OutboxEvent.objects.filter(event_id__in=acked_ids).update(sent_at=sent_ts, last_error="")
+            if rejected_map:
+                # Treat rejects as permanently failed (mark sent) to avoid infinite retry loops.
+                for ev_id, err in rejected_map.items():
+                    OutboxEvent.objects.filter(event_id=ev_id).update(
+                        sent_at=sent_ts,
+                        last_error=f"rejected: {err}",
+                        last_attempt_at=sent_ts,
+                    )
+        return acked_ids, rejected_map
+
+    def send(self, client, batch: list[OutboxEvent], label: str = "") -> bool:
+        """POST one batch and record acks/rejects, or schedule a retry. Returns False if the batch failed."""
+        events = self._events(batch)
+
+        folded = {}
+        if self.coalesce:
+            events, folded = coalesce_events(events)
+        self._add_seqs(events, folded, batch)
+
+        sent_at_size = self.sizer.size
+        try:
+            resp = client.post_events(events)
+            acked_ids, rejected_map = self.record_results(resp, folded)
+
+            last = client.last or {}
+            self.sizer.on_success(len(batch), (last.get("rttMs") or 0) / 1000, sent_at_size, last.get("suggestedBatchSize"))
+            with self._cond:
+                self.coalesced += len(batch) - len(events)
+            self._out(
+                f"{_stamp()} | synced {label}batch={len(batch)} sent={len(events)} acked={len(acked_ids)} "
+                f"rejected={len(rejected_map)} next={self.sizer.size} {client.describe_last()}"
+            )
+            return True
+        except SyncHTTPError as e:
+            if e.code == 413 and len(batch) > 1:
+                # Too many events (or bytes) for the backend: resend in smaller pieces now, no retry penalty.
+                self.sizer.on_too_large(len(batch), e.suggested_batch_size)
+                step = max(1, min(self.sizer.size, len(batch) // 2))
+                self._err(f"{_stamp()} | sync {label}batch={len(batch)} too large for backend, resending by {step}")
+                return all(self.send(client, batch[i:i + step], label) for i in range(0, len(batch), step))
+            if e.code in (429, 503) and e.retry_after is not None:
+                self.sizer.on_overload(sent_at_size, e.suggested_batch_size)
+                self.defer(batch, e.retry_after, str(e))
+                return False
+            if e.code >= 500 or e.code == 429:
+                self.sizer.on_overload(sent_at_size, e.suggested_batch_size)
+            # 4xx/5xx with body
+            self.mark_retry(batch, str(e))
+        except Exception as e:
+            # Timeout / connection error: as much an overload signal as a 5xx.
+            self.sizer.on_overload(sent_at_size)
+            self.mark_retry(batch, str(e))
+        return False
+
+    def defer(self, batch: list[OutboxEvent], delay_s: float, err: str) -> None:
+        """Backend is busy: retry the batch after `delay_s` (its Retry-After), without counting an attempt."""
+        now = timezone.now()
+        retry_at = now + timedelta(seconds=delay_s)
+        for row in batch:
+            row.last_attempt_at = now
+            row.next_retry_at = retry_at
+            row.last_error = f"deferred: {err}"[:2000]
+        OutboxEvent.objects.bulk_update(batch, fields=["last_attempt_at", "next_retry_at", "last_error"])
+        with self._cond:
+            self.deferrals += 1
+            self._resume_at = max(self._resume_at, time.monotonic() + delay_s)
+        self._err(
+            f"{_stamp()} | backend busy; deferred {len(batch)} events by {delay_s:g}s, batch size now {self.sizer.size}"
+        )
+
+    def mark_retry(self, batch: list[OutboxEvent], err: str) -> None:
+        now = timezone.now()
+
+        # Update objects in memory first
+        for row in batch:
+            row.attempt_count = (row.attempt_count or 0) + 1
+            delay_s = compute_next_retry(row.attempt_count)
+            row.last_attempt_at = now
+            row.next_retry_at = now + timedelta(seconds=delay_s)
+            row.last_error = err[:2000]
+
+        # Push all changes to DB in one go
+        OutboxEvent.objects.bulk_update(
+            batch,
+            fields=["attempt_count", "last_attempt_at", "next_retry_at", "last_error"]
+        )
+        self._err(f"{_stamp()} | sync failed; scheduled retry for {len(batch)} events: {err}")
+
+    def run_once(self) -> int:
+        """Send a single batch from the calling thread. Returns the number of events in it."""
+        self.expire_stale()
+        self.check_cursor()
+        client = self.client_factory()
+        self.clients.append(client)
+        batch = self.fetch(self.batch_size)
+        if batch:
+            self.send(client, batch)
+        client.close()
+        return len(batch)
+
+    # ------------------------------------------------------------------
+    # Pipelined drain
+    # ------------------------------------------------------------------
+    def drain(self, sleep_s: float, until_empty: bool = False, listener=None, listen_fallback_s: float = 60) -> None:
+        """
+        Drain the outbox with `inflight` partitions; with `until_empty`, return once nothing is due.
+
+        When idle, waits on `listener` (if given) for up to `listen_fallback_s`,
+        otherwise sleeps `sleep_s` between polls.
+        """
+        self._stopping = False
+        self.expire_stale()
+        self.check_cursor()
+        partitions = [_Partition(i) for i in range(self.inflight)]
+        threads = [
+            threading.Thread(target=self._worker, args=(p,), name=f"outbox-drain-{p.index}", daemon=True)
+            for p in partitions
+        ]
+        for thread in threads:
+            thread.start()
+
+        cycle_started, cycle_events = None, 0
+        try:
+            while True:
+                with self._cond:
+                    # Bound read-ahead to about one batch per partition queued behind the in-flight ones.
+                    while sum(len(p.rows) for p in partitions) >= self.inflight * self.batch_size:
+                        self._cond.wait()
+                    self._release_held()
+                    exclude = self._pending.union(*(ids for _, ids in self._held.values()))
+                    failed, self._failed = self._failed, False
+
+                rows = [] if failed else self.fetch(self.inflight * self.batch_size, exclude)
+                if not rows and not failed and not exclude:
+                    self.idle_polls += 1
+                if rows:
+                    if cycle_started is None:
+                        cycle_started = time.monotonic()
+                    cycle_events += len(rows)
+                    with self._cond:
+                        for row in rows:
+                            key = partition_key(row)
+                            if key in self._held:
+                                self._held[key][1].add(row.event_id)
+                                continue
+                            partitions[zlib.crc32(key.encode()) % self.inflight].rows.append(row)
+                            self._pending.add(row.event_id)
+                        self._cond.notify_all()
+                    continue
+
+                # Nothing due (or a batch failed): let in-flight batches finish before deciding.
+                with self._cond:
+                    while self._pending:
+                        self._cond.wait()
+                if cycle_started is not None and not failed:
+                    elapsed = time.monotonic() - cycle_started
+                    self._out(
+                        f"{_stamp()} | drained events={cycle_events} in {elapsed:.1f}s "
+                        f"({cycle_events / elapsed if elapsed else 0:.0f} events/s, inflight={self.inflight})"
+                    )
+                    cycle_started, cycle_events = None, 0
+                    self.check_cursor()
+                if until_empty and not failed:
+                    return
+                self.expire_stale()
+                if failed or listener is None:
+                    time.sleep(sleep_s)
+                else:
+                    self._wait_for_events(listener, listen_fallback_s, sleep_s)
+        finally:
+            with self._cond:
+                self._stopping = True
+                for p in partitions:
+                    p.rows.clear()  # unsent rows stay unsent in the outbox
+                self._cond.notify_all()
+            for thread in threads:
+                thread.join()
+
+    def _wait_for_events(self, listener, fallback_s: float, sleep_s: float) -> None:
+        """Block until the outbox is notified, the earliest scheduled retry is due, or `fallback_s` passes."""
+        timeout = fallback_s
+        next_retry = (
+            OutboxEvent.objects.filter(sent_at__isnull=True, next_retry_at__isnull=False)
+            .aggregate(due=Min("next_retry_at"))["due"]
+        )
+        if next_retry is not None:
+            timeout = min(timeout, max(0.0, (next_retry - timezone.now()).total_seconds()))
+        try:
+            listener.wait(timeout)
+        except Exception as e:
+            # Lost the LISTEN connection: poll until it can be re-established on the next idle wait.
+            listener.close()
+            self._err(f"{_stamp()} | outbox LISTEN failed, polling every {sleep_s}s: {e}")
+            time.sleep(sleep_s)
+
+    def _hold_after_failure(self, partition: _Partition, batch: list[OutboxEvent]) -> None:
+        """
+        Keep each roll in order after `batch` failed (call with self._cond held): the
+        partition's queued rows go back to the outbox, and rows of the batch's rolls
+        are held back until its retry is due, so they can't overtake it.
+        """
+        self._pending.difference_update(row.event_id for row in partition.rows)
+        partition.rows.clear()
+        now = timezone.now()
+        for row in batch:
+            if row.next_retry_at is not None and row.next_retry_at > now:
+                key = partition_key(row)
+                retry_at, ids = self._held.get(key, (now, set()))
+                self._held[key] = (max(retry_at, row.next_retry_at), ids)
+
+    def _release_held(self) -> None:
+        """Stop holding back the rolls whose failed batch is due again (call with self._cond held)."""
+        now = timezone.now()
+        for key in [key for key, (retry_at, _) in self._held.items() if retry_at <= now]:
+            del self._held[key]
+
+    def _worker(self, partition: _Partition) -> None:
+        client = self.client_factory()
+        self.clients.append(client)
+        try:
+            while True:
+                with self._cond:
+                    while not partition.rows and not self._stopping:
+                        self._cond.wait()
+                    if self._stopping:
+                        return
+                    # Backend asked for a pause (Retry-After): hold the next batch until then.
+                    while not self._stopping and (delay := self._resume_at - time.monotonic()) > 0:
+                        self._cond.wait(timeout=delay)
+                    if self._stopping:
+                        return
+                    size = self.sizer.size
+                    batch = partition.rows[:size]
+                    del partition.rows[:size]
+                    self._cond.notify_all()
+
+                try:
+                    ok = self.send(client, batch, label=f"p{partition.index} ")
+                except Exception as e:
+                    # mark_retry itself failed (DB unavailable); the rows stay due and are fetched again.
+                    self._err(f"{_stamp()} | sync p{partition.index} failed: {e}")
+                    connection.close()
+                    ok = False
+
+                with self._cond:
+                    self._pending.difference_update(row.event_id for row in batch)
+                    if not ok:
+                        self._failed = True
+                        self._hold_after_failure(partition, batch)
+                    self._cond.notify_all()
+        finally:
+            client.close()
+            connection.close()
+
+    # ------------------------------------------------------------------
+    # Streaming catch-up
+    # ------------------------------------------------------------------
+    def _stream_lines(self, rows, folded: dict):
+        """Encoded NDJSON lines for `rows`, coalesced one batch-size page at a time."""
+        page = []
+        for row in rows:
+            page.append(row)
+            if len(page) >= self.sizer.size:
+                yield from self._page_lines(page, folded)
+                page = []
+        if page:
+            yield from self._page_lines(page, folded)
+
+    def _page_lines(self, page: list[OutboxEvent], folded: dict):
+        events = self._events(page)
+        page_folded = {}
+        if self.coalesce:
+            events, page_folded = coalesce_events(events)
+            folded.update(page_folded)
+            self.coalesced += len(page) - len(events)
+        self._add_seqs(events, page_folded, page)
+        for event in events:
+            yield (json.dumps(event) + "\n").encode("utf-8")
+
+    def stream(self, client, max_events: int) -> tuple[int, int]:
+        """
+        Send up to `max_events` due events in one streaming request, marking each
+        acked micro-batch sent as it arrives. Returns (events read, events acked or rejected);
+        raises like SyncClient.post_event_stream.
+        """
+        now = timezone.now()
+        rows = (
+            self._unexpired(OutboxEvent.objects.filter(sent_at__isnull=True))
+            .filter(models.Q(next_retry_at__isnull=True) | models.Q(next_retry_at__lte=now))
+            .order_by("created_at")
+            .only("event_id", "event_type", "payload", "seq")[:max_events]
+        )
+        read = 0
+        resolved = 0
+        folded = {}  # carrier id -> folded ids, until the carrier is acked
+
+        def counted(iterable):
+            nonlocal read
+            for row in iterable:
+                read += 1
+                yield row
+
+        def on_result(message):
+            nonlocal resolved
+            acked_ids, rejected_map = self.record_results(message, folded)
+            resolved += len(acked_ids) + len(rejected_map)
+            self._out(
+                f"{_stamp()} | streamed acked={len(acked_ids)} rejected={len(rejected_map)} "
+                f"total={resolved}/{read}"
+            )
+
+        if not rows.exists():
+            return 0, 0
+        client.post_event_stream(self._stream_lines(counted(rows.iterator(chunk_size=2000)), folded), on_result)
+        return read, resolved
+
+    def drain_stream(self, max_events: int) -> bool:
+        """Stream due events, `max_events` per request, until nothing is due. Returns False if a stream failed."""
+        self.expire_stale()
+        self.check_cursor()
+        client = self.client_factory()
+        self.clients.append(client)
+        started, total = time.monotonic(), 0
+        try:
+            while True:
+                try:
+                    read, resolved = self.stream(client, max_events)
+                except SyncHTTPError as e:
+                    if e.code in (429, 503) and e.retry_after is not None:
+                        self.deferrals += 1
+                        self._err(f"{_stamp()} | backend busy; streaming again in {e.retry_after:g}s")
+                        time.sleep(e.retry_after)
+                        continue
+                    self._err(f"{_stamp()} | sync stream refused: {e}")
+                    return False
+                except Exception as e:
+                    self._err(f"{_stamp()} | sync stream failed, unacked events stay due: {e}")
+                    return False
+                total += resolved
+                if read == 0:
+                    break
+                if resolved < read:
+                    # The backend confirmed the stream without answering for every event; don't resend in a loop.
+                    self._err(f"{_stamp()} | sync stream left {read - resolved} events unanswered; they stay due")
+                    return False
+        finally:
+            client.close()
+        elapsed = time.monotonic() - started
+        self._out(
+            f"{_stamp()} | drained events={total} in {elapsed:.1f}s "
+            f"({total / elapsed if elapsed else 0:.0f} events/s, streamed)"
+        )
+        return True
@@ -0,0 +1,84 @@
+"""
+Outbox insert notifications (Postgres LISTEN/NOTIFY).
+
+Migration 0002 installs a statement-level trigger on gate_outbox_events that
+runs `pg_notify('gate_outbox', '')`. Postgres delivers it when the inserting
+transaction commits (once per transaction, however many rows), so every insert
+path - scans, write-behind commits, auto_exit_midnight - wakes the sync worker
+without knowing about it.
+
+OutboxListener holds a separate autocommit connection that LISTENs on the
+channel. `wait(timeout)` blocks until a notification arrives (then lingers for
+a short debounce window so a burst of scans goes out as one batch) or the
+timeout expires, in which case the caller falls back to polling.
+"""
+
+import select
+import time
+
+from django.db import connection
+
+
+CHANNEL = "gate_outbox"
+
+
+class OutboxListener:
+    def __init__(self, debounce_ms: int = 50):
+        self.debounce_s = debounce_ms / 1000
+        self._conn = None
+        self.notifications = 0
+
+    @staticmethod
+    def supported() -> bool:
+        return connection.vendor == "postgresql"
+
+    def connect(self) -> None:
+        self._conn = connection.get_new_connection(connection.get_connection_params())
+        self._conn.autocommit = True
+        with self._conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+
+    def close(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            finally:
+                self._conn = None
+
+    def wait(self, timeout: float) -> bool:
+        """Block for up to `timeout` seconds. Returns True if the outbox was notified."""
+        if self._conn is None:
+            # Events committed before LISTEN took effect were not announced; have the caller look.
+            self.connect()
+            return True
+        if hasattr(self._conn, "poll"):
+            notified = self._wait_psycopg2(timeout)
+        else:
+            notified = self._wait_psycopg(timeout)
+        if notified:
+            self.notifications += 1
+        return notified
+
+    def _wait_psycopg2(self, timeout: float) -> bool:
+        conn = self._conn
+        conn.poll()
+        if not conn.notifies:
+            if not select.select([conn], [], [], timeout)[0]:
+                return False
+            conn.poll()
+            if not conn.notifies:
+                return False
+        # Debounce: collect the rest of the burst before the caller fetches.
+        deadline = time.monotonic() + self.debounce_s
+        while (remaining := deadline - time.monotonic()) > 0:
+            if select.select([conn], [], [], remaining)[0]:
+                conn.poll()
+        conn.notifies.clear()
+        return True
+
+    def _wait_psycopg(self, timeout: float) -> bool:
+        notified = any(True for _ in self._conn.notifies(timeout=timeout, stop_after=1))
+        if notified:
+            for _ in self._conn.notifies(timeout=self.debounce_s):
+                pass
+        return notified
@@ -0,0 +1,144 @@
+"""
+Outbox retention for compact_outbox.
+
+Sent OutboxEvent rows are kept for OUTBOX_RETENTION_DAYS, then deleted. Deletes
+run in small batches, each in its own short transaction, so scans and the
+sync worker never queue behind one long delete. Before a batch is deleted it
+is appended (and fsync'ed) to a gzip-compressed JSONL archive, one file per
+run. Each batch is a separate gzip member, so a crash mid-run still leaves a
+readable file. Unsent rows are never touched.
+
+`outbox_size()` measures the table and its indexes; compact_outbox appends
+each measurement to OUTBOX_SIZE_HISTORY_PATH so growth (and the effect of
+purges and vacuum) can be followed over time.
+"""
+
+import gzip
+import json
+import os
+import time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from scanner.models import OutboxEvent
+
+
+class OutboxArchive:
+    """gzip JSONL file of purged outbox rows (one gzip member per batch)."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"outbox-{timezone.now():%Y%m%dT%H%M%S}.jsonl.gz")
+        self._fh = open(self.path, "ab")
+        self.rows = 0
+
+    def write(self, rows: list[OutboxEvent]) -> None:
+        lines = []
+        for row in rows:
+            lines.append(json.dumps({
+                "eventId": row.event_id,
+                "type": row.event_type,
+                "payload": row.payload,
+                "createdAt": row.created_at,
+                "sentAt": row.sent_at,
+                "attemptCount": row.attempt_count,
+                "lastError": row.last_error,
+            }, cls=DjangoJSONEncoder))
+        self._fh.write(gzip.compress(("\n".join(lines) + "\n").encode("utf-8")))
+        self._fh.flush()
+        os.fsync(self._fh.fileno())  # on disk before the rows are deleted
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+def purge_sent_events(cutoff, batch_size: int = 500, archive: OutboxArchive | None = None, pause_s: float = 0) -> int:
+    """Delete (and archive) events sent before `cutoff`, `batch_size` rows per transaction. Returns rows deleted."""
+    purged = 0
+    last_id = None
+    while True:
+        # Walk the primary key so every batch starts where the previous one stopped.
+        qs = OutboxEvent.objects.filter(sent_at__lt=cutoff)
+        if last_id is not None:
+            qs = qs.filter(event_id__gt=last_id)
+        rows = list(qs.order_by("event_id")[:batch_size])
+        if not rows:
+            return purged
+
+        if archive is not None:
+            archive.write(rows)
+        with transaction.atomic():
+            deleted, _ = OutboxEvent.objects.filter(
+                event_id__in=[row.event_id for row in rows], sent_at__lt=cutoff
+            ).delete()
+        purged += deleted
+        last_id = rows[-1].event_id
+        if pause_s:
+            time.sleep(pause_s)
+
+
+def outbox_size() -> dict:
+    """Row counts and on-disk size (bytes) of the outbox table and each of its indexes."""
+    table = OutboxEvent._meta.db_table
+    report = {
+        "at": timezone.now().isoformat(),
+        "rows": OutboxEvent.objects.count(),
+        "unsent": OutboxEvent.objects.filter(sent_at__isnull=True).count(),
+        "tableBytes": None,
+        "indexBytes": None,
+        "indexes": {},
+    }
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT pg_relation_size(%s), pg_indexes_size(%s)", [table, table])
+            report["tableBytes"], report["indexBytes"] = cursor.fetchone()
+            cursor.execute(
+                "SELECT indexrelname, pg_relation_size(indexrelid) FROM pg_stat_user_indexes "
+                "WHERE relname = %s ORDER BY indexrelname",
+                [table],
+            )
+            report["indexes"] = dict(cursor.fetchall())
+            cursor.execute("SELECT n_dead_tup FROM pg_stat_user_tables WHERE relname = %s", [table])
+            row = cursor.fetchone()
+            report["deadRows"] = row[0] if row else None
+        elif connection.vendor == "sqlite":
+            try:
+                cursor.execute(
+                    "SELECT name, SUM(pgsize) FROM dbstat WHERE name IN "
+                    "(SELECT name FROM sqlite_master WHERE tbl_name = %s) GROUP BY name",
+                    [table],
+                )
+            except OperationalError:
+                pass  # sqlite built without the dbstat table
+            else:
+                sizes = dict(cursor.fetchall())
+                report["tableBytes"] = sizes.pop(table, 0)
+                report["indexes"] = sizes
+                report["indexBytes"] = sum(sizes.values())
+    return report
+
+
+def append_size_history(path, report: dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as fh:
+        fh.write(json.dumps(report) + "\n")
+
+
+def read_size_history(path, limit: int = 10) -> list[dict]:
+    """The last `limit` measurements, oldest first."""
+    try:
+        with open(path, encoding="utf-8") as fh:
+            lines = fh.readlines()
+    except FileNotFoundError:
+        return []
+    history = []
+    for line in lines[-limit:]:
+        try:
+            history.append(json.loads(line))
+        except ValueError:
+            continue
+    return history
@@ -0,0 +1,56 @@
+"""
+Per-gate outbox sequence numbers.
+
+On Postgres every outbox row gets a `seq` from the gate_outbox_seq sequence,
+assigned by a trigger (migration 0004). Seqs increase in insertion order (not
+quite in commit order) and are never reused, also after compact_outbox has
+deleted the rows; a rolled-back insert leaves a hole. Other databases have no
+seqs: rows keep seq NULL, head_seq is None and events are synced by id
+alone. The numbering belongs to an `epoch` made with the database, so a gate
+whose database is recreated starts a new cursor on the backend instead of
+having its seqs taken for old ones.
+
+The backend keeps a cursor per gate (apps.sync.services.gate_cursor): which
+seqs of the epoch it has durably, as a high-water mark with a few gap ranges.
+`mark_durable` applies that cursor to the outbox after a restart, so events
+the backend committed but whose ack never arrived are not sent again.
+"""
+
+from django.db import connection
+from django.utils import timezone
+
+from scanner.models import OutboxEvent, OutboxSequence
+
+
+def current_epoch():
+    """The epoch of this database's seq numbering."""
+    return OutboxSequence.objects.get_or_create(id=1)[0].epoch
+
+
+def head_seq() -> int | None:
+    """The newest seq handed out, or None if none was (or the database has no seqs)."""
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT CASE WHEN is_called THEN last_value END FROM gate_outbox_seq")
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def _is_durable(seq: int, cursor: dict) -> bool:
+    if not cursor["floorSeq"] <= seq <= cursor["highWaterSeq"]:
+        return False
+    return not any(start <= seq <= end for start, end in cursor["gaps"])
+
+
+def mark_durable(cursor: dict) -> int:
+    """Mark unsent rows whose seq the backend `cursor` (of this epoch) reports durable as sent. Returns how many."""
+    if cursor.get("epoch") != str(current_epoch()) or cursor["highWaterSeq"] < cursor["floorSeq"]:
+        return 0
+    rows = OutboxEvent.objects.filter(
+        sent_at__isnull=True, seq__gte=cursor["floorSeq"], seq__lte=cursor["highWaterSeq"]
+    ).values_list("event_id", "seq")
+    durable = [event_id for event_id, seq in rows if _is_durable(seq, cursor)]
+    if durable:
+        OutboxEvent.objects.filter(event_id__in=durable).update(sent_at=timezone.now(), last_error="")
+    return len(durable)
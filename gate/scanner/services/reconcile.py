@@ -0,0 +1,86 @@
+"""
+Range-hash (Merkle-style) reconciliation for reconcile_sync.
+
+Instead of re-sending every row in a window (repair_sync_full), the gate and
+the backend compare hashes of created_at buckets (shared.apps.entries.range_hash):
+
+  1. the window is split into `fanout` buckets; both sides hash them and the
+     backend returns its hashes for all pending ranges in one request
+  2. every bucket whose (count, hash) differs becomes a pending range, split
+     into `fanout` buckets again on the next round
+  3. once a differing bucket holds at most `leaf_rows` rows on either side,
+     both sides list per-row digests for it and the rows that are missing on
+     the backend or differ are collected for re-sending
+
+Matching buckets are never looked at again, so a window that is mostly in
+sync costs a few kilobytes of hashes regardless of its size.
+"""
+
+from shared.apps.entries.range_hash import bucket_hashes, row_digests, split_range
+
+
+MAX_RANGES_PER_REQUEST = 256  # the backend's MAX_RANGES
+ROWS_PER_REQUEST = 4096  # below the backend's default SYNC_RECONCILE_MAX_ROWS
+
+
+class ReconcileResult:
+    def __init__(self):
+        self.stale = {}  # id -> local digest of rows to re-send: missing on the backend or different there
+        self.backend_only = []  # ids the backend has and the gate doesn't
+        self.rounds = 0
+        self.buckets_compared = 0
+        self.buckets_differing = 0
+
+
+class RangeReconciler:
+    def __init__(self, client, kind: str, fanout: int = 16, leaf_rows: int = 64, roll: str | None = None):
+        self.client = client
+        self.kind = kind
+        self.fanout = max(2, fanout)
+        self.leaf_rows = max(1, leaf_rows)
+        self.roll = roll
+
+    def _ask(self, ranges: list[tuple], **query) -> list:
+        """Backend answers for `ranges`, in order, batched into requests of MAX_RANGES_PER_REQUEST."""
+        key = "rows" if query.get("rows") else "buckets"
+        per_request = MAX_RANGES_PER_REQUEST
+        if query.get("rows"):
+            # A leaf range holds at most leaf_rows rows on the backend.
+            per_request = min(per_request, max(1, ROWS_PER_REQUEST // self.leaf_rows))
+        answers = []
+        for i in range(0, len(ranges), per_request):
+            chunk = [[start.isoformat(), end.isoformat()] for start, end in ranges[i:i + per_request]]
+            resp = self.client.post_reconcile({"kind": self.kind, "ranges": chunk, "roll": self.roll, **query})
+            answers.extend(resp[key])
+        return answers
+
+    def run(self, start, end) -> ReconcileResult:
+        result = ReconcileResult()
+        pending, leaves = [(start, end)], []
+        while pending:
+            result.rounds += 1
+            remote = self._ask(pending, buckets=self.fanout)
+            next_pending = []
+            for (r_start, r_end), remote_buckets in zip(pending, remote):
+                local_buckets = bucket_hashes(self.kind, r_start, r_end, self.fanout, self.roll)
+                subranges = split_range(r_start, r_end, self.fanout)
+                for sub, mine, theirs in zip(subranges, local_buckets, remote_buckets):
+                    result.buckets_compared += 1
+                    if mine == theirs:
+                        continue
+                    result.buckets_differing += 1
+                    small = max(mine["count"], theirs["count"]) <= self.leaf_rows
+                    # A range of fewer microseconds than buckets can't be split further.
+                    if small or (sub[1] - sub[0]).total_seconds() * 1_000_000 < self.fanout:
+                        leaves.append(sub)
+                    else:
+                        next_pending.append(sub)
+            pending = next_pending
+
+        if leaves:
+            result.rounds += 1
+            for (l_start, l_end), remote_rows in zip(leaves, self._ask(leaves, rows=True)):
+                local_rows = row_digests(self.kind, l_start, l_end, self.roll)
+                result.stale.update((row_id, digest) for row_id, digest in local_rows.items() if remote_rows.get(row_id) != digest)
+                result.backend_only.extend(row_id for row_id in remote_rows if row_id not in local_rows)
+        return result
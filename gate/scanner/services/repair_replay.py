@@ -0,0 +1,206 @@
+"""
+Parallel, resumable replay for repair_sync_full.
+
+Rows are read in (created_at, id) order by a single query on a server-side
+cursor (`QuerySet.iterator`), so the table is scanned once instead of once
+per OFFSET page, and rows inserted during the run can't shift a page. Pages of
+`batch_size` rows are posted by `workers` threads, each with its own
+keep-alive SyncClient. Replay is idempotent and the backend keeps the latest
+timestamp, so pages may be acked in any order.
+
+Progress is the (created_at, id) key of the last page below which every page
+has been acked (pages finish out of order). It is written atomically to a
+JSON checkpoint file; a resumed run starts its query after that key and sends
+at most about `workers` pages again.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from scanner.services.sync_client import SyncHTTPError
+
+
+def entry_event(e) -> dict:
+    ts = e.scanned_at or e.created_at or timezone.now()
+    return {
+        "eventId": str(e.id),  # deterministic per-entry
+        "type": "ENTRY",
+        "entryId": str(e.id),
+        "roll": e.roll_id,
+        "scannedAt": ts.isoformat(),
+        "createdAt": e.created_at.isoformat(),
+        "status": e.status,
+        "entryFlag": e.entry_flag,
+        "laptop": e.laptop,
+        "extra": e.extra or [],
+        "deviceMeta": e.device_meta or {},
+        "deviceId": e.device_id,
+        "source": e.source,
+        "os": e.os,
+    }
+
+
+def exit_event(x) -> dict:
+    ts = x.scanned_at or x.created_at or timezone.now()
+    return {
+        "eventId": str(x.id),  # deterministic per-exit
+        "type": "EXIT",
+        "exitId": str(x.id),
+        "entryId": str(x.entry_id_id) if x.entry_id_id else None,
+        "roll": x.roll_id,
+        "scannedAt": ts.isoformat(),
+        "createdAt": x.created_at.isoformat(),
+        "exitFlag": x.exit_flag,
+        "laptop": x.laptop,
+        "extra": x.extra or [],
+        "deviceMeta": x.device_meta or {},
+        "deviceId": x.device_id,
+        "source": x.source,
+        "os": x.os,
+    }
+
+
+def after_key(qs, key):
+    """Rows of `qs` strictly after `key` = [created_at ISO string, id] in (created_at, id) order."""
+    if not key:
+        return qs
+    created_at, row_id = parse_datetime(key[0]), key[1]
+    # created_at >= t first, so the range starts on the created_at index.
+    return qs.filter(created_at__gte=created_at).exclude(created_at=created_at, id__lte=row_id)
+
+
+class RepairCheckpoint:
+    """JSON file with the replay position; replaced atomically on every save."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self) -> dict | None:
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state: dict) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(state, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self.path)
+
+    def clear(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ParallelReplayer:
+    BUSY_RETRIES = 5  # per page, for 429/503 + Retry-After
+
+    def __init__(self, client_factory, workers: int = 4, batch_size: int = 200, stdout=None, stderr=None):
+        self.client_factory = client_factory
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.stdout = stdout
+        self.stderr = stderr
+        self.clients = []
+
+    def _out(self, msg: str) -> None:
+        if self.stdout is not None:
+            self.stdout.write(msg)
+
+    def _err(self, msg: str) -> None:
+        if self.stderr is not None:
+            self.stderr.write(msg)
+
+    def _pages(self, qs, to_event):
+        page = []
+        for row in qs.iterator(chunk_size=self.batch_size):
+            page.append(row)
+            if len(page) == self.batch_size:
+                yield [row.created_at.isoformat(), str(row.id)], [to_event(r) for r in page]
+                page = []
+        if page:
+            yield [page[-1].created_at.isoformat(), str(page[-1].id)], [to_event(r) for r in page]
+
+    def _post(self, client, events: list[dict]) -> dict:
+        for attempt in range(self.BUSY_RETRIES + 1):
+            try:
+                return client.post_events(events)
+            except SyncHTTPError as e:
+                if e.code not in (429, 503) or e.retry_after is None or attempt == self.BUSY_RETRIES:
+                    raise
+                time.sleep(e.retry_after)
+
+    def replay(self, qs, to_event, label: str, after=None, on_progress=None) -> int:
+        """
+        Post every row of `qs` after key `after`; returns rows acked or rejected.
+
+        `on_progress(key, rows)` is called each time the contiguous acked prefix
+        grows. The first error stops the replay (after in-flight pages finish)
+        and is raised.
+        """
+        jobs = queue.Queue(maxsize=self.workers * 2)  # bounds read-ahead
+        lock = threading.Lock()
+        state = {"done": {}, "next": 0, "rows": 0, "error": None}
+
+        def work():
+            client = self.client_factory()
+            with lock:
+                self.clients.append(client)
+            try:
+                while (job := jobs.get()) is not None:
+                    seq, key, events = job
+                    if state["error"] is not None:
+                        continue  # stopping: leave the page for the resumed run
+                    try:
+                        resp = self._post(client, events)
+                    except Exception as e:
+                        with lock:
+                            state["error"] = state["error"] or e
+                        continue
+                    acked = len(resp.get("ackedEventIds") or [])
+                    rejected = resp.get("rejected") or []
+                    if rejected:
+                        self._err(f"repair {label}: rejected {len(rejected)} (showing first): {rejected[:1]}")
+                    self._out(f"repair {label}: sent={len(events)} acked={acked} {client.describe_last()}")
+                    with lock:
+                        state["done"][seq] = (key, len(events))
+                        advanced = None
+                        while state["next"] in state["done"]:
+                            advanced, rows = state["done"].pop(state["next"])
+                            state["rows"] += rows
+                            state["next"] += 1
+                        if advanced is not None and on_progress is not None:
+                            on_progress(advanced, state["rows"])
+            finally:
+                client.close()
+
+        threads = [
+            threading.Thread(target=work, name=f"repair-{label}-{i}", daemon=True) for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for seq, (key, events) in enumerate(self._pages(after_key(qs.order_by("created_at", "id"), after), to_event)):
+                if state["error"] is not None:
+                    break
+                jobs.put((seq, key, events))
+        finally:
+            for _ in threads:
+                jobs.put(None)
+            for thread in threads:
+                thread.join()
+        if state["error"] is not None:
+            raise state["error"]
+        return state["rows"]
@@ -0,0 +1,280 @@
+"""
+Per-stage scan latency metrics.
+
+Every scan is timed with a ScanTimer (monotonic clock) split into stages:
+
+  token_read    reading the token (stdin / argument / socket request)
+  jwt_decode    public key lookup + signature verification
+  apply         entry/exit state machine incl. DB queries and commit
+  db_lookup     SELECTs issued while applying  (part of apply)
+  db_write      entry/exit INSERT/UPDATEs       (part of apply)
+  outbox_write  outbox INSERTs                  (part of apply)
+  output        printing / building the response
+  total         whole scan
+
+Timings are aggregated per (stage, outcome) into log-linear ("HDR-style")
+histograms: exact below 128us, then 64 sub-buckets per power of two (~1.6%
+precision), so p50/p95/p99 stay accurate without keeping samples.
+
+Short-lived processes (process_token) merge their sample into a JSON file
+(SCAN_STATS_PATH); scan_server aggregates in memory and flushes periodically.
+`manage.py scan_stats` reads the file.
+"""
+
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+
+
+STAGES = ("token_read", "jwt_decode", "apply", "db_lookup", "db_write", "outbox_write", "output", "total")
+QUANTILES = (0.5, 0.95, 0.99)
+
+_SUB_BUCKET_BITS = 7
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS   # values below this are exact
+_HALF = _SUB_BUCKETS // 2
+
+
+def _bucket_index(value_us: int) -> int:
+    if value_us < _SUB_BUCKETS:
+        return value_us
+    shift = value_us.bit_length() - _SUB_BUCKET_BITS
+    return shift * _HALF + (value_us >> shift)
+
+
+def _bucket_value(index: int) -> int:
+    """Representative (mid-point) value in microseconds for a bucket index."""
+    if index < _SUB_BUCKETS:
+        return index
+    shift = index // _HALF - 1
+    low = (index - shift * _HALF) << shift
+    return low + ((1 << shift) - 1) // 2
+
+
+def scan_outcome(result: dict | None) -> str:
+    """Outcome label for a scan: its flag, DENY, or ALLOW for flag-less allows."""
+    if result is None:
+        return "DENY"
+    return result.get("flag") or "ALLOW"
+
+
+def stats_store_from_settings():
+    """ScanStatsStore for SCAN_STATS_PATH, or None when stats collection is disabled."""
+    path = getattr(settings, "SCAN_STATS_PATH", "")
+    return ScanStatsStore(path) if path else None
+
+
+class LatencyHistogram:
+    """Log-linear latency histogram in microseconds. Mergeable and JSON-serialisable."""
+
+    def __init__(self):
+        self.counts = {}  # bucket index -> count
+        self.count = 0
+        self.sum_us = 0
+        self.max_us = 0
+
+    def record(self, seconds: float) -> None:
+        value_us = max(0, int(seconds * 1_000_000))
+        index = _bucket_index(value_us)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum_us += value_us
+        self.max_us = max(self.max_us, value_us)
+
+    def percentile(self, q: float) -> float:
+        """Latency in seconds at quantile `q` (0..1); 0.0 if empty."""
+        if not self.count:
+            return 0.0
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(_bucket_value(index), self.max_us) / 1_000_000
+        return self.max_us / 1_000_000
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        for index, n in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + n
+        self.count += other.count
+        self.sum_us += other.sum_us
+        self.max_us = max(self.max_us, other.max_us)
+
+    def to_dict(self) -> dict:
+        return {"counts": {str(i): n for i, n in self.counts.items()}, "count": self.count,
+                "sum_us": self.sum_us, "max_us": self.max_us}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        hist = cls()
+        hist.counts = {int(i): n for i, n in data.get("counts", {}).items()}
+        hist.count = data.get("count", 0)
+        hist.sum_us = data.get("sum_us", 0)
+        hist.max_us = data.get("max_us", 0)
+        return hist
+
+
+class ScanTimer:
+    """Monotonic stage timings for one scan."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    @contextmanager
+    def db_queries(self):
+        """Attribute the time of every query run inside the block to db_lookup / db_write / outbox_write."""
+        with connection.execute_wrapper(self._time_query):
+            yield
+
+    def _time_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            head = sql.lstrip()[:16].upper()
+            if head.startswith(("SAVEPOINT", "RELEASE", "ROLLBACK")):
+                stage = None
+            elif "gate_outbox_events" in sql:
+                stage = "outbox_write"
+            elif head.startswith("SELECT"):
+                stage = "db_lookup"
+            else:
+                stage = "db_write"
+            if stage:
+                self.add(stage, time.perf_counter() - started)
+
+    def finish(self) -> None:
+        self.stages["total"] = time.perf_counter() - self.started
+
+
+class ScanMetrics:
+    """Histograms keyed by (stage, outcome)."""
+
+    def __init__(self, since: str | None = None):
+        self.since = since or datetime.now(dt_timezone.utc).isoformat()
+        self.histograms = {}  # (stage, outcome) -> LatencyHistogram
+
+    def record(self, timer: ScanTimer, outcome: str) -> None:
+        if "total" not in timer.stages:
+            timer.finish()
+        for stage, seconds in timer.stages.items():
+            self.histograms.setdefault((stage, outcome), LatencyHistogram()).record(seconds)
+
+    def merge(self, other: "ScanMetrics") -> None:
+        self.since = min(self.since, other.since)
+        for key, hist in other.histograms.items():
+            self.histograms.setdefault(key, LatencyHistogram()).merge(hist)
+
+    def __bool__(self):
+        return bool(self.histograms)
+
+    def rows(self) -> list[dict]:
+        """One summary row per (stage, outcome), in STAGES order."""
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        rows = []
+        for (stage, outcome), hist in sorted(
+            self.histograms.items(), key=lambda item: (order.get(item[0][0], len(order)), item[0][1])
+        ):
+            rows.append({
+                "stage": stage,
+                "outcome": outcome,
+                "count": hist.count,
+                "p50": hist.percentile(0.5),
+                "p95": hist.percentile(0.95),
+                "p99": hist.percentile(0.99),
+                "max": hist.max_us / 1_000_000,
+            })
+        return rows
+
+    def to_dict(self) -> dict:
+        return {
+            "since": self.since,
+            "histograms": [
+                {"stage": stage, "outcome": outcome, **hist.to_dict()}
+                for (stage, outcome), hist in self.histograms.items()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ScanMetrics":
+        metrics = cls(since=data.get("since"))
+        for item in data.get("histograms", []):
+            metrics.histograms[(item["stage"], item["outcome"])] = LatencyHistogram.from_dict(item)
+        return metrics
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition format (summary per stage/outcome)."""
+        name = "gate_scan_stage_seconds"
+        lines = [
+            f"# HELP {name} Gate scan latency per stage and outcome.",
+            f"# TYPE {name} summary",
+        ]
+        for (stage, outcome), hist in sorted(self.histograms.items()):
+            labels = f'stage="{stage}",outcome="{outcome}"'
+            for q in QUANTILES:
+                lines.append(f'{name}{{{labels},quantile="{q}"}} {hist.percentile(q):.6f}')
+            lines.append(f"{name}_sum{{{labels}}} {hist.sum_us / 1_000_000:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+class ScanStatsStore:
+    """JSON file holding the aggregated ScanMetrics, shared by all gate processes."""
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self) -> ScanMetrics:
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                return ScanMetrics.from_dict(json.load(fh))
+        except (FileNotFoundError, ValueError):
+            return ScanMetrics()
+
+    def _write(self, metrics: ScanMetrics) -> None:
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(metrics.to_dict(), fh)
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> ScanMetrics:
+        with self._locked():
+            return self._read()
+
+    def add(self, metrics: ScanMetrics) -> None:
+        if not metrics:
+            return
+        with self._locked():
+            stored = self._read()
+            stored.merge(metrics)
+            self._write(stored)
+
+    def reset(self) -> None:
+        with self._locked():
+            self._write(ScanMetrics())
@@ -0,0 +1,715 @@
+"""
+Gate scan processing service.
+
+Verifies a backend-issued JWT (offline) and applies the entry/exit state machine
+to the local gate DB (EntryLog / ExitLog + OutboxEvent rows for sync).
+
+Used by:
+  - process_token  (one scan per process, CLI output; --batch uses BatchScanWriter)
+  - scan_server    (long-running, keeps Django + public key + DB connection warm)
+"""
+
+import time
+import uuid
+from contextlib import nullcontext
+from datetime import datetime
+
+import jwt
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from shared.apps.entries.models import EntryLog, ExitLog
+from shared.apps.users.models import User
+from scanner.models import OutboxEvent
+from scanner.services.key_manager import MissingPublicKeyError, PublicKeyManager
+from scanner.services.open_entry_index import OpenEntryIndex
+from scanner.services.scan_metrics import ScanTimer
+
+
+# Per-scan query budget: data statements issued inside the scan transaction
+# (BEGIN/COMMIT/SAVEPOINT not counted). Enforced by scanner/tests.py.
+# With an OpenEntryIndex the lookup is answered from memory (one query less).
+SCAN_QUERY_BUDGET = {
+    "NORMAL_ENTRY": 4,    # entry/open-entry lookup, user upsert, entry insert, outbox insert
+    "FORCED_ENTRY": 5,    # + close previous open entries
+    "DUPLICATE_SCAN": 1,  # lookup only
+    "EXPIRED": 2,         # entry update, outbox insert
+    "NORMAL_EXIT": 5,     # entry+exit-seen lookup, user upsert, exit insert, entry update, outbox insert
+    "EMERGENCY_EXIT": 5,
+    "DUPLICATE_EXIT": 4,  # lookup, user upsert, exit insert, outbox insert
+    "ORPHAN_EXIT": 4,     # 3 when the token carries no entryId
+}
+
+
+class ScanDenied(Exception):
+    """
+    Raised when a scan must be denied.
+
+    The message is the DENY line shown to the operator; `notes` carries any
+    "scanned successfully: ..." lines produced before the decision was made.
+    """
+
+    def __init__(self, message, notes=None):
+        super().__init__(message)
+        self.notes = notes or []
+
+
+def parse_iso_datetime(dt_str: str) -> datetime:
+    """Parse ISO format datetime string to timezone-aware datetime."""
+    if not dt_str:
+        return None
+    # Handle Z suffix
+    dt_str = dt_str.replace("Z", "+00:00")
+    try:
+        dt = datetime.fromisoformat(dt_str)
+        # Make timezone-aware if naive
+        if dt.tzinfo is None:
+            dt = timezone.make_aware(dt)
+        return dt
+    except ValueError as e:
+        raise ValueError(f"Error: {e}\nInvalid datetime format: {dt_str}. Use ISO format (e.g., 2026-01-10T14:30:00Z)")
+
+
+def decode_token(token: str, public_key, test_mode: bool = False, now: float | None = None):
+    """
+    Verify the JWT and return (payload, is_expired).
+
+    The signature, audience and issuer are verified exactly once; expiry is then
+    classified from the already-decoded `exp` claim, so expired tokens don't
+    need a second decode. `now` (epoch seconds) is the moment the token was
+    scanned, for replays of scans captured earlier. In test mode expiry is not
+    checked at all.
+    """
+    try:
+        payload = jwt.decode(
+            token,
+            public_key,
+            algorithms=["RS256"],
+            audience="library-gate",
+            issuer="library-backend",
+            options={"verify_exp": False},
+        )
+    except jwt.InvalidAudienceError:
+        raise ScanDenied("DENY: invalid audience (aud)")
+    except jwt.InvalidIssuerError:
+        raise ScanDenied("DENY: invalid issuer (iss)")
+    except jwt.InvalidTokenError as e:
+        raise ScanDenied(f"DENY: invalid token ({e})")
+
+    if test_mode or "exp" not in payload:
+        return payload, False
+
+    # Same rule as PyJWT's own exp validation (zero leeway).
+    try:
+        exp = int(payload["exp"])
+    except (TypeError, ValueError):
+        raise ScanDenied("DENY: invalid token (Expiration Time claim (exp) must be an integer.)")
+    return payload, exp <= (time.time() if now is None else now)
+
+
+def entry_status_event(entry_id, roll, status, ts) -> OutboxEvent:
+    """
+    Compact ENTRY_STATUS outbox event for a status change of an entry whose full
+    snapshot was already emitted as ENTRY (unsaved; caller inserts it).
+
+    `ts` is when the transition happened; the backend applies it only if it is
+    not older than the entry's scanned_at (and sets scanned_at for EXPIRED, as
+    the gate does).
+    """
+    return OutboxEvent(
+        event_type="ENTRY_STATUS",
+        payload={
+            "eventId": None,
+            "type": "ENTRY_STATUS",
+            "entryId": str(entry_id),
+            "roll": roll,
+            "status": status,
+            "ts": ts.isoformat(),
+        },
+    )
+
+
+def _parse_entry_id(value):
+    """Normalise a token entryId to a UUID (None if absent)."""
+    if not value:
+        return None
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        raise ScanDenied(f"DENY: invalid token (entryId is not a UUID: {value})")
+
+
+def extract_device_context(payload, is_expired=False, gate_device_id=None):
+    """
+    Extract device context from the JWT payload.
+
+    Supports both camelCase and snake_case keys and defensively copies the
+    metadata dictionary so callers can safely mutate it. `gate_device_id` (the
+    lane that scanned the token) wins over the GATE_DEVICE_ID setting.
+    """
+    raw_meta = (
+        payload.get("deviceMetadata")
+        or payload.get("deviceMeta")
+        or payload.get("device_meta")
+        or {}
+    )
+    if not isinstance(raw_meta, dict):
+        raw_meta = {}
+    device_meta = dict(raw_meta)
+
+    source = payload.get("source") or device_meta.get("source")
+    os_name = payload.get("os") or device_meta.get("os")
+    device_id = (
+        payload.get("deviceId")
+        or device_meta.get("deviceId")
+        or device_meta.get("id")
+    )
+
+    if is_expired:
+        device_meta.setdefault("expired", True)
+
+    if gate_device_id:
+        device_meta["gateDeviceId"] = gate_device_id
+    elif getattr(settings, "GATE_DEVICE_ID", None):
+        device_meta.setdefault("gateDeviceId", settings.GATE_DEVICE_ID)
+
+    return {
+        "source": source,
+        "os": os_name,
+        "device_id": device_id,
+        "device_meta": device_meta,
+    }
+
+
+class DbScanWriter:
+    """Writes each scan straight to the gate DB, one transaction per scan."""
+
+    def atomic(self):
+        return transaction.atomic()
+
+    def on_commit(self, func):
+        transaction.on_commit(func)
+
+    def wait_durable(self):
+        pass  # every scan is committed before it returns
+
+    def expire_entry(self, entry_id, ts) -> bool:
+        return bool(EntryLog.objects.filter(id=entry_id).update(status="EXPIRED", scanned_at=ts))
+
+    def close_entries(self, entries, ts):
+        EntryLog.objects.filter(id__in=[e.id for e in entries]).update(status="EXPIRED", scanned_at=ts)
+
+    def mark_exited(self, entry):
+        EntryLog.objects.filter(id=entry.id).update(status="EXITED")
+
+    def create_entry(self, roll, **fields):
+        return EntryLog.create_with_roll(roll=roll, **fields)
+
+    def create_exit(self, roll, **fields):
+        return ExitLog.create_with_roll(roll=roll, **fields)
+
+    def add_events(self, events):
+        OutboxEvent.objects.bulk_create(events)
+
+
+class BatchScanWriter:
+    """
+    Collects the writes of many scans in memory and flushes them with bulk queries.
+
+    The entry state of the batch lives in `index` (an OpenEntryIndex loaded with
+    `load_for`), so later scans in the batch see the effect of earlier ones
+    before anything is written.
+    """
+
+    def __init__(self, index: OpenEntryIndex):
+        self.index = index
+        self.rolls = set()
+        self.new_entries = {}      # entry_id -> unsaved EntryLog
+        self.changed_entries = {}  # entry_id -> existing EntryLog with a new status
+        self.exits = []
+        self.events = []
+
+    def atomic(self):
+        return nullcontext()
+
+    def on_commit(self, func):
+        func()
+
+    def wait_durable(self):
+        pass  # lookups are answered from the index loaded for the batch
+
+    def _entry_row(self, entry_id):
+        row = self.new_entries.get(entry_id) or self.changed_entries.get(entry_id)
+        if row is None:
+            row = self.index.get(entry_id)
+            if row is not None:
+                self.changed_entries[entry_id] = row
+        return row
+
+    def expire_entry(self, entry_id, ts) -> bool:
+        row = self._entry_row(entry_id)
+        if row is None:
+            return False
+        row.status, row.scanned_at = "EXPIRED", ts
+        return True
+
+    def close_entries(self, entries, ts):
+        for entry in entries:
+            self.expire_entry(entry.id, ts)
+
+    def mark_exited(self, entry):
+        row = self._entry_row(entry.id)
+        if row is not None:
+            row.status = "EXITED"
+
+    def create_entry(self, roll, **fields):
+        entry = EntryLog(roll_id=roll, **fields)
+        self.rolls.add(roll)
+        self.new_entries[entry.id] = entry
+        return entry
+
+    def create_exit(self, roll, **fields):
+        exit_log = ExitLog(roll_id=roll, **fields)
+        self.rolls.add(roll)
+        self.exits.append(exit_log)
+        return exit_log
+
+    def add_events(self, events):
+        self.events.extend(events)
+
+    def flush(self, batch_size: int = 1000) -> int:
+        """Write everything collected so far in one transaction. Returns the number of rows written."""
+        with transaction.atomic():
+            User.ensure(*self.rolls)
+            EntryLog.objects.bulk_create(list(self.new_entries.values()), batch_size=batch_size)
+            EntryLog.objects.bulk_update(
+                list(self.changed_entries.values()), ["status", "scanned_at"], batch_size=batch_size
+            )
+            ExitLog.objects.bulk_create(self.exits, batch_size=batch_size)
+            OutboxEvent.objects.bulk_create(self.events, batch_size=batch_size)
+        written = len(self.new_entries) + len(self.changed_entries) + len(self.exits) + len(self.events)
+        self.rolls, self.new_entries, self.changed_entries = set(), {}, {}
+        self.exits, self.events = [], []
+        return written
+
+
+class ScanProcessor:
+    """
+    Applies gate scans against the local DB.
+
+    Holds a PublicKeyManager so a long-running process verifies tokens
+    without re-reading/re-parsing the PEM on every scan. With an optional
+    OpenEntryIndex, scan decisions are made without read queries. Writes go
+    through `writer` (DbScanWriter by default; BatchScanWriter for --batch,
+    write_behind.JournalScanWriter for scan_server --write-behind).
+
+    When scans are processed on several threads (scan_server), `apply_lock`
+    maps a verified payload to the lock its scan is applied under.
+    """
+
+    def __init__(
+        self,
+        key_manager: PublicKeyManager,
+        index: OpenEntryIndex | None = None,
+        writer: DbScanWriter | BatchScanWriter | None = None,
+        apply_lock=None,
+    ):
+        self.key_manager = key_manager
+        self.index = index
+        self.writer = writer or DbScanWriter()
+        self.apply_lock = apply_lock
+
+    def process(
+        self,
+        token: str,
+        mode: str = "entry",
+        test_mode: bool = False,
+        override_scanned_at=None,
+        override_created_at=None,
+        timer: ScanTimer | None = None,
+        gate_device_id: str | None = None,
+    ) -> dict:
+        """
+        Verify `token` and apply an entry/exit scan.
+
+        Returns a result dict with "decision": "ALLOW"; raises ScanDenied otherwise.
+        Stage timings are recorded into `timer` when given; `gate_device_id`
+        tags the scan with the lane that read it.
+        """
+        token = (token or "").strip()
+        if not token:
+            raise ScanDenied("DENY: no token provided")
+
+        timer = timer or ScanTimer()
+        with timer.stage("jwt_decode"):
+            try:
+                public_key = self.key_manager.get()
+            except MissingPublicKeyError as e:
+                raise ScanDenied(str(e))
+            payload, is_expired = decode_token(token, public_key, test_mode=test_mode)
+
+        lock = self.apply_lock(payload) if self.apply_lock is not None else nullcontext()
+        with timer.stage("apply"), lock, timer.db_queries():
+            return self.apply(
+                payload,
+                is_expired,
+                mode=mode,
+                test_mode=test_mode,
+                override_scanned_at=override_scanned_at,
+                override_created_at=override_created_at,
+                gate_device_id=gate_device_id,
+            )
+
+    def apply(
+        self,
+        payload: dict,
+        is_expired: bool,
+        mode: str = "entry",
+        test_mode: bool = False,
+        override_scanned_at=None,
+        override_created_at=None,
+        gate_device_id: str | None = None,
+    ) -> dict:
+        """Apply an entry/exit scan for an already verified token payload."""
+        # Check for createdAt in token payload if not overridden
+        if test_mode and not override_created_at and payload.get("createdAt"):
+            try:
+                override_created_at = parse_iso_datetime(payload["createdAt"])
+            except ValueError:
+                pass  # Ignore invalid createdAt in token
+
+        ctx = {
+            "test_mode": test_mode,
+            "override_scanned_at": override_scanned_at,
+            "override_created_at": override_created_at,
+            "gate_device_id": gate_device_id,
+        }
+        if mode == "exit":
+            result = self.handle_exit(payload, is_expired, ctx)
+        else:
+            result = self.handle_entry(payload, is_expired if not test_mode else False, ctx)
+        result["payload"] = payload
+        return result
+
+    def handle_entry(self, payload, is_expired, ctx):
+        """
+        Handle entry scan.
+
+        All reads/writes for one scan run in a single transaction (see SCAN_QUERY_BUDGET).
+        """
+        entry_log_id = payload.get("entryId")
+        device_ctx = extract_device_context(payload, is_expired=is_expired, gate_device_id=ctx.get("gate_device_id"))
+        source = device_ctx["source"]
+        os_name = device_ctx["os"]
+        device_id = device_ctx["device_id"]
+        device_meta = device_ctx["device_meta"]
+
+        # Test mode context
+        test_mode = ctx.get("test_mode", False)
+        override_scanned_at = ctx.get("override_scanned_at")
+        override_created_at = ctx.get("override_created_at")
+
+        # In test mode, override source to TEST
+        if test_mode:
+            source = "TEST"
+            device_meta["testMode"] = True
+
+        notes = []
+        entry_uuid = _parse_entry_id(entry_log_id)
+
+        if is_expired:
+            # For entry, expired tokens mark the entry as EXPIRED and deny
+            if entry_uuid:
+                ts = override_scanned_at or timezone.now()
+                with self.writer.atomic():
+                    updated = self.writer.expire_entry(entry_uuid, ts)
+                    self._index_on_commit("set_status", [entry_uuid], "EXPIRED", scanned_at=ts)
+                    if updated:
+                        self.writer.add_events([entry_status_event(entry_uuid, payload.get("roll"), "EXPIRED", ts)])
+                notes.append(f"scanned successfully: EXPIRED at {ts}")
+            raise ScanDenied("DENY: token expired", notes=notes)
+
+        # proceeding to update the local database
+        entry_id = payload.get("entryId") or payload.get("exitId")
+        roll = payload.get("roll")
+        laptop = payload.get("laptop")
+        extra = payload.get("extra")
+        flag = None
+
+        # Update local gate DB entry_logs status + entry_flag (only for entry tokens)
+        if entry_uuid:
+            with self.writer.atomic():
+                # One lookup answers both "does this entry exist?" and "is the roll already inside?"
+                existing_entry, open_entries = self._lookup_entries(entry_uuid, roll, payload, include_open=True)
+
+                # If entry doesn't exist locally yet, create it on scan.
+                if not existing_entry:
+                    ts = override_scanned_at or timezone.now()
+                    # Rows are already in memory, so the outbox events below see pre-update values.
+                    entries_to_close = open_entries
+                    events = []
+
+                    if entries_to_close:
+                        # Auto-close any previous open entry locally.
+                        self.writer.close_entries(entries_to_close, ts)
+                        self._index_on_commit("set_status", [e.id for e in entries_to_close], "EXPIRED", scanned_at=ts)
+                        entry_flag = "FORCED_ENTRY"
+
+                        # Closed entries were already sent as full snapshots; only ship the status change.
+                        events.extend(
+                            entry_status_event(open_entry.id, roll, "EXPIRED", ts) for open_entry in entries_to_close
+                        )
+                    else:
+                        entry_flag = "NORMAL_ENTRY"
+
+                    new_entry = self.writer.create_entry(
+                        roll=roll,
+                        id=entry_uuid,
+                        status="ENTERED",
+                        entry_flag=entry_flag,
+                        laptop=laptop,
+                        extra=extra or [],
+                        scanned_at=ts,
+                        # The ENTRY event's createdAt, which is what the backend stores (range reconcile compares them).
+                        created_at=override_created_at or ts,
+                        source=source,
+                        os=os_name,
+                        device_id=device_id,
+                        device_meta=device_meta,
+                    )
+
+                    events.append(OutboxEvent(
+                        event_type="ENTRY",
+                        payload={
+                            "eventId": None,
+                            "type": "ENTRY",
+                            "entryId": str(new_entry.id),
+                            "roll": roll,
+                            "scannedAt": ts.isoformat(),
+                            "createdAt": (override_created_at or ts).isoformat(),
+                            "status": new_entry.status,
+                            "entryFlag": new_entry.entry_flag,
+                            "laptop": new_entry.laptop,
+                            "extra": new_entry.extra or [],
+                            "deviceMeta": device_meta,
+                            "deviceId": device_id,
+                            "source": source,
+                            "os": os_name,
+                        },
+                    ))
+                    self.writer.add_events(events)
+                    self._index_on_commit("record_entry", new_entry)
+
+                    flag = new_entry.entry_flag
+                    notes.append(
+                        f"scanned successfully: {new_entry.status} {new_entry.entry_flag} at {new_entry.scanned_at}"
+                    )
+                else:
+                    # DUPLICATE_SCAN: same token scanned multiple times at entry (only first scan processed)
+                    if existing_entry.status == "ENTERED":
+                        flag = "DUPLICATE_SCAN"
+                        notes.append("scanned successfully: DUPLICATE_SCAN")
+                    else:
+                        notes.append(f"unexpected state for entryId={existing_entry.id}: {existing_entry.status}, ignoring")
+
+        return {
+            "decision": "ALLOW",
+            "mode": "entry",
+            "roll": roll,
+            "action": payload.get("action"),
+            "laptop": laptop,
+            "extra": extra,
+            "id": entry_id,
+            "flag": flag,
+            "exp": payload.get("exp"),
+            "deviceMeta": device_meta,
+            "notes": notes,
+        }
+
+    def handle_exit(self, payload, is_expired, ctx):
+        """
+        Handle exit scan with 5-flag model:
+        - NORMAL_EXIT: standard exit with matching entry
+        - EMERGENCY_EXIT: exit via emergency token (type=emergency)
+        - ORPHAN_EXIT: no matching entry found
+        - DUPLICATE_EXIT: exit already recorded for this entry
+        - AUTO_EXIT: (created by midnight job, not by scan)
+
+        All reads/writes for one scan run in a single transaction (see SCAN_QUERY_BUDGET).
+        """
+        # Test mode context
+        test_mode = ctx.get("test_mode", False)
+        override_scanned_at = ctx.get("override_scanned_at")
+        override_created_at = ctx.get("override_created_at")
+
+        ts = override_scanned_at or timezone.now()
+        roll = payload.get("roll")
+        entry_id_from_token = payload.get("entryId")
+        entry_uuid = _parse_entry_id(entry_id_from_token)
+        token_type = payload.get("type")  # 'emergency' for emergency tokens, None/missing for entry tokens
+        laptop = payload.get("laptop")
+        extra = payload.get("extra") or []
+        device_ctx = extract_device_context(payload, is_expired=is_expired, gate_device_id=ctx.get("gate_device_id"))
+        device_meta = dict(device_ctx["device_meta"] or {})
+        source = device_ctx["source"]
+        os_name = device_ctx["os"]
+        device_id = device_ctx["device_id"]
+
+        # In test mode, override source to TEST
+        if test_mode:
+            source = "TEST"
+            device_meta["testMode"] = True
+
+        with self.writer.atomic():
+            # Determine entry reference (+ whether it already has an exit) in one lookup.
+            # Emergency tokens without a known entry fall back to the most recent open entry for the roll.
+            entry_obj, open_entries = self._lookup_entries(
+                entry_uuid, roll, payload, include_open=token_type == "emergency"
+            )
+            if not entry_obj and open_entries:
+                entry_obj = open_entries[0]
+
+            # Duplicate check: if entry exists and already has an exit log
+            if entry_obj and entry_obj.has_exit:
+                # DUPLICATE_EXIT: still ALLOW but log as duplicate
+                exit_log = self.writer.create_exit(
+                    roll=roll,
+                    entry_id=entry_obj,
+                    exit_flag="DUPLICATE_EXIT",
+                    laptop=laptop,
+                    extra=extra,
+                    device_meta=device_meta,
+                    source=source,
+                    os=os_name,
+                    device_id=device_id,
+                    scanned_at=ts,
+                    created_at=override_created_at or timezone.now(),
+                )
+                self.writer.add_events([self._exit_event(exit_log, roll)])
+                return self._exit_result(payload, roll, laptop, extra, exit_log, "DUPLICATE_EXIT", notes=[])
+
+            # Determine exit flag
+            if not entry_obj:
+                # ORPHAN_EXIT: no matching entry found
+                exit_flag = "ORPHAN_EXIT"
+                if entry_id_from_token:
+                    device_meta["claimedEntryId"] = str(entry_id_from_token)
+            elif token_type == "emergency":
+                exit_flag = "EMERGENCY_EXIT"
+            else:
+                exit_flag = "NORMAL_EXIT"
+
+            # Create ExitLog
+            exit_log = self.writer.create_exit(
+                roll=roll,
+                entry_id=entry_obj,
+                exit_flag=exit_flag,
+                laptop=laptop,
+                extra=extra,
+                device_meta=device_meta,
+                source=source,
+                os=os_name,
+                device_id=device_id,
+                scanned_at=ts,
+                created_at=override_created_at or timezone.now(),
+            )
+
+            events = []
+            # Update EntryLog status to EXITED (if we have a valid entry)
+            if entry_obj:
+                # ## [FIX]: Removed 'scanned_at=ts' from this update.
+                # 'scanned_at' on EntryLog refers to entry time. Overwriting it with exit time destroys data.
+                self.writer.mark_exited(entry_obj)
+                self._index_on_commit("mark_exited", entry_obj.id)
+
+                # Emit ENTRY_STATUS event to sync the status change to backend
+                events.append(entry_status_event(entry_obj.id, roll, "EXITED", ts))
+
+            # Emit EXIT outbox event
+            events.append(self._exit_event(exit_log, roll))
+            self.writer.add_events(events)
+
+        return self._exit_result(payload, roll, laptop, extra, exit_log, exit_flag, notes=["scanned successfully: EXITED"])
+
+    def _lookup_entries(self, entry_uuid, roll, payload, include_open):
+        """
+        Return (entry, open_entries) for a scan.
+
+        `entry` is the EntryLog for `entry_uuid` (or None) and `open_entries` the
+        roll's ENTERED rows, most recent first (only if `include_open`). Rows carry
+        a `has_exit` flag. Answered from the OpenEntryIndex when it is
+        authoritative for this token, otherwise with a single DB query.
+        """
+        if self.index is not None and self.index.can_answer(entry_uuid, payload.get("iat")):
+            self.index.hits += 1
+            entry = self.index.get(entry_uuid) if entry_uuid else None
+            open_entries = self.index.open_for_roll(roll) if include_open else []
+            return entry, [e for e in open_entries if e.id != entry_uuid]
+        if self.index is not None:
+            self.index.fallbacks += 1
+
+        # Write-behind mode: the DB must have caught up with earlier scans before it is read.
+        self.writer.wait_durable()
+        lookup = Q()
+        if entry_uuid:
+            lookup |= Q(id=entry_uuid)
+        if include_open:
+            lookup |= Q(roll_id=roll, status="ENTERED")
+        if not lookup:
+            return None, []
+
+        rows = list(
+            EntryLog.objects.filter(lookup)
+            .annotate(has_exit=Exists(ExitLog.objects.filter(entry_id=OuterRef("pk"))))
+            .order_by("-created_at")
+        )
+        entry = next((row for row in rows if row.id == entry_uuid), None)
+        open_entries = [
+            row for row in rows
+            if include_open and row.id != entry_uuid and row.roll_id == roll and row.status == "ENTERED"
+        ]
+        return entry, open_entries
+
+    def _index_on_commit(self, method, *args, **kwargs):
+        """Apply a write-through index update once the scan transaction commits."""
+        if self.index is not None:
+            self.writer.on_commit(lambda: getattr(self.index, method)(*args, **kwargs))
+
+    def _exit_result(self, payload, roll, laptop, extra, exit_log, exit_flag, notes):
+        return {
+            "decision": "ALLOW",
+            "mode": "exit",
+            "roll": roll,
+            "action": "EXITING",
+            "laptop": laptop,
+            "extra": extra,
+            "id": str(exit_log.id),
+            "flag": exit_flag,
+            "exp": payload.get("exp"),
+            "notes": notes,
+        }
+
+    def _exit_event(self, exit_log, roll):
+        """Build the EXIT outbox event for syncing to backend (caller inserts it)."""
+        created_at = exit_log.created_at or exit_log.scanned_at
+        return OutboxEvent(
+            event_type="EXIT",
+            payload={
+                "eventId": None,  # filled at send-time from OutboxEvent.event_id
+                "type": "EXIT",
+                "exitId": str(exit_log.id),
+                "entryId": str(exit_log.entry_id_id) if exit_log.entry_id_id else None,
+                "roll": roll,
+                "scannedAt": exit_log.scanned_at.isoformat() if exit_log.scanned_at else None,
+                "createdAt": created_at.isoformat() if created_at else None,
+                "exitFlag": exit_log.exit_flag,
+                "laptop": exit_log.laptop,
+                "extra": exit_log.extra or [],
+                "deviceMeta": exit_log.device_meta or {},
+                "deviceId": exit_log.device_id,
+                "source": exit_log.source,
+                "os": exit_log.os,
+            },
+        )
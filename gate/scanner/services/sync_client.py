@@ -0,0 +1,355 @@
+"""
+HTTP client for gate -> backend sync (sync_to_backend, repair_sync_full).
+
+Keeps one keep-alive connection to BACKEND_SYNC_URL open across batches, so a
+batch costs one round trip instead of TCP + TLS handshakes + the request, and
+compresses request bodies (SYNC_COMPRESSION: gzip, zstd on Python 3.14+, or
+none). The backend decompresses them in RequestDecompressionMiddleware.
+
+Every request's round trip is recorded; `last` describes the latest batch and
+`summary()` the whole run. Backpressure hints from the backend (`Retry-After`,
+`X-Sync-Batch-Size`) are kept in `last` and on SyncHTTPError.
+
+`post_event_stream` sends a whole backlog as one NDJSON request to the
+streaming endpoint (BACKEND_SYNC_URL + "/stream"). The body is spooled
+(compressed) to a temporary file first, so its Content-Length is known and
+memory stays bounded; it is then uploaded from a background thread while the
+backend's ack lines are read and handed to the caller as they arrive.
+
+`post_reconcile` asks the backend's reconcile endpoint (BACKEND_SYNC_URL with
+"/events" replaced by "/reconcile") for range hashes over the same connection,
+and `post_cursor` the "/cursor" endpoint for this gate's sequence cursor.
+Every request names the epoch of the gate's outbox seqs (X-Gate-Epoch).
+"""
+
+import gzip
+import http.client
+import json
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from scanner.services.outbox_seq import current_epoch
+from scanner.services.scan_metrics import LatencyHistogram
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    zstd = None
+
+
+COMPRESSIONS = ("gzip", "zstd", "none")
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+STREAM_SPOOL_BYTES = 4 * 1024 * 1024  # stream bodies larger than this are spooled to disk
+STREAM_UPLOAD_CHUNK = 64 * 1024
+
+# The backend may close an idle keep-alive connection at any time; the next
+# request on it then fails before a response. Sync is idempotent, so resend once.
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+def sync_client_from_settings(epoch=None) -> "SyncClient":
+    """
+    SyncClient for BACKEND_SYNC_URL / GATE_API_KEY; raises ValueError on a bad
+    configuration. Pass `epoch` to skip reading it from the database (worker threads).
+    """
+    return SyncClient(
+        getattr(settings, "BACKEND_SYNC_URL", ""),
+        getattr(settings, "GATE_API_KEY", ""),
+        timeout_s=int(getattr(settings, "SYNC_TIMEOUT_SECONDS", 10)),
+        compression=getattr(settings, "SYNC_COMPRESSION", "gzip"),
+        min_compress_bytes=int(getattr(settings, "SYNC_COMPRESS_MIN_BYTES", 1024)),
+        epoch=epoch if epoch is not None else current_epoch(),
+    )
+
+
+def _header_number(value, cast=float):
+    try:
+        return cast(value) if value is not None else None
+    except ValueError:
+        return None  # e.g. an HTTP-date Retry-After; treated as no hint
+
+
+class SyncHTTPError(Exception):
+    """Non-2xx response from the backend."""
+
+    def __init__(self, code: int, body: str, retry_after: float | None = None, suggested_batch_size: int | None = None):
+        super().__init__(f"HTTPError {code}: {body}")
+        self.code = code
+        self.body = body
+        self.retry_after = retry_after
+        self.suggested_batch_size = suggested_batch_size
+
+
+class SyncClient:
+    def __init__(
+        self,
+        url: str,
+        api_key: str,
+        timeout_s: int = 10,
+        compression: str = "gzip",
+        min_compress_bytes: int = 1024,
+        epoch=None,
+    ):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Invalid BACKEND_SYNC_URL: {url}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown SYNC_COMPRESSION '{compression}' (expected one of {', '.join(COMPRESSIONS)})")
+        if compression == "zstd" and zstd is None:
+            raise ValueError("SYNC_COMPRESSION=zstd needs Python 3.14+ (compression.zstd)")
+
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self.stream_path = (parts.path or "").rstrip("/") + "/stream" + (f"?{parts.query}" if parts.query else "")
+        base = (parts.path or "").rstrip("/")
+        base = base[: -len("/events")] if base.endswith("/events") else base
+        self.reconcile_path = base + "/reconcile" + (f"?{parts.query}" if parts.query else "")
+        self.cursor_path = base + "/cursor" + (f"?{parts.query}" if parts.query else "")
+        self.api_key = api_key
+        self.epoch = epoch
+        self.timeout_s = timeout_s
+        self.compression = compression
+        self.min_compress_bytes = min_compress_bytes
+        self._conn = None
+
+        self.rtt = LatencyHistogram()
+        self.requests = 0
+        self.connects = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self.received_bytes = 0
+        self.last = {}
+
+    def _connect(self):
+        conn_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        self.connects += 1
+        return conn_class(self.host, self.port, timeout=self.timeout_s)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _encode(self, raw: bytes) -> tuple[bytes, str | None]:
+        if self.compression == "none" or len(raw) < self.min_compress_bytes:
+            return raw, None
+        if self.compression == "zstd":
+            return zstd.compress(raw), "zstd"
+        return gzip.compress(raw, compresslevel=6), "gzip"
+
+    def _headers(self, content_type: str = "application/json") -> dict:
+        headers = {"Content-Type": content_type, "X-GATE-API-KEY": self.api_key}
+        if self.epoch is not None:
+            headers["X-Gate-Epoch"] = str(self.epoch)
+        return headers
+
+    def _request(self, body: bytes, headers: dict, path: str | None = None) -> tuple:
+        """POST `body` (to the sync path by default); returns (status, headers, body, whether the connection was reused)."""
+        while True:
+            reused = self._conn is not None
+            if not reused:
+                self._conn = self._connect()
+            try:
+                self._conn.request("POST", path or self.path, body=body, headers=headers)
+                resp = self._conn.getresponse()
+                data = resp.read()
+            except _STALE_CONNECTION_ERRORS:
+                self.close()
+                if reused:
+                    continue
+                raise
+            except Exception:
+                self.close()
+                raise
+            if resp.will_close:
+                self.close()
+            self.received_bytes += len(data)
+            return resp.status, resp.headers, data, reused
+
+    def post_events(self, events: list[dict]) -> dict:
+        """POST one batch to the sync endpoint and return the decoded JSON response."""
+        raw = json.dumps({"events": events}).encode("utf-8")
+        body, encoding = self._encode(raw)
+        headers = self._headers()
+        if encoding:
+            headers["Content-Encoding"] = encoding
+
+        started = time.perf_counter()
+        status, resp_headers, data, reused = self._request(body, headers)
+        rtt_s = time.perf_counter() - started
+        retry_after = _header_number(resp_headers.get("Retry-After"))
+        suggested = _header_number(resp_headers.get("X-Sync-Batch-Size"), int)
+
+        self.rtt.record(rtt_s)
+        self.requests += 1
+        self.raw_bytes += len(raw)
+        self.sent_bytes += len(body)
+        self.last = {
+            "rttMs": round(rtt_s * 1000, 1),
+            "rawBytes": len(raw),
+            "sentBytes": len(body),
+            "encoding": encoding or "identity",
+            "reused": reused,
+            "retryAfter": retry_after,
+            "suggestedBatchSize": suggested,
+        }
+
+        if not 200 <= status < 300:
+            raise SyncHTTPError(status, data.decode("utf-8", errors="replace"), retry_after, suggested)
+        return json.loads(data.decode("utf-8") or "{}")
+
+    def post_reconcile(self, query: dict) -> dict:
+        """POST one reconcile query (see backend apps.sync.services.reconcile) and return the decoded answer."""
+        return self._post_json(query, self.reconcile_path)
+
+    def post_cursor(self, head_seq: int | None) -> dict:
+        """Report this gate's newest seq and return its cursor (see backend apps.sync.services.gate_cursor)."""
+        return self._post_json({"epoch": str(self.epoch), "headSeq": head_seq}, self.cursor_path)
+
+    def _post_json(self, query: dict, path: str) -> dict:
+        raw = json.dumps(query).encode("utf-8")
+        body, encoding = self._encode(raw)
+        headers = self._headers()
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        status, resp_headers, data, _ = self._request(body, headers, path)
+        self.requests += 1
+        self.raw_bytes += len(raw)
+        self.sent_bytes += len(body)
+        if not 200 <= status < 300:
+            raise SyncHTTPError(
+                status, data.decode("utf-8", errors="replace"), _header_number(resp_headers.get("Retry-After"))
+            )
+        return json.loads(data.decode("utf-8") or "{}")
+
+    def _spool(self, lines) -> tuple:
+        """Write `lines` (compressed) to a temporary file; returns (file at offset 0, raw bytes, body bytes)."""
+        spool = tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_BYTES)
+        if self.compression == "gzip":
+            writer = gzip.GzipFile(fileobj=spool, mode="wb", compresslevel=6)
+        elif self.compression == "zstd":
+            writer = zstd.ZstdFile(spool, mode="wb")
+        else:
+            writer = spool
+        raw = 0
+        for line in lines:
+            writer.write(line)
+            raw += len(line)
+        if writer is not spool:
+            writer.close()  # flushes the compressor; the spool stays open
+        size = spool.tell()
+        spool.seek(0)
+        return spool, raw, size
+
+    def post_event_stream(self, lines, on_result) -> dict:
+        """
+        Send NDJSON event `lines` (bytes, newline-terminated) as one streaming request.
+
+        Calls `on_result(message)` with each {"ackedEventIds", "rejected"} line as the
+        backend commits it and returns the final {"done": true, ...} line. Raises
+        SyncHTTPError if the stream is refused, ConnectionError if it ends early
+        (the results already handed to `on_result` stand).
+        """
+        spool, raw, size = self._spool(lines)
+        headers = self._headers(NDJSON_CONTENT_TYPE)
+        headers["Content-Length"] = str(size)
+        if self.compression != "none":
+            headers["Content-Encoding"] = self.compression
+
+        # A connection of its own: the upload and the ack lines share it for the whole stream.
+        conn = self._connect()
+        upload_errors = []
+
+        def upload():
+            try:
+                while chunk := spool.read(STREAM_UPLOAD_CHUNK):
+                    conn.send(chunk)
+            except OSError as e:
+                upload_errors.append(e)  # the backend stopped reading (error response or disconnect)
+
+        started = time.perf_counter()
+        uploader = threading.Thread(target=upload, name="sync-stream-upload", daemon=True)
+        final = None
+        try:
+            conn.putrequest("POST", self.stream_path, skip_accept_encoding=True)
+            for name, value in headers.items():
+                conn.putheader(name, value)
+            conn.endheaders()
+            uploader.start()
+            resp = conn.getresponse()
+            if resp.status != 200:
+                data = resp.read()
+                raise SyncHTTPError(
+                    resp.status,
+                    data.decode("utf-8", errors="replace"),
+                    _header_number(resp.headers.get("Retry-After")),
+                    _header_number(resp.headers.get("X-Sync-Batch-Size"), int),
+                )
+            for line in resp:
+                if not line.strip():
+                    continue
+                message = json.loads(line)
+                if message.get("done"):
+                    final = message
+                    break
+                if "error" in message:
+                    raise ConnectionError(f"backend could not read the stream: {message['error']}")
+                on_result(message)
+        finally:
+            conn.close()  # also unblocks an upload the backend stopped reading
+            if uploader.ident is not None:
+                uploader.join()
+            spool.close()
+            self.requests += 1
+            self.raw_bytes += raw
+            self.sent_bytes += size
+            self.last = {
+                "rttMs": round((time.perf_counter() - started) * 1000, 1),
+                "rawBytes": raw,
+                "sentBytes": size,
+                "encoding": self.compression if self.compression != "none" else "identity",
+                "reused": False,
+                "retryAfter": None,
+                "suggestedBatchSize": None,
+            }
+        if final is None:
+            error = f" ({upload_errors[0]})" if upload_errors else ""
+            raise ConnectionError(f"sync stream ended before the backend confirmed it{error}")
+        return final
+
+    def describe_last(self) -> str:
+        """Round-trip details of the latest batch for the per-batch log line."""
+        last = self.last
+        if not last:
+            return ""
+        return (
+            f"rtt={last['rttMs']}ms sent={last['sentBytes'] / 1024:.1f}kB/{last['rawBytes'] / 1024:.1f}kB "
+            f"({last['encoding']}) conn={'reused' if last['reused'] else 'new'}"
+        )
+
+    def summary(self) -> str:
+        if not self.requests:
+            return "no requests"
+        ratio = self.sent_bytes / self.raw_bytes if self.raw_bytes else 1.0
+        rtt = ""
+        if self.rtt.count:  # batches only; a stream's duration is not a round trip
+            rtt = (
+                f"rtt p50={self.rtt.percentile(0.5) * 1000:.1f}ms p95={self.rtt.percentile(0.95) * 1000:.1f}ms "
+                f"max={self.rtt.max_us / 1000:.1f}ms "
+            )
+        return (
+            f"requests={self.requests} connections={self.connects} {rtt}"
+            f"sent={self.sent_bytes / 1024:.1f}kB of {self.raw_bytes / 1024:.1f}kB ({ratio:.0%})"
+        )
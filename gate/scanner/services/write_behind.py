@@ -0,0 +1,353 @@
+"""
+Write-behind scan persistence (scan_server --write-behind).
+
+By default a scan is answered only after its transaction commits, so every
+decision waits for a Postgres round trip + fsync. In write-behind mode:
+
+  1. the decision is made from the resident OpenEntryIndex (no DB reads)
+  2. the scan's writes (new entries, status changes, exits, outbox events) are
+     appended as one JSON line to a local journal file and fsync'ed
+  3. the turnstile gets ALLOW/DENY
+  4. a background JournalCommitter drains the journal into the gate DB, many
+     scans per transaction (group commit)
+
+Until a record is committed the journal is the only durable copy. The highest
+committed sequence number is kept next to it (`<journal>.committed`) and the
+journal is truncated once everything in it is committed. On startup every
+record after that number is replayed. Replaying a record twice is harmless:
+inserts skip existing primary keys and status updates are re-applied in
+journal order.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from django.db import InterfaceError, OperationalError, connection, transaction
+
+from shared.apps.entries.models import EntryLog, ExitLog
+from shared.apps.users.models import User
+from scanner.models import OutboxEvent
+from scanner.services.open_entry_index import OpenEntryIndex
+from scanner.services.scan_service import parse_iso_datetime
+
+
+def _plain(value):
+    """JSON-ready value: datetimes and UUIDs as strings, so live and replayed records look the same."""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _dump_row(obj) -> dict:
+    return {f.attname: _plain(f.value_from_object(obj)) for f in obj._meta.concrete_fields}
+
+
+def _load_row(model, data: dict):
+    fields = {f.attname: f for f in model._meta.concrete_fields}
+    return model(**{name: fields[name].to_python(value) for name, value in data.items()})
+
+
+def apply_records(records) -> None:
+    """Apply journal records to the DB in one transaction (idempotent, in record order)."""
+    rolls = set()
+    entries, exits, events = [], [], []
+    status = {}  # entry_id -> (status, scanned_at or None); last change wins
+    for record in records:
+        for kind, data in record["ops"]:
+            if kind == "entry":
+                entries.append(_load_row(EntryLog, data))
+                rolls.add(data["roll_id"])
+            elif kind == "exit":
+                exits.append(_load_row(ExitLog, data))
+                rolls.add(data["roll_id"])
+            elif kind == "event":
+                events.append(
+                    OutboxEvent(event_id=data["eventId"], event_type=data["type"], payload=data["payload"])
+                )
+            elif kind == "status":
+                entry_id = uuid.UUID(data["id"])
+                ts = parse_iso_datetime(data.get("scannedAt"))
+                previous = status.get(entry_id)
+                status[entry_id] = (data["status"], ts or (previous[1] if previous else None))
+
+    # One UPDATE per distinct (status, scanned_at); closing/expiring usually shares a timestamp.
+    updates = {}
+    for entry_id, key in status.items():
+        updates.setdefault(key, []).append(entry_id)
+
+    with transaction.atomic():
+        User.ensure(*rolls)
+        EntryLog.objects.bulk_create(entries, ignore_conflicts=True)
+        for (new_status, ts), entry_ids in updates.items():
+            fields = {"status": new_status}
+            if ts is not None:
+                fields["scanned_at"] = ts
+            EntryLog.objects.filter(id__in=entry_ids).update(**fields)
+        ExitLog.objects.bulk_create(exits, ignore_conflicts=True)
+        OutboxEvent.objects.bulk_create(events, ignore_conflicts=True)
+
+
+class ScanJournal:
+    """Append-only JSONL journal of scan writes: {"seq": n, "ops": [[kind, data], ...]} per line."""
+
+    def __init__(self, path, fsync: bool = True):
+        self.path = str(path)
+        self.committed_path = self.path + ".committed"
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        self.committed_seq = self._read_committed()
+        self._drop_torn_tail()
+        records = self._read_records()
+        self.seq = max([self.committed_seq] + [r["seq"] for r in records])
+        self._fh = open(self.path, "ab")
+
+    def _read_committed(self) -> int:
+        try:
+            with open(self.committed_path, encoding="utf-8") as fh:
+                return int(fh.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _drop_torn_tail(self) -> None:
+        """Cut a half-written last line (crash during append) so new records start on a fresh line."""
+        try:
+            with open(self.path, "rb+") as fh:
+                data = fh.read()
+                if data and not data.endswith(b"\n"):
+                    fh.truncate(data.rfind(b"\n") + 1)
+        except FileNotFoundError:
+            pass
+
+    def _read_records(self) -> list[dict]:
+        records = []
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return records
+
+    def uncommitted(self) -> list[dict]:
+        """Records appended after the last committed sequence number, in order."""
+        return [r for r in self._read_records() if r["seq"] > self.committed_seq]
+
+    def append(self, ops: list) -> dict:
+        """Durably append one scan's writes. Returns the record."""
+        with self._lock:
+            record = {"seq": self.seq + 1, "ops": ops}
+            self._fh.write(json.dumps(record).encode("utf-8") + b"\n")
+            self._fh.flush()
+            if self.fsync:
+                os.fsync(self._fh.fileno())
+            self.seq = record["seq"]
+        return record
+
+    def mark_committed(self, seq: int) -> None:
+        """Record that everything up to `seq` is in the DB; truncate the journal once it is all committed."""
+        with self._lock:
+            tmp_path = f"{self.committed_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                fh.write(str(seq))
+            os.replace(tmp_path, self.committed_path)
+            self.committed_seq = seq
+            if seq >= self.seq:
+                os.ftruncate(self._fh.fileno(), 0)
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+class JournalCommitter:
+    """
+    Moves journal records into the DB in groups.
+
+    `run_in_thread()` starts the background loop: it waits for records, gives
+    later scans up to `commit_ms` to join the group, then commits up to
+    `max_batch` records in one transaction. On a DB error the records stay
+    queued (and journaled) and the commit is retried.
+    """
+
+    RETRY_SECONDS = 1.0
+
+    def __init__(self, journal: ScanJournal, commit_ms: int = 20, max_batch: int = 500):
+        self.journal = journal
+        self.commit_s = commit_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.groups = 0
+        self.committed = 0
+        self.errors = 0
+        self.last_error = ""
+
+    def replay(self) -> int:
+        """Commit records left over from a previous run. Returns the number of replayed records."""
+        records = self.journal.uncommitted()
+        for i in range(0, len(records), self.max_batch):
+            group = records[i:i + self.max_batch]
+            apply_records(group)
+            self.journal.mark_committed(group[-1]["seq"])
+        return len(records)
+
+    def submit(self, record: dict) -> None:
+        with self._cond:
+            self._pending.append(record)
+            self._cond.notify_all()
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def commit_pending(self) -> int:
+        """Commit the next group of queued records. Returns the number committed."""
+        with self._cond:
+            group = list(self._pending)[:self.max_batch]
+        if not group:
+            return 0
+        apply_records(group)
+        self.journal.mark_committed(group[-1]["seq"])
+        with self._cond:
+            for _ in group:
+                self._pending.popleft()
+            self.groups += 1
+            self.committed += len(group)
+            self._cond.notify_all()
+        return len(group)
+
+    def wait_idle(self) -> None:
+        """Block until every submitted record is in the DB (before reading the DB directly)."""
+        if self._thread is None:
+            while self.commit_pending():
+                pass
+            return
+        with self._cond:
+            while self._pending and self._thread.is_alive():
+                self._cond.wait(timeout=0.5)
+
+    def run_in_thread(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="scan-journal-committer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background loop after it has committed what is queued."""
+        if self._thread is not None:
+            with self._cond:
+                self._stopping = True
+                self._cond.notify_all()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        try:
+            while True:
+                with self._cond:
+                    while not self._pending and not self._stopping:
+                        self._cond.wait()
+                    if not self._pending:
+                        return
+                    if not self._stopping and len(self._pending) < self.max_batch:
+                        # Group commit: let scans arriving in the next few ms share the transaction.
+                        self._cond.wait(timeout=self.commit_s)
+                try:
+                    self.commit_pending()
+                except (OperationalError, InterfaceError) as e:
+                    connection.close()
+                    self.errors += 1
+                    self.last_error = str(e)
+                    if self._stopping:
+                        return  # still journaled; replayed on the next start
+                    time.sleep(self.RETRY_SECONDS)
+        finally:
+            connection.close()
+
+
+class JournalScanWriter:
+    """
+    Scan writer for write-behind mode.
+
+    Collects the writes of one scan (`atomic()` block), journals them as one
+    record and hands the record to the committer. Decisions come from `index`,
+    which is updated as soon as the record is journaled.
+    """
+
+    def __init__(self, index: OpenEntryIndex, journal: ScanJournal, committer: JournalCommitter):
+        self.index = index
+        self.journal = journal
+        self.committer = committer
+        self._ops = None
+        self._callbacks = []
+
+    @contextmanager
+    def atomic(self):
+        if self._ops is not None:
+            yield
+            return
+        self._ops, self._callbacks = [], []
+        try:
+            yield
+            ops, callbacks = self._ops, self._callbacks
+        finally:
+            self._ops, self._callbacks = None, []
+        if ops:
+            self.committer.submit(self.journal.append(ops))
+        for func in callbacks:
+            func()
+
+    def on_commit(self, func):
+        if self._ops is None:
+            func()
+        else:
+            self._callbacks.append(func)
+
+    def wait_durable(self):
+        self.committer.wait_idle()
+
+    def _status(self, entry_id, status, ts=None):
+        self._ops.append(["status", {"id": _plain(entry_id), "status": status, "scannedAt": _plain(ts)}])
+
+    def expire_entry(self, entry_id, ts) -> bool:
+        if self.index.get(entry_id) is None:
+            # Not indexed (older than the window): ask the DB once earlier scans are in it.
+            self.wait_durable()
+            if not EntryLog.objects.filter(id=entry_id).exists():
+                return False
+        self._status(entry_id, "EXPIRED", ts)
+        return True
+
+    def close_entries(self, entries, ts):
+        for entry in entries:
+            self._status(entry.id, "EXPIRED", ts)
+
+    def mark_exited(self, entry):
+        self._status(entry.id, "EXITED")
+
+    def create_entry(self, roll, **fields):
+        entry = EntryLog(roll_id=roll, **fields)
+        self._ops.append(["entry", _dump_row(entry)])
+        return entry
+
+    def create_exit(self, roll, **fields):
+        exit_log = ExitLog(roll_id=roll, **fields)
+        self._ops.append(["exit", _dump_row(exit_log)])
+        return exit_log
+
+    def add_events(self, events):
+        for event in events:
+            self._ops.append(
+                ["event", {"eventId": _plain(event.event_id), "type": event.event_type, "payload": event.payload}]
+            )
@@ -0,0 +1,1201 @@
+import gzip
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from unittest import skipIf, skipUnless
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from scanner.management.commands.scan_server import Command as ScanServerCommand, _ScanUnixServer
+from scanner.models import OutboxEvent, OutboxSequence
+from scanner.services.batch_ingest import BatchIngest
+from scanner.services.batch_sizer import BatchSizer
+from scanner.services.key_manager import MissingPublicKeyError, PublicKeyManager
+from scanner.services.open_entry_index import OpenEntryIndex
+from scanner.services.outbox_coalesce import coalesce_events
+from scanner.services.outbox_drain import OutboxDrainer
+from scanner.services.outbox_retention import OutboxArchive, outbox_size, purge_sent_events
+from scanner.services.outbox_seq import current_epoch, head_seq
+from scanner.services.reconcile import RangeReconciler
+from scanner.services.repair_replay import ParallelReplayer, RepairCheckpoint
+from scanner.services.scan_metrics import LatencyHistogram, ScanMetrics, ScanStatsStore, ScanTimer
+from scanner.services.scan_service import SCAN_QUERY_BUDGET, ScanDenied, ScanProcessor, decode_token
+from scanner.services.sync_client import SyncClient, SyncHTTPError
+from scanner.services.write_behind import JournalCommitter, JournalScanWriter, ScanJournal, apply_records
+from shared.apps.entries.models import EntryLog, ExitLog
+from shared.apps.entries.range_hash import bucket_hashes, row_digests
+from shared.apps.users.models import User
+
+
+def _make_keypair():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_pem = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    return private_key, public_pem
+
+
+def _count_data_queries(captured_queries):
+    """Count statements issued by a scan, ignoring transaction control (SAVEPOINT/RELEASE)."""
+    return len([
+        q for q in captured_queries
+        if not q["sql"].upper().startswith(("SAVEPOINT", "RELEASE SAVEPOINT"))
+    ])
+
+
+def _sign(private_key, **claims):
+    now = int(time.time())
+    payload = {
+        "iss": "library-backend",
+        "aud": "library-gate",
+        "iat": now,
+        "exp": now + 3600,
+        "roll": "24MA10001",
+    }
+    payload.update(claims)
+    return jwt.encode(payload, private_key, algorithm="RS256")
+
+
+class SignedTokenTestMixin:
+    """
+    setUp gives each test a temporary directory (`tmp_path`) holding a fresh
+    `public.pem` (`key_path`), its `private_key` for `_sign`, and a `key_manager`.
+    """
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp_path = Path(tmp.name)
+        self.key_path = self.tmp_path / "public.pem"
+        self.private_key, public_pem = _make_keypair()
+        self.key_path.write_bytes(public_pem)
+        self.key_manager = PublicKeyManager(self.key_path)
+
+
+class KeyManagerTestCase(SimpleTestCase):
+    """Tests for PublicKeyManager caching / reload and single-pass token decoding."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.key_path = Path(self.tmp.name) / "public.pem"
+        self.private_key, public_pem = _make_keypair()
+        self.key_path.write_bytes(public_pem)
+
+    def test_key_is_parsed_once(self):
+        manager = PublicKeyManager(self.key_path)
+        self.assertIs(manager.get(), manager.get())
+
+    def test_key_reloads_when_file_changes(self):
+        manager = PublicKeyManager(self.key_path)
+        first = manager.get()
+
+        rotated_private, rotated_pem = _make_keypair()
+        self.key_path.write_bytes(rotated_pem)
+        stat = self.key_path.stat()
+        os.utime(self.key_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        second = manager.get()
+        self.assertIsNot(first, second)
+        payload, _ = decode_token(_sign(rotated_private), second)
+        self.assertEqual(payload["roll"], "24MA10001")
+
+    def test_missing_key(self):
+        with self.assertRaises(MissingPublicKeyError):
+            PublicKeyManager(Path(self.tmp.name) / "missing.pem").get()
+
+    def test_valid_and_expired_tokens_are_classified(self):
+        key = PublicKeyManager(self.key_path).get()
+        _, is_expired = decode_token(_sign(self.private_key), key)
+        self.assertFalse(is_expired)
+
+        past = int(time.time()) - 7200
+        payload, is_expired = decode_token(_sign(self.private_key, iat=past, exp=past + 60), key)
+        self.assertTrue(is_expired)
+        self.assertEqual(payload["roll"], "24MA10001")
+
+        _, is_expired = decode_token(_sign(self.private_key, iat=past, exp=past + 60), key, test_mode=True)
+        self.assertFalse(is_expired)
+
+    def test_bad_signature_is_denied(self):
+        other_private, _ = _make_keypair()
+        key = PublicKeyManager(self.key_path).get()
+        with self.assertRaises(ScanDenied):
+            decode_token(_sign(other_private), key)
+
+
+class ScanQueryBudgetTestCase(SignedTokenTestMixin, TestCase):
+    """Each scan must stay within SCAN_QUERY_BUDGET and keep the entry/exit state machine intact."""
+
+    def setUp(self):
+        super().setUp()
+        self.processor = ScanProcessor(self.key_manager)
+
+    def _scan(self, mode="entry", **claims):
+        token = _sign(self.private_key, **claims)
+        with CaptureQueriesContext(connection) as ctx:
+            result = self.processor.process(token, mode=mode)
+        return result, _count_data_queries(ctx.captured_queries)
+
+    def assertWithinBudget(self, flag, num_queries):
+        self.assertLessEqual(num_queries, SCAN_QUERY_BUDGET[flag], f"{flag} used {num_queries} queries")
+
+    def test_normal_forced_and_duplicate_entry(self):
+        first_id = str(uuid.uuid4())
+        result, n = self._scan(entryId=first_id)
+        self.assertEqual(result["flag"], "NORMAL_ENTRY")
+        self.assertWithinBudget("NORMAL_ENTRY", n)
+
+        result, n = self._scan(entryId=first_id)
+        self.assertEqual(result["flag"], "DUPLICATE_SCAN")
+        self.assertWithinBudget("DUPLICATE_SCAN", n)
+
+        result, n = self._scan(entryId=str(uuid.uuid4()))
+        self.assertEqual(result["flag"], "FORCED_ENTRY")
+        self.assertWithinBudget("FORCED_ENTRY", n)
+        self.assertEqual(EntryLog.objects.get(id=first_id).status, "EXPIRED")
+        self.assertEqual(OutboxEvent.objects.filter(event_type="ENTRY").count(), 2)
+        status_event = OutboxEvent.objects.get(event_type="ENTRY_STATUS")
+        self.assertEqual(status_event.payload["entryId"], first_id)
+        self.assertEqual(status_event.payload["status"], "EXPIRED")
+
+    def test_created_at_is_set_at_insert(self):
+        created_at = datetime(2026, 1, 10, 9, 0, tzinfo=dt_timezone.utc)
+        entry_id = str(uuid.uuid4())
+        token = _sign(self.private_key, entryId=entry_id, createdAt=created_at.isoformat())
+        self.processor.process(token, mode="entry", test_mode=True)
+        self.assertEqual(EntryLog.objects.get(id=entry_id).created_at, created_at)
+
+    def test_normal_duplicate_and_orphan_exit(self):
+        entry_id = str(uuid.uuid4())
+        self._scan(entryId=entry_id)
+
+        result, n = self._scan(mode="exit", entryId=entry_id)
+        self.assertEqual(result["flag"], "NORMAL_EXIT")
+        self.assertWithinBudget("NORMAL_EXIT", n)
+        self.assertEqual(EntryLog.objects.get(id=entry_id).status, "EXITED")
+
+        result, n = self._scan(mode="exit", entryId=entry_id)
+        self.assertEqual(result["flag"], "DUPLICATE_EXIT")
+        self.assertWithinBudget("DUPLICATE_EXIT", n)
+
+        result, n = self._scan(mode="exit", entryId=str(uuid.uuid4()))
+        self.assertEqual(result["flag"], "ORPHAN_EXIT")
+        self.assertWithinBudget("ORPHAN_EXIT", n)
+        self.assertEqual(ExitLog.objects.count(), 3)
+
+    def test_emergency_exit_uses_open_entry(self):
+        entry_id = str(uuid.uuid4())
+        self._scan(entryId=entry_id)
+
+        result, n = self._scan(mode="exit", type="emergency")
+        self.assertEqual(result["flag"], "EMERGENCY_EXIT")
+        self.assertWithinBudget("EMERGENCY_EXIT", n)
+        self.assertEqual(str(ExitLog.objects.get().entry_id_id), entry_id)
+
+    def test_lane_id_is_stored_as_gate_device_id(self):
+        entry_id = str(uuid.uuid4())
+        self.processor.process(_sign(self.private_key, entryId=entry_id), gate_device_id="gate1-lane2")
+        self.assertEqual(EntryLog.objects.get(id=entry_id).device_meta["gateDeviceId"], "gate1-lane2")
+        self.assertEqual(OutboxEvent.objects.get().payload["deviceMeta"]["gateDeviceId"], "gate1-lane2")
+
+    def test_expired_entry_is_denied(self):
+        entry_id = str(uuid.uuid4())
+        self._scan(entryId=entry_id)
+
+        past = int(time.time()) - 7200
+        token = _sign(self.private_key, entryId=entry_id, iat=past, exp=past + 60)
+        with CaptureQueriesContext(connection) as ctx:
+            with self.assertRaises(ScanDenied):
+                self.processor.process(token, mode="entry")
+        self.assertWithinBudget("EXPIRED", _count_data_queries(ctx.captured_queries))
+        self.assertEqual(EntryLog.objects.get(id=entry_id).status, "EXPIRED")
+
+
+class OpenEntryIndexTestCase(SignedTokenTestMixin, TestCase):
+    """With a warm OpenEntryIndex, scan decisions need no read queries."""
+
+    def setUp(self):
+        super().setUp()
+        self.index = OpenEntryIndex(window_hours=48)
+        self.index.warm()
+        self.processor = ScanProcessor(self.key_manager, index=self.index)
+
+    def _scan(self, mode="entry", **claims):
+        token = _sign(self.private_key, **claims)
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as ctx:
+                result = self.processor.process(token, mode=mode)
+        selects = [q for q in ctx.captured_queries if q["sql"].upper().startswith("SELECT")]
+        return result, len(selects)
+
+    def test_decisions_without_reads(self):
+        first_id = str(uuid.uuid4())
+        result, selects = self._scan(entryId=first_id)
+        self.assertEqual((result["flag"], selects), ("NORMAL_ENTRY", 0))
+
+        result, selects = self._scan(entryId=first_id)
+        self.assertEqual((result["flag"], selects), ("DUPLICATE_SCAN", 0))
+
+        second_id = str(uuid.uuid4())
+        result, selects = self._scan(entryId=second_id)
+        self.assertEqual((result["flag"], selects), ("FORCED_ENTRY", 0))
+
+        result, selects = self._scan(mode="exit", entryId=second_id)
+        self.assertEqual((result["flag"], selects), ("NORMAL_EXIT", 0))
+
+        result, selects = self._scan(mode="exit", entryId=second_id)
+        self.assertEqual((result["flag"], selects), ("DUPLICATE_EXIT", 0))
+
+        result, selects = self._scan(mode="exit", entryId=str(uuid.uuid4()))
+        self.assertEqual((result["flag"], selects), ("ORPHAN_EXIT", 0))
+
+        self.assertEqual(self.index.verify(), [])
+
+    def test_old_tokens_fall_back_to_db(self):
+        old_iat = int(time.time()) - 72 * 3600
+        result, selects = self._scan(mode="exit", entryId=str(uuid.uuid4()), iat=old_iat)
+        self.assertEqual(result["flag"], "ORPHAN_EXIT")
+        self.assertEqual(selects, 1)
+        self.assertEqual(self.index.fallbacks, 1)
+
+    def test_verify_corrects_drift(self):
+        entry_id = str(uuid.uuid4())
+        self._scan(entryId=entry_id)
+        # Another writer (e.g. auto_exit_midnight) closes the entry behind the index's back.
+        EntryLog.objects.filter(id=entry_id).update(status="EXPIRED")
+
+        mismatches = self.index.verify()
+        self.assertEqual(len(mismatches), 1)
+        self.assertEqual(self.index.open_for_roll("24MA10001"), [])
+
+
+class BatchIngestTestCase(SignedTokenTestMixin, TestCase):
+    """process_token --batch: scans are applied in capture order and written in bulk."""
+
+    def _line(self, mode, scanned_at, **claims):
+        return json.dumps({
+            "token": _sign(self.private_key, **claims),
+            "mode": mode,
+            "scannedAt": scanned_at,
+        })
+
+    def _run(self, lines, chunk_size=1000):
+        return BatchIngest(key_path=self.key_path, workers=1, chunk_size=chunk_size).run(lines)
+
+    def test_scans_are_applied_in_capture_order(self):
+        first_id, second_id = str(uuid.uuid4()), str(uuid.uuid4())
+        lines = [
+            self._line("exit", "2026-01-10T12:00:00Z", entryId=second_id),
+            self._line("entry", "2026-01-10T09:00:00Z", entryId=first_id),
+            "not a token",
+            self._line("entry", "2026-01-10T10:00:00Z", entryId=second_id),
+            self._line("entry", "2026-01-10T10:05:00Z", entryId=second_id),
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            results = self._run(lines)
+
+        self.assertEqual([r["line"] for r in results], [1, 2, 3, 4, 5])
+        self.assertEqual(
+            [r.get("flag") or r["decision"] for r in results],
+            ["NORMAL_EXIT", "NORMAL_ENTRY", "DENY", "FORCED_ENTRY", "DUPLICATE_SCAN"],
+        )
+        self.assertEqual(EntryLog.objects.get(id=first_id).status, "EXPIRED")
+        self.assertEqual(EntryLog.objects.get(id=second_id).status, "EXITED")
+        self.assertEqual(ExitLog.objects.get().entry_id_id, uuid.UUID(second_id))
+        # NORMAL + FORCED snapshots, forced-close status, EXITED status + EXIT
+        self.assertEqual(OutboxEvent.objects.count(), 5)
+        # one lookup plus bulk writes, independent of the number of scans
+        self.assertLessEqual(_count_data_queries(ctx.captured_queries), 8)
+
+    def test_state_carries_across_chunks(self):
+        entry_id = str(uuid.uuid4())
+        lines = [
+            self._line("entry", "2026-01-10T09:00:00Z", entryId=entry_id),
+            self._line("exit", "2026-01-10T11:00:00Z", entryId=entry_id),
+            self._line("exit", "2026-01-10T11:01:00Z", entryId=entry_id),
+        ]
+        results = self._run(lines, chunk_size=1)
+        self.assertEqual(
+            [r["flag"] for r in results], ["NORMAL_ENTRY", "NORMAL_EXIT", "DUPLICATE_EXIT"]
+        )
+
+    def test_expiry_is_judged_at_scan_time(self):
+        exp = int(datetime(2026, 1, 10, 10, 0, tzinfo=dt_timezone.utc).timestamp())
+        entry_id = str(uuid.uuid4())
+        results = self._run([
+            self._line("entry", "2026-01-10T09:59:00Z", entryId=entry_id, iat=exp - 600, exp=exp),
+            self._line("entry", "2026-01-10T10:01:00Z", entryId=entry_id, iat=exp - 600, exp=exp),
+        ])
+        self.assertEqual(results[0]["flag"], "NORMAL_ENTRY")
+        self.assertEqual((results[1]["decision"], results[1]["reason"]), ("DENY", "DENY: token expired"))
+        self.assertEqual(EntryLog.objects.get(id=entry_id).status, "EXPIRED")
+
+
+class ScanMetricsTestCase(SimpleTestCase):
+    """Latency histograms keep percentiles accurate and survive merging through the stats file."""
+
+    def test_percentiles_are_within_bucket_precision(self):
+        hist = LatencyHistogram()
+        for ms in range(1, 1001):
+            hist.record(ms / 1000)
+        for q, expected in ((0.5, 0.5), (0.95, 0.95), (0.99, 0.99)):
+            self.assertAlmostEqual(hist.percentile(q), expected, delta=expected * 0.02)
+        self.assertEqual(hist.percentile(1.0), 1.0)
+
+    def test_store_merges_samples_from_many_processes(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        store = ScanStatsStore(Path(tmp.name) / "scan_stats.json")
+
+        for seconds, outcome in ((0.010, "NORMAL_ENTRY"), (0.020, "NORMAL_ENTRY"), (0.001, "DENY")):
+            timer = ScanTimer()
+            timer.add("jwt_decode", seconds)
+            timer.stages["total"] = seconds
+            metrics = ScanMetrics()
+            metrics.record(timer, outcome)
+            store.add(metrics)
+
+        rows = {(r["stage"], r["outcome"]): r for r in store.load().rows()}
+        self.assertEqual(rows[("total", "NORMAL_ENTRY")]["count"], 2)
+        self.assertEqual(rows[("jwt_decode", "DENY")]["count"], 1)
+        self.assertIn(
+            'gate_scan_stage_seconds_count{stage="total",outcome="NORMAL_ENTRY"} 2',
+            store.load().prometheus(),
+        )
+
+        store.reset()
+        self.assertFalse(store.load())
+
+
+class ScanTimingTestCase(SignedTokenTestMixin, TestCase):
+    """ScanProcessor splits a scan's time into decode / apply / DB query groups."""
+
+    def test_scan_records_stage_timings(self):
+        timer = ScanTimer()
+        ScanProcessor(self.key_manager).process(
+            _sign(self.private_key, entryId=str(uuid.uuid4())), mode="entry", timer=timer
+        )
+        timer.finish()
+        for stage in ("jwt_decode", "apply", "db_lookup", "db_write", "outbox_write", "total"):
+            self.assertIn(stage, timer.stages)
+        self.assertLessEqual(
+            timer.stages["db_lookup"] + timer.stages["db_write"] + timer.stages["outbox_write"],
+            timer.stages["apply"],
+        )
+
+
+class WriteBehindTestCase(SignedTokenTestMixin, TestCase):
+    """Write-behind scans are decided without DB access and reach the DB via the journal."""
+
+    def setUp(self):
+        super().setUp()
+        self.journal_path = self.tmp_path / "journal.jsonl"
+        self.journal = ScanJournal(self.journal_path, fsync=False)
+        self.addCleanup(self.journal.close)
+        self.committer = JournalCommitter(self.journal)
+        self.index = OpenEntryIndex()
+        self.index.warm()
+        writer = JournalScanWriter(self.index, self.journal, self.committer)
+        self.processor = ScanProcessor(self.key_manager, index=self.index, writer=writer)
+
+    def _scan(self, mode="entry", **claims):
+        return self.processor.process(_sign(self.private_key, **claims), mode=mode)
+
+    def test_scans_are_acknowledged_before_commit(self):
+        first_id, second_id = str(uuid.uuid4()), str(uuid.uuid4())
+        with CaptureQueriesContext(connection) as ctx:
+            flags = [
+                self._scan(entryId=first_id)["flag"],
+                self._scan(entryId=second_id)["flag"],
+                self._scan(mode="exit", entryId=second_id)["flag"],
+            ]
+        self.assertEqual(flags, ["NORMAL_ENTRY", "FORCED_ENTRY", "NORMAL_EXIT"])
+        self.assertEqual(ctx.captured_queries, [])
+        self.assertEqual(self.committer.pending(), 3)
+
+        # All three scans land in one transaction.
+        self.assertEqual(self.committer.commit_pending(), 3)
+        self.assertEqual(EntryLog.objects.get(id=first_id).status, "EXPIRED")
+        self.assertEqual(EntryLog.objects.get(id=second_id).status, "EXITED")
+        self.assertEqual(ExitLog.objects.get().entry_id_id, uuid.UUID(second_id))
+        self.assertEqual(OutboxEvent.objects.count(), 5)
+        self.assertEqual(self.index.verify(), [])
+        self.assertEqual(self.journal_path.read_bytes(), b"")
+
+    def test_uncommitted_scans_are_replayed_after_a_crash(self):
+        entry_id = str(uuid.uuid4())
+        self._scan(entryId=entry_id)
+        self._scan(mode="exit", entryId=entry_id)
+        with open(self.journal_path, "ab") as fh:
+            fh.write(b'{"seq": 3, "ops": [["sta')  # torn write at the moment of the crash
+        self.assertFalse(EntryLog.objects.exists())
+
+        restarted = JournalCommitter(ScanJournal(self.journal_path, fsync=False))
+        self.addCleanup(restarted.journal.close)
+        records = restarted.journal.uncommitted()
+        self.assertEqual(restarted.replay(), 2)
+        self.assertEqual(EntryLog.objects.get(id=entry_id).status, "EXITED")
+
+        # A crash between the DB commit and marking the journal replays the same records again.
+        apply_records(records)
+        self.assertEqual(EntryLog.objects.get(id=entry_id).status, "EXITED")
+        self.assertEqual((ExitLog.objects.count(), OutboxEvent.objects.count()), (1, 3))
+        self.assertEqual(restarted.journal.uncommitted(), [])
+
+
+class _FakeSyncHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        if self.path.endswith("/stream"):
+            return self._stream([json.loads(line) for line in body.splitlines()])
+        events = json.loads(body)["events"]
+        if hasattr(self.server, "received"):
+            self.server.received.extend(e["eventId"] for e in events)
+        status = 200 if self.headers.get("X-GATE-API-KEY") == "k" else 403
+        raw = json.dumps({"ackedEventIds": [e["eventId"] for e in events], "rejected": []}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _stream(self, events):
+        # Two events per ack line; the connection drops after `stream_cut_after` lines when set.
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        cut_after = getattr(self.server, "stream_cut_after", None)
+        for n, i in enumerate(range(0, len(events), 2)):
+            if n == cut_after:
+                return
+            acked = [e["eventId"] for e in events[i:i + 2]]
+            self.wfile.write(json.dumps({"ackedEventIds": acked, "rejected": []}).encode() + b"\n")
+            self.wfile.flush()
+        self.wfile.write(json.dumps({"done": True, "events": len(events)}).encode() + b"\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start_fake_backend(testcase, **attrs):
+    server = HTTPServer(("127.0.0.1", 0), _FakeSyncHandler)
+    server.connections = 0
+    for name, value in attrs.items():
+        setattr(server, name, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    testcase.addCleanup(server.server_close)
+    testcase.addCleanup(server.shutdown)
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/sync/gate/events"
+
+
+class ScanServerTestCase(SignedTokenTestMixin, TestCase):
+    """scan_server answers every request with JSON, and a stalled client doesn't block the others."""
+
+    def _command(self, processor):
+        command = ScanServerCommand(stdout=io.StringIO(), stderr=io.StringIO())
+        command.processor, command.index = processor, None
+        command.metrics, command.metrics_total = ScanMetrics(), ScanMetrics()
+        command.metrics_lock = threading.Lock()
+        return command
+
+    def test_errors_are_denied(self):
+        command = self._command(ScanProcessor(self.key_manager))
+
+        token = _sign(self.private_key, entryId=str(uuid.uuid4()), roll=None)
+        resp = command.dispatch(json.dumps({"token": token}).encode())
+        self.assertEqual(resp["decision"], "DENY")
+        self.assertIn("could not be recorded", resp["reason"])
+
+        class BadPayload:
+            def process(self, *args, **kwargs):
+                raise KeyError("roll")
+
+        resp = self._command(BadPayload()).dispatch(b'{"token": "x"}')
+        self.assertEqual(resp["decision"], "DENY")
+        self.assertIn("invalid token payload", resp["reason"])
+
+    def test_stalled_client_times_out(self):
+        path = str(self.tmp_path / "scan.sock")
+        server = _ScanUnixServer(path, lambda raw: {"decision": "DENY"}, lambda: None, request_timeout=0.2)
+        thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        stalled = socket.socket(socket.AF_UNIX)
+        stalled.connect(path)  # sends nothing
+        self.addCleanup(stalled.close)
+        with socket.socket(socket.AF_UNIX) as client:
+            client.settimeout(5)
+            client.connect(path)
+            client.sendall(b'{"token": "x"}\n')
+            self.assertEqual(json.loads(client.makefile().readline()), {"decision": "DENY"})
+
+    def test_workers_serve_lanes_concurrently(self):
+        path = str(self.tmp_path / "scan.sock")
+        server = _ScanUnixServer(path, lambda raw: {"decision": "DENY"}, lambda: None, request_timeout=5, workers=2)
+        thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        stalled = socket.socket(socket.AF_UNIX)
+        stalled.connect(path)  # holds one worker until the request timeout
+        self.addCleanup(stalled.close)
+        started = time.monotonic()
+        with socket.socket(socket.AF_UNIX) as client:
+            client.settimeout(5)
+            client.connect(path)
+            client.sendall(b'{"token": "x"}\n')
+            self.assertEqual(json.loads(client.makefile().readline()), {"decision": "DENY"})
+        self.assertLess(time.monotonic() - started, 2)
+
+
+class SyncClientTestCase(SimpleTestCase):
+    """SyncClient reuses one connection across batches and compresses large bodies."""
+
+    def setUp(self):
+        self.server, self.url = _start_fake_backend(self)
+
+    def test_batches_share_a_compressed_keep_alive_connection(self):
+        client = SyncClient(self.url, "k", min_compress_bytes=100)
+        self.addCleanup(client.close)
+        for _ in range(3):
+            events = [{"eventId": str(uuid.uuid4()), "type": "ENTRY", "roll": "24MA10001"} for _ in range(20)]
+            resp = client.post_events(events)
+            self.assertEqual(len(resp["ackedEventIds"]), 20)
+
+        self.assertEqual((client.requests, client.connects, self.server.connections), (3, 1, 1))
+        self.assertEqual(client.last["encoding"], "gzip")
+        self.assertTrue(client.last["reused"])
+        self.assertLess(client.sent_bytes, client.raw_bytes)
+
+    def test_error_status_raises(self):
+        client = SyncClient(self.url, "wrong")
+        self.addCleanup(client.close)
+        with self.assertRaises(SyncHTTPError) as ctx:
+            client.post_events([])
+        self.assertEqual(ctx.exception.code, 403)
+
+    def test_stream_hands_over_each_ack_line(self):
+        client = SyncClient(self.url, "k")
+        ids = [str(uuid.uuid4()) for _ in range(5)]
+        results = []
+        final = client.post_event_stream(
+            (json.dumps({"eventId": i, "type": "ENTRY"}).encode() + b"\n" for i in ids), results.append
+        )
+        self.assertEqual([r["ackedEventIds"] for r in results], [ids[0:2], ids[2:4], ids[4:]])
+        self.assertEqual(final["events"], 5)
+        self.assertLess(client.sent_bytes, client.raw_bytes)
+
+
+class _RecordingSyncClient:
+    """Stands in for SyncClient: acks everything and records what was sent, in order."""
+
+    def __init__(self, log, lock):
+        self.log, self.lock = log, lock
+        self.requests = 0
+        self.last = {}
+
+    def post_events(self, events):
+        time.sleep(0.01)  # a round trip, so partitions overlap
+        with self.lock:
+            self.log.append((id(self), [e["eventId"] for e in events]))
+        self.requests += 1
+        return {"ackedEventIds": [e["eventId"] for e in events], "rejected": []}
+
+    def describe_last(self):
+        return ""
+
+    def close(self):
+        pass
+
+
+class OutboxDrainTestCase(TransactionTestCase):
+    """Pipelined draining keeps each roll's events in order and runs partitions concurrently."""
+
+    def test_drain_preserves_per_roll_order(self):
+        base = datetime(2026, 1, 10, 9, 0, tzinfo=dt_timezone.utc)
+        by_roll = {}
+        for i in range(60):
+            roll = f"24MA1000{i % 6}"
+            event = OutboxEvent.objects.create(event_type="ENTRY", payload={"type": "ENTRY", "roll": roll})
+            OutboxEvent.objects.filter(pk=event.pk).update(created_at=base + timedelta(seconds=i))
+            by_roll.setdefault(roll, []).append(str(event.event_id))
+
+        log, lock = [], threading.Lock()
+        drainer = OutboxDrainer(lambda: _RecordingSyncClient(log, lock), batch_size=4, inflight=3)
+        drainer.drain(sleep_s=0, until_empty=True)
+
+        self.assertFalse(OutboxEvent.objects.filter(sent_at__isnull=True).exists())
+        sent = [event_id for _, ids in log for event_id in ids]
+        self.assertEqual(sorted(sent), sorted(i for ids in by_roll.values() for i in ids))
+        for roll, ids in by_roll.items():
+            self.assertEqual([i for i in sent if i in ids], ids, roll)
+        self.assertGreater(len({client for client, _ in log}), 1)
+
+    def test_failed_batch_holds_back_its_roll(self):
+        base = datetime(2026, 1, 10, 9, 0, tzinfo=dt_timezone.utc)
+        by_roll = {}
+        for i, roll in enumerate(["24MA10001"] * 12 + ["24MA10002"] * 4):
+            event = OutboxEvent.objects.create(event_type="ENTRY", payload={"type": "ENTRY", "roll": roll})
+            OutboxEvent.objects.filter(pk=event.pk).update(created_at=base + timedelta(seconds=i))
+            by_roll.setdefault(roll, []).append(str(event.event_id))
+        first = by_roll["24MA10001"][0]
+
+        log, lock, failed = [], threading.Lock(), []
+
+        class FirstBatchFails(_RecordingSyncClient):
+            def post_events(self, events):
+                if any(e["eventId"] == first for e in events) and not failed:
+                    failed.append(events)
+                    raise OSError("connection reset")
+                return super().post_events(events)
+
+        drainer = OutboxDrainer(lambda: FirstBatchFails(log, lock), batch_size=4, inflight=2)
+        drainer.drain(sleep_s=0, until_empty=True)
+
+        sent = [event_id for _, ids in log for event_id in ids]
+        # Nothing of the failed roll went out after its failed batch; the other roll still did.
+        self.assertFalse(set(sent) & set(by_roll["24MA10001"]))
+        self.assertEqual(sent, by_roll["24MA10002"])
+        self.assertEqual(OutboxEvent.objects.filter(sent_at__isnull=True).count(), 12)
+
+        # Once the retry is due the roll goes out in order.
+        OutboxEvent.objects.update(next_retry_at=None)
+        drainer._held.clear()
+        log.clear()
+        drainer.drain(sleep_s=0, until_empty=True)
+        self.assertEqual([i for _, ids in log for i in ids], by_roll["24MA10001"])
+
+
+class _FakeListener:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.timeouts = []
+        self.closed = False
+
+    def wait(self, timeout):
+        self.timeouts.append(timeout)
+        if self.fail:
+            raise OSError("connection lost")
+        return False
+
+    def close(self):
+        self.closed = True
+
+
+class OutboxListenTestCase(TestCase):
+    """An idle drainer waits on LISTEN no longer than until the next scheduled retry."""
+
+    def test_idle_wait_is_capped_by_next_retry(self):
+        event = OutboxEvent.objects.create(event_type="ENTRY", payload={"roll": "24MA10001"})
+        OutboxEvent.objects.filter(pk=event.pk).update(next_retry_at=datetime.now(dt_timezone.utc) + timedelta(seconds=10))
+
+        listener = _FakeListener()
+        OutboxDrainer(lambda: None)._wait_for_events(listener, fallback_s=60, sleep_s=0)
+        self.assertLessEqual(listener.timeouts[0], 10)
+
+        listener = _FakeListener()
+        OutboxEvent.objects.all().delete()
+        OutboxDrainer(lambda: None)._wait_for_events(listener, fallback_s=60, sleep_s=0)
+        self.assertEqual(listener.timeouts, [60])
+
+    def test_lost_listen_connection_falls_back_to_polling(self):
+        listener = _FakeListener(fail=True)
+        OutboxDrainer(lambda: None)._wait_for_events(listener, fallback_s=60, sleep_s=0)
+        self.assertTrue(listener.closed)
+
+
+class OutboxCoalesceTestCase(TestCase):
+    """Superseded events of one entry are sent as one snapshot; every folded id is still acked."""
+
+    def setUp(self):
+        self.t0 = datetime(2026, 1, 10, 9, 0, tzinfo=dt_timezone.utc)
+        self.entry_id = str(uuid.uuid4())
+
+    def _snapshot(self, ts, status="ENTERED"):
+        return {
+            "eventId": str(uuid.uuid4()), "type": "ENTRY", "entryId": self.entry_id, "roll": "24MA10001",
+            "scannedAt": ts.isoformat(), "createdAt": ts.isoformat(), "status": status, "laptop": "Dell",
+        }
+
+    def _status(self, status, ts):
+        return {
+            "eventId": str(uuid.uuid4()), "type": "ENTRY_STATUS", "entryId": self.entry_id, "roll": "24MA10001",
+            "status": status, "ts": ts.isoformat(),
+        }
+
+    def test_status_changes_fold_into_snapshot(self):
+        snapshot = self._snapshot(self.t0)
+        exit_event = {"eventId": str(uuid.uuid4()), "type": "EXIT", "exitId": str(uuid.uuid4()),
+                      "entryId": self.entry_id, "roll": "24MA10001"}
+        exited = self._status("EXITED", self.t0 + timedelta(hours=1))
+        other = self._status("EXPIRED", self.t0)
+        other["entryId"] = str(uuid.uuid4())  # no snapshot in the batch: sent as-is
+
+        events, folded = coalesce_events([snapshot, exit_event, exited, other])
+
+        self.assertEqual([e["eventId"] for e in events], [exited["eventId"], exit_event["eventId"], other["eventId"]])
+        self.assertEqual((events[0]["type"], events[0]["status"], events[0]["laptop"]), ("ENTRY", "EXITED", "Dell"))
+        self.assertEqual(events[0]["scannedAt"], snapshot["scannedAt"])  # EXITED keeps the entry time
+        self.assertEqual(folded, {exited["eventId"]: [snapshot["eventId"]]})
+
+    def test_merge_follows_latest_timestamp_wins(self):
+        snapshot = self._snapshot(self.t0 + timedelta(hours=2))
+        stale = self._status("EXPIRED", self.t0)
+        newer = self._snapshot(self.t0 + timedelta(hours=3), status="EXPIRED")
+        expired = self._status("EXPIRED", self.t0 + timedelta(hours=4))
+
+        events, folded = coalesce_events([snapshot, stale, newer, expired])
+
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]["eventId"], expired["eventId"])
+        self.assertEqual((events[0]["status"], events[0]["scannedAt"]), ("EXPIRED", expired["ts"]))
+        self.assertEqual(
+            sorted(folded[expired["eventId"]]), sorted([snapshot["eventId"], stale["eventId"], newer["eventId"]])
+        )
+
+    def test_invalid_status_event_is_not_folded(self):
+        events, folded = coalesce_events([self._snapshot(self.t0), self._status("BOGUS", self.t0)])
+        self.assertEqual((len(events), folded), (2, {}))
+
+    def test_drainer_acks_folded_events(self):
+        snapshot = self._snapshot(self.t0)
+        exited = self._status("EXITED", self.t0 + timedelta(hours=1))
+        for i, event in enumerate([snapshot, exited]):
+            row = OutboxEvent.objects.create(event_id=event["eventId"], event_type=event["type"], payload=event)
+            OutboxEvent.objects.filter(pk=row.pk).update(created_at=self.t0 + timedelta(seconds=i))
+
+        log = []
+        drainer = OutboxDrainer(lambda: _RecordingSyncClient(log, threading.Lock()), batch_size=10)
+        drainer.run_once()
+
+        self.assertEqual(log[0][1], [exited["eventId"]])
+        self.assertEqual(drainer.coalesced, 1)
+        self.assertFalse(OutboxEvent.objects.filter(sent_at__isnull=True).exists())
+
+
+class OutboxRetentionTestCase(TestCase):
+    """compact_outbox deletes only old sent rows, archives them first, and unsent rows stay indexed."""
+
+    def _event(self, sent_days_ago=None):
+        now = datetime.now(dt_timezone.utc)
+        sent_at = now - timedelta(days=sent_days_ago) if sent_days_ago is not None else None
+        return OutboxEvent.objects.create(event_type="ENTRY", payload={"roll": "24MA10001"}, sent_at=sent_at)
+
+    def test_purge_archives_old_sent_events_in_batches(self):
+        old = [self._event(sent_days_ago=10) for _ in range(5)]
+        recent = self._event(sent_days_ago=1)
+        unsent = self._event()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = OutboxArchive(tmp)
+            purged = purge_sent_events(datetime.now(dt_timezone.utc) - timedelta(days=7), batch_size=2, archive=archive)
+            archive.close()
+            with gzip.open(archive.path, "rt", encoding="utf-8") as fh:
+                archived = [json.loads(line) for line in fh]
+
+        self.assertEqual(purged, 5)
+        self.assertEqual(sorted(a["eventId"] for a in archived), sorted(str(e.event_id) for e in old))
+        self.assertEqual(
+            set(OutboxEvent.objects.values_list("event_id", flat=True)), {recent.event_id, unsent.event_id}
+        )
+        self.assertEqual((outbox_size()["rows"], outbox_size()["unsent"]), (2, 1))
+
+    def test_claim_query_uses_partial_index(self):
+        qs = OutboxEvent.objects.filter(sent_at__isnull=True).order_by("created_at")[:10]
+        self.assertIn("outbox_unsent_idx", qs.explain())
+
+
+class _RefusingSyncClient:
+    """Stands in for SyncClient: raises `error` for batches larger than `max_events`, acks the rest."""
+
+    def __init__(self, error, max_events=0):
+        self.error, self.max_events = error, max_events
+        self.batches = []
+        self.last = {}
+
+    def post_events(self, events):
+        self.batches.append(len(events))
+        if len(events) > self.max_events:
+            raise self.error
+        self.last = {"rttMs": 5.0}
+        return {"ackedEventIds": [e["eventId"] for e in events], "rejected": []}
+
+    def describe_last(self):
+        return ""
+
+    def close(self):
+        pass
+
+
+class AdaptiveBatchTestCase(TestCase):
+    """AIMD batch sizing and the drainer's handling of 413 / Retry-After."""
+
+    def test_sizer_grows_on_fast_full_batches_and_halves_once_per_overload(self):
+        sizer = BatchSizer(100, min_size=10, max_size=400, target_rtt_ms=1000, step=10)
+        sizer.on_success(100, 0.2, sent_at_size=100)
+        self.assertEqual(sizer.size, 110)
+        sizer.on_success(50, 0.2, sent_at_size=110)  # not full: no growth
+        self.assertEqual(sizer.size, 110)
+
+        sizer.on_success(110, 2.5, sent_at_size=110)  # slow
+        sizer.on_overload(sent_at_size=110)  # same overload, reported by another partition
+        self.assertEqual(sizer.size, 55)
+
+        sizer.on_success(55, 0.2, sent_at_size=55, suggested=30)  # backend hint caps the size
+        self.assertEqual(sizer.size, 30)
+        sizer.on_success(30, 0.2, sent_at_size=30)
+        self.assertEqual(sizer.size, 40)
+
+    def test_too_large_batch_is_split_and_resent(self):
+        events = [OutboxEvent.objects.create(event_type="ENTRY", payload={"roll": "24MA10001"}) for _ in range(10)]
+        client = _RefusingSyncClient(SyncHTTPError(413, "too many", suggested_batch_size=4), max_events=4)
+        drainer = OutboxDrainer(lambda: client, batch_size=10)
+
+        self.assertTrue(drainer.send(client, events))
+        self.assertEqual(client.batches, [10, 4, 4, 2])
+        self.assertEqual(drainer.batch_size, 4)
+        self.assertFalse(OutboxEvent.objects.filter(sent_at__isnull=True).exists())
+
+    def test_busy_backend_defers_without_counting_an_attempt(self):
+        events = [OutboxEvent.objects.create(event_type="ENTRY", payload={"roll": "24MA10001"}) for _ in range(3)]
+        client = _RefusingSyncClient(SyncHTTPError(503, "busy", retry_after=30))
+        drainer = OutboxDrainer(lambda: client, sizer=BatchSizer(100, min_size=10))
+
+        self.assertFalse(drainer.send(client, events))
+        self.assertEqual(drainer.batch_size, 50)
+        self.assertEqual(drainer.deferrals, 1)
+        row = OutboxEvent.objects.get(pk=events[0].pk)
+        self.assertEqual(row.attempt_count, 0)
+        self.assertGreater(row.next_retry_at, datetime.now(dt_timezone.utc) + timedelta(seconds=25))
+
+
+class OutboxStreamTestCase(TestCase):
+    """Streaming catch-up marks each acked micro-batch sent as it arrives."""
+
+    def _events(self, n):
+        return [
+            OutboxEvent.objects.create(event_type="ENTRY", payload={"roll": f"24MA1000{i}", "entryId": str(uuid.uuid4())})
+            for i in range(n)
+        ]
+
+    def test_stream_drains_the_outbox(self):
+        self._events(5)
+        _, url = _start_fake_backend(self)
+        drainer = OutboxDrainer(lambda: SyncClient(url, "k"), batch_size=2)
+
+        self.assertTrue(drainer.drain_stream(max_events=3))
+        self.assertFalse(OutboxEvent.objects.filter(sent_at__isnull=True).exists())
+        self.assertEqual(drainer.clients[0].requests, 2)
+
+    def test_broken_stream_keeps_acked_batches(self):
+        events = self._events(5)
+        _, url = _start_fake_backend(self, stream_cut_after=1)
+        drainer = OutboxDrainer(lambda: SyncClient(url, "k"), batch_size=10)
+
+        self.assertFalse(drainer.drain_stream(max_events=100))
+        sent = set(OutboxEvent.objects.filter(sent_at__isnull=False).values_list("event_id", flat=True))
+        self.assertEqual(sent, {events[0].event_id, events[1].event_id})
+        self.assertFalse(OutboxEvent.objects.filter(attempt_count__gt=0).exists())
+
+
+class RepairReplayTestCase(TestCase):
+    """repair_sync_full reads by (created_at, id), posts in parallel and resumes from its checkpoint."""
+
+    def setUp(self):
+        User.ensure("24MA10001")
+        t0 = datetime(2026, 1, 10, 9, 0, tzinfo=dt_timezone.utc)
+        # Several rows share a created_at: the id breaks the tie.
+        self.entries = [
+            EntryLog.objects.create(roll_id="24MA10001", status="ENTERED", created_at=t0 + timedelta(minutes=i // 3))
+            for i in range(25)
+        ]
+        self.entries.sort(key=lambda e: (e.created_at, str(e.id)))
+        self.server, self.url = _start_fake_backend(self, received=[])
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), "repair.json")
+
+    def test_parallel_replay_sends_every_row_once(self):
+        with override_settings(BACKEND_SYNC_URL=self.url, GATE_API_KEY="k"):
+            call_command("repair_sync_full", workers=3, batch_size=4, checkpoint=self.checkpoint, stdout=io.StringIO())
+        self.assertEqual(sorted(self.server.received), sorted(str(e.id) for e in self.entries))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume_continues_after_the_checkpointed_key(self):
+        done = self.entries[9]
+        RepairCheckpoint(self.checkpoint).save({
+            "filters": {"since": None, "until": None, "roll": None},
+            "phase": "entries",
+            "after": [done.created_at.isoformat(), str(done.id)],
+            "rows": {"entries": 10},
+        })
+        with override_settings(BACKEND_SYNC_URL=self.url, GATE_API_KEY="k"):
+            call_command("repair_sync_full", resume=True, batch_size=4, checkpoint=self.checkpoint, stdout=io.StringIO())
+        self.assertEqual(sorted(self.server.received), sorted(str(e.id) for e in self.entries[10:]))
+
+    def test_checkpoint_only_advances_over_acked_pages(self):
+        progress = []
+        replayer = ParallelReplayer(lambda: SyncClient(self.url, "k"), workers=4, batch_size=3)
+        replayer.replay(EntryLog.objects.all(), lambda e: {"eventId": str(e.id), "type": "ENTRY"}, "entries",
+                        on_progress=lambda key, rows: progress.append((key, rows)))
+        self.assertEqual([rows for _, rows in progress], sorted(rows for _, rows in progress))
+        self.assertEqual(progress[-1], ([self.entries[-1].created_at.isoformat(), str(self.entries[-1].id)], 25))
+
+
+class _Answered(Exception):
+    def __init__(self, resp):
+        self.resp = resp
+
+
+class _DivergedBackend:
+    """Answers reconcile queries from this database with `diverge()` applied in a rolled-back savepoint."""
+
+    def __init__(self, diverge):
+        self.diverge = diverge
+        self.queries = []
+
+    def post_reconcile(self, query):
+        self.queries.append(query)
+        ranges = [(datetime.fromisoformat(a), datetime.fromisoformat(b)) for a, b in query["ranges"]]
+        try:
+            with transaction.atomic():
+                self.diverge()
+                if query.get("rows"):
+                    raise _Answered({"rows": [row_digests(query["kind"], a, b, query["roll"]) for a, b in ranges]})
+                raise _Answered({
+                    "buckets": [bucket_hashes(query["kind"], a, b, query["buckets"], query["roll"]) for a, b in ranges]
+                })
+        except _Answered as answered:
+            return answered.resp
+
+
+class RangeReconcileTestCase(SignedTokenTestMixin, TestCase):
+    """reconcile_sync narrows differing created_at buckets down to exactly the rows that differ."""
+
+    def setUp(self):
+        super().setUp()
+        User.ensure("24MA10001")
+        self.t0 = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        self.entries = EntryLog.objects.bulk_create([
+            EntryLog(roll_id="24MA10001", status="EXITED", created_at=self.t0 + timedelta(hours=7 * i))
+            for i in range(100)
+        ])
+
+    def test_only_differing_rows_are_found(self):
+        missing, changed = self.entries[13], self.entries[71]
+        extra = uuid.uuid4()
+
+        def diverge():
+            EntryLog.objects.filter(id=missing.id).delete()
+            EntryLog.objects.filter(id=changed.id).update(status="ENTERED")
+            EntryLog.objects.create(id=extra, roll_id="24MA10001", created_at=self.t0 + timedelta(days=3))
+
+        backend = _DivergedBackend(diverge)
+        result = RangeReconciler(backend, "entries", fanout=4, leaf_rows=4).run(self.t0, self.t0 + timedelta(days=30))
+        self.assertEqual(sorted(result.stale), sorted([str(missing.id), str(changed.id)]))
+        self.assertEqual(result.backend_only, [str(extra)])
+        self.assertGreater(result.rounds, 2)
+        self.assertLess(result.buckets_compared, len(self.entries))
+
+    def test_matching_window_takes_one_round(self):
+        backend = _DivergedBackend(lambda: None)
+        result = RangeReconciler(backend, "entries", fanout=8).run(self.t0, self.t0 + timedelta(days=30))
+        self.assertEqual((result.stale, result.backend_only, result.rounds), ({}, [], 1))
+        self.assertEqual(len(backend.queries), 1)
+
+    def test_live_scan_matches_what_the_backend_stores(self):
+        entry_id = str(uuid.uuid4())
+        ScanProcessor(self.key_manager).process(_sign(self.private_key, entryId=entry_id), mode="entry")
+        payload = OutboxEvent.objects.get(event_type="ENTRY", payload__entryId=entry_id).payload
+        created_at = datetime.fromisoformat(payload["createdAt"])
+
+        def stored_by_backend():
+            EntryLog.objects.filter(id=entry_id).update(
+                created_at=created_at, scanned_at=datetime.fromisoformat(payload["scannedAt"])
+            )
+
+        # The window ends right after the event's createdAt, so a row stamped any later falls out of it.
+        backend = _DivergedBackend(stored_by_backend)
+        result = RangeReconciler(backend, "entries", fanout=8).run(
+            created_at - timedelta(seconds=1), created_at + timedelta(microseconds=1)
+        )
+        self.assertEqual((result.buckets_differing, result.stale, result.backend_only), (0, {}, []))
+
+
+class _HorizonSyncClient(_RecordingSyncClient):
+    """Acks everything and advertises a backend replay horizon."""
+
+    def __init__(self, log, lock, horizon):
+        super().__init__(log, lock)
+        self.horizon = horizon
+
+    def post_events(self, events):
+        resp = super().post_events(events)
+        resp["replayHorizon"] = self.horizon.isoformat()
+        return resp
+
+
+class ReplayHorizonTestCase(TestCase):
+    """Outbox events older than the replay horizon are expired, never sent."""
+
+    def _event(self, age):
+        event = OutboxEvent.objects.create(event_type="ENTRY", payload={"type": "ENTRY", "roll": "24MA10001"})
+        OutboxEvent.objects.filter(pk=event.pk).update(created_at=timezone.now() - age)
+        return str(event.event_id)
+
+    def test_events_past_the_horizon_are_expired(self):
+        old, fresh = self._event(timedelta(days=40)), self._event(timedelta(days=1))
+        log, lock = [], threading.Lock()
+        drainer = OutboxDrainer(lambda: _RecordingSyncClient(log, lock), replay_horizon=timedelta(days=28))
+        drainer.run_once()
+
+        self.assertEqual([ids for _, ids in log], [[fresh]])
+        expired = OutboxEvent.objects.get(event_id=old)
+        self.assertIsNotNone(expired.sent_at)
+        self.assertTrue(expired.last_error.startswith("expired:"))
+        self.assertEqual(drainer.expired, 1)
+
+    def test_backend_horizon_tightens_the_local_one(self):
+        self._event(timedelta(hours=1))
+        log, lock = [], threading.Lock()
+        backend_horizon = timezone.now() - timedelta(days=7)
+        drainer = OutboxDrainer(
+            lambda: _HorizonSyncClient(log, lock, backend_horizon), replay_horizon=timedelta(days=28)
+        )
+        drainer.run_once()
+        self.assertEqual(drainer.horizon(), backend_horizon + timedelta(hours=1))
+
+        middle = self._event(timedelta(days=10))  # inside the local 28 days, outside the backend's 7
+        drainer.run_once()
+        self.assertEqual(len(log), 1)
+        self.assertTrue(OutboxEvent.objects.get(event_id=middle).last_error.startswith("expired:"))
+
+
+class _CursorSyncClient(_RecordingSyncClient):
+    """Acks everything, keeps the events it was sent, and answers cursor requests with `cursor`."""
+
+    def __init__(self, cursor):
+        super().__init__([], threading.Lock())
+        self.cursor = cursor
+        self.events = []
+        self.reported = []
+
+    def post_events(self, events):
+        self.events.extend(events)
+        return super().post_events(events)
+
+    def post_cursor(self, head):
+        self.reported.append(head)
+        return self.cursor
+
+
+POSTGRES_ONLY = skipUnless(connection.vendor == "postgresql", "outbox seqs are assigned on Postgres only")
+
+
+class OutboxSeqTestCase(TestCase):
+    """Outbox rows are numbered per gate; the backend's cursor says which numbers it already has."""
+
+    def setUp(self):
+        self.epoch = str(current_epoch())
+        self.t0 = timezone.now() - timedelta(minutes=5)
+
+    def _rows(self, n, entry_id=None):
+        rows = []
+        for i in range(n):
+            payload = {"type": "ENTRY", "entryId": entry_id or str(uuid.uuid4()), "roll": "24MA10001",
+                       "scannedAt": (self.t0 + timedelta(seconds=i)).isoformat()}
+            row = OutboxEvent.objects.create(event_type="ENTRY", payload=payload)
+            OutboxEvent.objects.filter(pk=row.pk).update(created_at=self.t0 + timedelta(seconds=i))
+            rows.append(OutboxEvent.objects.get(pk=row.pk))
+        return rows
+
+    @POSTGRES_ONLY
+    def test_rows_are_numbered_in_insert_order_and_never_reused(self):
+        first = self._rows(2)
+        OutboxEvent.objects.bulk_create([OutboxEvent(event_type="ENTRY", payload={}) for _ in range(2)])
+        seqs = [row.seq for row in first] + sorted(OutboxEvent.objects.exclude(
+            pk__in=[row.pk for row in first]).values_list("seq", flat=True))
+        self.assertEqual(seqs, list(range(seqs[0], seqs[0] + 4)))
+
+        OutboxEvent.objects.all().delete()  # compact_outbox
+        self.assertEqual(self._rows(1)[0].seq, seqs[-1] + 1)
+        self.assertEqual(head_seq(), seqs[-1] + 1)
+        self.assertEqual(str(OutboxSequence.objects.get().epoch), self.epoch)
+
+    @POSTGRES_ONLY
+    def test_events_carry_their_seqs_and_folded_seqs(self):
+        entry_id = str(uuid.uuid4())
+        snapshot, newer = self._rows(2, entry_id=entry_id)
+        client = _CursorSyncClient(None)
+        OutboxDrainer(lambda: client, batch_size=10).run_once()
+
+        self.assertEqual(len(client.events), 1)
+        self.assertEqual((client.events[0]["seq"], client.events[0]["foldedSeqs"]), (newer.seq, [snapshot.seq]))
+
+    @POSTGRES_ONLY
+    def test_cursor_marks_rows_the_backend_has_sent(self):
+        rows = self._rows(5)
+        seqs = [row.seq for row in rows]
+        cursor = {"epoch": self.epoch, "floorSeq": seqs[0], "highWaterSeq": seqs[3], "gaps": [[seqs[1], seqs[1]]],
+                  "lastDurableSeq": seqs[0], "lagEvents": 1}
+        client = _CursorSyncClient(cursor)
+        drainer = OutboxDrainer(lambda: client, batch_size=10, report_cursor=True)
+        drainer.run_once()
+
+        self.assertEqual(client.reported, [seqs[4]])
+        self.assertEqual(drainer.already_durable, 3)
+        self.assertEqual([e["seq"] for e in client.events], [seqs[1], seqs[4]])
+
+        # A cursor of another epoch (the backend's view of an older database) changes nothing.
+        self._rows(1)
+        client.cursor = dict(cursor, epoch=str(uuid.uuid4()), highWaterSeq=seqs[4] + 1)
+        self.assertEqual(drainer.check_cursor()["highWaterSeq"], seqs[4] + 1)
+        self.assertEqual(drainer.already_durable, 3)
+
+    @skipIf(connection.vendor == "postgresql", "Postgres assigns seqs")
+    def test_without_seqs_events_are_synced_by_id(self):
+        rows = self._rows(2, entry_id=str(uuid.uuid4()))
+        self.assertEqual([row.seq for row in rows], [None, None])
+        self.assertIsNone(head_seq())
+
+        cursor = {"epoch": self.epoch, "floorSeq": 1, "highWaterSeq": 10, "gaps": [],
+                  "lastDurableSeq": 10, "lagEvents": 0}
+        client = _CursorSyncClient(cursor)
+        drainer = OutboxDrainer(lambda: client, batch_size=10, report_cursor=True)
+        drainer.run_once()
+
+        self.assertEqual(client.reported, [None])
+        self.assertEqual(drainer.already_durable, 0)
+        self.assertEqual(len(client.events), 1)
+        self.assertNotIn("seq", client.events[0])
+        self.assertNotIn("foldedSeqs", client.events[0])
+        self.assertFalse(OutboxEvent.objects.filter(sent_at__isnull=True).exists())
@@ -1,65 +1,410 @@
+import base64
 import cv2
+import hashlib
+import json
+import os
+import queue
+import socket
 import subprocess
+import threading
 import time
+from collections import OrderedDict, deque
 from pyzbar.pyzbar import decode
 
 # --- CONFIGURATION ---
-# The command or script to run when a QR is found
-COMMAND = ["/home/freak/rack/code_rack/tsg/pale-tsg-v2/scripts/qr_commands.sh"] 
-# How many seconds to wait before scanning again
-COOLDOWN_SECONDS = 2
+# The command or script to run when a QR is found (fallback when scan_server is not running)
+COMMAND = ["/home/freak/rack/code_rack/tsg/pale-tsg-v2/scripts/qr_commands.sh"]
+# Unix socket of the warm gate scan service (`python gate/manage.py scan_server`)
+SCAN_SOCKET = os.environ.get("SCAN_SOCKET_PATH", "/tmp/pale-gate-scan.sock")
+SCAN_TIMEOUT_SECONDS = 5
+# The same token is submitted once per window (the window restarts while it stays in view);
+# different tokens go through immediately
+DEDUPE_WINDOW_SECONDS = float(os.environ.get("QR_DEDUPE_WINDOW", "5"))
+# Distinct recent tokens remembered (least recently seen are evicted first)
+DEDUPE_MAX_TOKENS = int(os.environ.get("QR_DEDUPE_MAX_TOKENS", "256"))
+
+# Decode pipeline (tune for the gate box)
+# Threads running pyzbar (zbar and OpenCV release the GIL while they work)
+DECODE_WORKERS = int(os.environ.get("QR_DECODE_WORKERS", "2"))
+# Frames waiting for a decoder; when full the oldest frame is dropped
+FRAME_QUEUE_SIZE = int(os.environ.get("QR_FRAME_QUEUE_SIZE", "4"))
+# Downscale factor before decoding (e.g. 0.5 = half resolution); 1.0 keeps full size
+DECODE_SCALE = float(os.environ.get("QR_DECODE_SCALE", "1.0"))
+# Region of interest as fractions of the frame: "x,y,w,h" (e.g. "0.25,0.2,0.5,0.6"); empty = whole frame
+ROI = os.environ.get("QR_ROI", "")
+# Upper bound for adaptive frame skipping (only every Nth frame is queued when decode falls behind)
+MAX_FRAME_SKIP = int(os.environ.get("QR_MAX_FRAME_SKIP", "4"))
+# How often to print fps / decode latency
+STATS_INTERVAL_SECONDS = float(os.environ.get("QR_STATS_INTERVAL", "10"))
+# Show the camera window (set to 0 on a headless gate box)
+SHOW_PREVIEW = os.environ.get("QR_SHOW_PREVIEW", "1") != "0"
+# Multi-lane gates: JSON file listing one camera per lane (see scripts/lanes.example.json).
+# Without it a single camera (device 0) is watched.
+LANES_CONFIG = os.environ.get("QR_LANES_CONFIG", "")
 # ---------------------
 
-def start_watching():
-    # 0 usually refers to the default webcam
-    cap = cv2.VideoCapture(0)
-    
-    if not cap.isOpened():
-        print("Error: Could not open webcam.")
-        return
-
-    last_scan_time = 0
-    print(f"[*] Watching for QR codes... (Press 'q' to quit)")
-
-    while True:
-        ret, frame = cap.read()
+
+def submit_to_scan_server(qr_data, lane_id=None):
+    """
+    Send the QR payload ({"token", "mode"}) to the warm scan service, tagged
+    with the lane that read it. Returns the JSON decision, or None if the
+    service isn't running (the fallback command may then run the scan).
+    Once the request is out the service may have applied the scan, so a
+    timeout or a bad reply is an ERROR decision, never None.
+    """
+    if not os.path.exists(SCAN_SOCKET):
+        return None
+    try:
+        request = json.loads(qr_data)
+        if lane_id:
+            request["lane"] = lane_id
+        request = json.dumps(request).encode("utf-8") + b"\n"
+    except (ValueError, TypeError):
+        return None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(SCAN_TIMEOUT_SECONDS)
+        try:
+            sock.connect(SCAN_SOCKET)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        except OSError as e:
+            return {"decision": "ERROR", "reason": f"scan service unavailable ({e})"}
+        try:
+            sock.sendall(request)
+            line = sock.makefile("rb").readline()
+            return json.loads(line)
+        except (OSError, ValueError) as e:
+            return {"decision": "ERROR", "reason": f"no answer from scan service, not retried ({e})"}
+
+
+def dedupe_key(qr_data):
+    """
+    Identity of a scan for duplicate suppression: mode + entryId read from the
+    (unverified) token payload, or a hash of the raw QR data when there is none.
+    Verification still happens in scan_server / process_token.
+    """
+    try:
+        req = json.loads(qr_data)
+        segment = req["token"].split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4)))
+        if claims.get("entryId"):
+            return f"{req.get('mode') or 'entry'}:{claims['entryId']}"
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        pass
+    return hashlib.sha256(qr_data.encode("utf-8")).hexdigest()
+
+
+class RecentTokenCache:
+    """
+    LRU + TTL set of recently submitted scans; `seen()` is True for a repeat within the window.
+    Shared by all lanes, so one student showing the same QR at two lanes is only counted once.
+    """
+
+    def __init__(self, window_seconds=DEDUPE_WINDOW_SECONDS, max_tokens=DEDUPE_MAX_TOKENS):
+        self.window = window_seconds
+        self.max_tokens = max_tokens
+        self._last_seen = OrderedDict()  # key -> monotonic time last seen
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def seen(self, key, now=None):
+        with self._lock:
+            return self._seen(key, time.monotonic() if now is None else now)
+
+    def _seen(self, key, now):
+        last = self._last_seen.pop(key, None)
+        # Re-insert at the end (most recent) and restart the window: a QR held in view stays suppressed.
+        self._last_seen[key] = now
+        if last is not None and now - last <= self.window:
+            self.hits += 1
+            return True
+        self.misses += 1
+        while len(self._last_seen) > self.max_tokens:
+            self._last_seen.popitem(last=False)
+        return False
+
+
+def parse_roi(spec):
+    """Parse "x,y,w,h" (fractions of the frame) into a tuple, or None for the whole frame."""
+    if not spec.strip():
+        return None
+    try:
+        x, y, w, h = (float(v) for v in spec.split(","))
+    except ValueError:
+        raise SystemExit(f"Invalid QR_ROI '{spec}' (expected x,y,w,h as fractions, e.g. 0.25,0.2,0.5,0.6)")
+    if not (0 <= x < 1 and 0 <= y < 1 and 0 < w <= 1 - x and 0 < h <= 1 - y):
+        raise SystemExit(f"Invalid QR_ROI '{spec}' (region must lie inside the frame)")
+    return x, y, w, h
+
+
+def roi_box(frame, roi):
+    """Pixel box (x0, y0, x1, y1) of the ROI for this frame."""
+    height, width = frame.shape[:2]
+    if roi is None:
+        return 0, 0, width, height
+    x, y, w, h = roi
+    return int(x * width), int(y * height), int((x + w) * width), int((y + h) * height)
+
+
+def preprocess(frame, roi, scale=1.0):
+    """Crop to the ROI, convert to grayscale and downscale: the smaller image zbar has to scan."""
+    x0, y0, x1, y1 = roi_box(frame, roi)
+    gray = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+    if scale != 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+class PipelineStats:
+    """Counters shared by one lane's pipeline threads, reported every STATS_INTERVAL_SECONDS."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.captured = 0
+        self.decoded = 0
+        self.dropped = 0
+        self.frame_skip = 1
+        self.latencies = deque(maxlen=500)  # recent decode latencies (seconds)
+        self.window_started = time.monotonic()
+
+    def record_decode(self, seconds):
+        with self.lock:
+            self.decoded += 1
+            self.latencies.append(seconds)
+
+    def report(self, label):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.window_started, 1e-6)
+            latencies = sorted(self.latencies)
+            line = (
+                f"[stats {label}] capture {self.captured / elapsed:.1f} fps | decode {self.decoded / elapsed:.1f} fps"
+            )
+            if latencies:
+                p50 = latencies[len(latencies) // 2] * 1000
+                p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+                line += f" | decode latency p50 {p50:.1f}ms p95 {p95:.1f}ms"
+            line += f" | dropped {self.dropped} | skip 1/{self.frame_skip}"
+            self.captured = self.decoded = self.dropped = 0
+            self.latencies.clear()
+            self.window_started = time.monotonic()
+        print(line)
+
+
+class Lane:
+    """One camera with its own capture thread, frame queue and decode workers."""
+
+    def __init__(self, lane_id, device, roi=None, decode_scale=DECODE_SCALE, workers=DECODE_WORKERS):
+        self.id = lane_id          # sent to scan_server, stored as deviceMeta["gateDeviceId"]
+        self.device = device       # cv2.VideoCapture index or path/URL
+        self.roi = roi
+        self.decode_scale = decode_scale
+        self.workers = max(1, workers)
+        self.frames = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
+        self.latest = None         # last captured frame, for the preview
+        self.stats = PipelineStats()
+        self.cap = None
+        self.running = False
+
+    @property
+    def name(self):
+        return self.id or f"camera {self.device}"
+
+
+def load_lanes(path):
+    """
+    Read the lanes config:
+        {"lanes": [{"id": "lane-1", "device": 0, "roi": "0.25,0.2,0.5,0.6", "decodeScale": 0.5, "workers": 2}]}
+    Only "id" and "device" are required; the rest default to the QR_* settings.
+    """
+    try:
+        with open(path) as fh:
+            config = json.load(fh)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Cannot read lanes config {path}: {e}")
+
+    lanes = []
+    for item in config.get("lanes") or []:
+        if not item.get("id") or "device" not in item:
+            raise SystemExit(f"Invalid lane in {path}: {item} (needs 'id' and 'device')")
+        lanes.append(Lane(
+            str(item["id"]),
+            item["device"],
+            roi=parse_roi(item.get("roi") or ROI),
+            decode_scale=float(item.get("decodeScale", DECODE_SCALE)),
+            workers=int(item.get("workers", DECODE_WORKERS)),
+        ))
+    if not lanes:
+        raise SystemExit(f"No lanes defined in {path}")
+    if len({lane.id for lane in lanes}) != len(lanes):
+        raise SystemExit(f"Duplicate lane ids in {path}")
+    return lanes
+
+
+def capture_loop(lane, stop):
+    """
+    Read frames as fast as the camera delivers them. Every `frame_skip`-th frame
+    goes to the decode queue; the skip grows while frames are being dropped
+    (decoders behind) and shrinks again once the queue drains.
+    """
+    stats = lane.stats
+    frame_no = 0
+    recent_drops = 0
+    last_adjust = time.monotonic()
+    while not stop.is_set():
+        ret, frame = lane.cap.read()
         if not ret:
-            print("Failed to grab frame")
+            print(f"Failed to grab frame ({lane.name})")
+            lane.running = False
             break
+        lane.latest = frame
+        frame_no += 1
+        with stats.lock:
+            stats.captured += 1
+            skip = stats.frame_skip
 
-        # Only process if we are outside the cooldown period
-        current_time = time.time()
-        if current_time - last_scan_time > COOLDOWN_SECONDS:
-            
-            # Decode QR codes in the frame
-            decoded_objects = decode(frame)
-            
-            for obj in decoded_objects:
-                qr_data = obj.data.decode("utf-8")
-                # print(f"[!] QR Detected: {qr_data}")
-                
-                # --- EXECUTE THE COMMAND ---
-                # We pass the QR data as an argument to your script just in case you need it
+        if frame_no % skip == 0:
+            try:
+                lane.frames.put_nowait(frame)
+            except queue.Full:
+                # Keep the newest frame: a QR held up to the camera is in the latest frames.
                 try:
-                    subprocess.Popen(COMMAND + [qr_data])
-                    print(f"    -> Command executed.")
-                except Exception as e:
-                    print(f"    -> Error executing command: {e}")
-                
-                # Reset cooldown
-                last_scan_time = time.time()
-                # Break loop to avoid detecting the same code multiple times in one frame
-                break
-
-        # Display the camera feed (Optional - helpful for aiming)
-        cv2.imshow("QR Watcher (Press q to quit)", frame)
-
-        # Press 'q' to exit
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+                    lane.frames.get_nowait()
+                except queue.Empty:
+                    pass
+                lane.frames.put_nowait(frame)
+                recent_drops += 1
+                with stats.lock:
+                    stats.dropped += 1
+
+        now = time.monotonic()
+        if now - last_adjust >= 1.0:
+            with stats.lock:
+                if recent_drops:
+                    stats.frame_skip = min(MAX_FRAME_SKIP, stats.frame_skip + 1)
+                elif lane.frames.empty() and stats.frame_skip > 1:
+                    stats.frame_skip -= 1
+            recent_drops = 0
+            last_adjust = now
+
+
+def decode_loop(lane, results, stop):
+    """Decode worker: grayscale/ROI/downscale, then zbar. Found payloads go to `results` as (lane id, data)."""
+    while not stop.is_set():
+        try:
+            frame = lane.frames.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        started = time.monotonic()
+        decoded_objects = decode(preprocess(frame, lane.roi, lane.decode_scale))
+        lane.stats.record_decode(time.monotonic() - started)
+        # Only the first code per frame, as before
+        for obj in decoded_objects:
+            results.put((lane.id, obj.data.decode("utf-8")))
             break
 
-    cap.release()
-    cv2.destroyAllWindows()
+
+def submit_loop(results, dedupe, stop):
+    """Hand decoded payloads to the scan service (or the fallback command), outside the UI thread."""
+    while not stop.is_set():
+        try:
+            lane_id, qr_data = results.get(timeout=0.5)
+        except queue.Empty:
+            continue
+
+        # Skip repeats of a token submitted within the dedupe window (on any lane)
+        if dedupe.seen(dedupe_key(qr_data)):
+            continue
+        # print(f"[!] QR Detected: {qr_data}")
+        prefix = f"[{lane_id}] " if lane_id else ""
+
+        # --- SUBMIT TO THE WARM SCAN SERVICE ---
+        resp = submit_to_scan_server(qr_data, lane_id)
+        if resp is not None:
+            print(f"    -> {prefix}{resp.get('decision')} {resp.get('flag') or resp.get('reason') or ''} ({resp.get('elapsedMs')}ms)")
+        else:
+            # --- EXECUTE THE COMMAND ---
+            # We pass the QR data as an argument to your script just in case you need it
+            env = dict(os.environ, GATE_DEVICE_ID=lane_id) if lane_id else None
+            try:
+                subprocess.Popen(COMMAND + [qr_data], env=env)
+                print(f"    -> {prefix}Command executed.")
+            except Exception as e:
+                print(f"    -> {prefix}Error executing command: {e}")
+
+
+def start_watching():
+    if LANES_CONFIG:
+        lanes = load_lanes(LANES_CONFIG)
+    else:
+        # 0 usually refers to the default webcam
+        lanes = [Lane(None, 0, roi=parse_roi(ROI))]
+
+    for lane in lanes:
+        lane.cap = cv2.VideoCapture(lane.device)
+        if not lane.cap.isOpened():
+            print(f"Error: Could not open webcam ({lane.name}).")
+            for opened in lanes:
+                if opened.cap is not None:
+                    opened.cap.release()
+            return
+        lane.running = True
+
+    results = queue.Queue()
+    dedupe = RecentTokenCache()
+    stop = threading.Event()
+
+    threads = []
+    for lane in lanes:
+        threads.append(threading.Thread(target=capture_loop, args=(lane, stop), daemon=True))
+        threads += [
+            threading.Thread(target=decode_loop, args=(lane, results, stop), daemon=True)
+            for _ in range(lane.workers)
+        ]
+    # One submitter per lane so a slow response on one lane doesn't hold up the others
+    threads += [
+        threading.Thread(target=submit_loop, args=(results, dedupe, stop), daemon=True)
+        for _ in lanes
+    ]
+    for thread in threads:
+        thread.start()
+
+    print(f"[*] Watching for QR codes on {len(lanes)} lane(s)... (Press 'q' to quit)")
+
+    last_report = time.monotonic()
+    try:
+        while not stop.is_set() and any(lane.running for lane in lanes):
+            if SHOW_PREVIEW:
+                for lane in lanes:
+                    frame = lane.latest
+                    if frame is None:
+                        continue
+                    # Display the camera feed with the ROI outlined (helpful for aiming)
+                    if lane.roi is not None:
+                        frame = frame.copy()
+                        x0, y0, x1, y1 = roi_box(frame, lane.roi)
+                        cv2.rectangle(frame, (x0, y0), (x1, y1), (0, 255, 0), 2)
+                    cv2.imshow(f"QR Watcher - {lane.name} (Press q to quit)", frame)
+                # Press 'q' to exit
+                if cv2.waitKey(15) & 0xFF == ord('q'):
+                    break
+            else:
+                time.sleep(0.2)
+
+            if time.monotonic() - last_report >= STATS_INTERVAL_SECONDS:
+                for lane in lanes:
+                    lane.stats.report(lane.name)
+                print(f"[stats] dedupe hits {dedupe.hits} misses {dedupe.misses}")
+                last_report = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=2)
+        for lane in lanes:
+            lane.cap.release()
+        cv2.destroyAllWindows()
 
 if __name__ == "__main__":
     start_watching()
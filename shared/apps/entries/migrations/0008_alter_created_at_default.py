@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-17 01:29
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entries', '0007_entrylog_device_id_entrylog_device_meta_entrylog_os_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='entrylog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='exitlog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -1,6 +1,7 @@
 # shared/apps/entries/models.py
 import uuid
 from django.db import models
+from django.utils import timezone
 
 from shared.apps.users.models import User
 
@@ -27,7 +28,8 @@ class EntryLog(models.Model):
     extra = models.JSONField(default=list, blank=True)
     
     # Timestamps
-    created_at = models.DateTimeField(auto_now_add=True)
+    # default (not auto_now_add) so the gate/backend can set it in the INSERT itself
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     scanned_at = models.DateTimeField(null=True, blank=True)
     source = models.CharField(max_length=20, null=True, blank=True)   # GATE / WEB / APP
     os = models.CharField(max_length=20, null=True, blank=True)       # android / ios / linux
@@ -46,8 +48,8 @@ class EntryLog(models.Model):
     
     @classmethod
     def create_with_roll(cls, roll, **kwargs):
-        user, _ = User.objects.get_or_create(roll=roll)
-        return cls.objects.create(roll=user, **kwargs)
+        User.ensure(roll)
+        return cls.objects.create(roll_id=roll, **kwargs)
     
     def __str__(self):
         return f"{self.roll} | {self.id}"
@@ -77,7 +79,7 @@ class ExitLog(models.Model):
  
     
     # Timestamps
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     scanned_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
@@ -92,8 +94,8 @@ class ExitLog(models.Model):
         
     @classmethod
     def create_with_roll(cls, roll, **kwargs):
-        user, _ = User.objects.get_or_create(roll=roll)
-        return cls.objects.create(roll=user, **kwargs)
+        User.ensure(roll)
+        return cls.objects.create(roll_id=roll, **kwargs)
     
     
     def __str__(self):
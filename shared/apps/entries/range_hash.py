@@ -0,0 +1,69 @@
+"""
+Range hashes of EntryLog / ExitLog rows, computed the same way on the gate and
+the backend (reconcile_sync / POST /api/sync/gate/reconcile).
+
+A time range [start, end) of created_at is split into `parts` equal buckets.
+Each row contributes a 128-bit digest of (id, status, flag, scanned_at), and a
+bucket's hash is the XOR of its rows' digests, so it doesn't depend on row
+order and two sides agree exactly when they hold the same rows in the same
+state. Buckets whose (count, hash) differ are split again until they are
+small enough to compare row by row.
+"""
+
+import hashlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from shared.apps.entries.models import EntryLog, ExitLog
+
+
+KINDS = {  # kind -> (model, status field, flag field, flag the backend stores for a missing one)
+    "entries": (EntryLog, "status", "entry_flag", "NORMAL_ENTRY"),
+    "exits": (ExitLog, None, "exit_flag", "NORMAL_EXIT"),
+}
+
+_US = timedelta(microseconds=1)
+
+
+def row_digest(row_id, status, flag, scanned_at) -> int:
+    scanned = scanned_at.astimezone(dt_timezone.utc).isoformat() if scanned_at else ""
+    key = f"{row_id}|{status or ''}|{flag or ''}|{scanned}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=16).digest(), "big")
+
+
+def split_range(start: datetime, end: datetime, parts: int) -> list[tuple[datetime, datetime]]:
+    """`parts` consecutive sub-ranges of [start, end) with whole-microsecond bounds."""
+    total = (end - start) // _US
+    bounds = [start + _US * (total * i // parts) for i in range(parts)] + [end]
+    return list(zip(bounds, bounds[1:]))
+
+
+def _rows(kind: str, start: datetime, end: datetime, roll: str | None = None):
+    """(id, digest, created_at) of every row in [start, end)."""
+    model, status_field, flag_field, default_flag = KINDS[kind]
+    qs = model.objects.filter(created_at__gte=start, created_at__lt=end)
+    if roll:
+        qs = qs.filter(roll_id=roll)
+    fields = [f for f in ("id", status_field, flag_field, "scanned_at", "created_at") if f]
+    for row in qs.values_list(*fields).iterator(chunk_size=2000):
+        row_id, created_at = row[0], row[-1]
+        status, flag, scanned_at = row[1:-1] if status_field else ("", *row[1:-1])
+        yield str(row_id), row_digest(row_id, status, flag or default_flag, scanned_at), created_at
+
+
+def bucket_hashes(kind: str, start: datetime, end: datetime, parts: int, roll: str | None = None) -> list[dict]:
+    """[{"count", "hash"}] for each of the `parts` buckets of [start, end) (see split_range)."""
+    total = max(1, (end - start) // _US)
+    counts = [0] * parts
+    hashes = [0] * parts
+    for _, digest, created_at in _rows(kind, start, end, roll):
+        offset = (created_at - start) // _US
+        # The bucket whose split_range bounds contain offset.
+        i = -(-(offset + 1) * parts // total) - 1
+        counts[i] += 1
+        hashes[i] ^= digest
+    return [{"count": c, "hash": f"{h:032x}"} for c, h in zip(counts, hashes)]
+
+
+def row_digests(kind: str, start: datetime, end: datetime, roll: str | None = None) -> dict[str, str]:
+    """{id: digest} of every row in [start, end)."""
+    return {row_id: f"{digest:032x}" for row_id, digest, _ in _rows(kind, start, end, roll)}
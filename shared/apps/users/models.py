@@ -11,6 +11,11 @@ class User(models.Model):
             models.Index(fields=["roll"], name="users_roll_ba5404_idx"),
         ]
         
+    @classmethod
+    def ensure(cls, *rolls):
+        """Make sure users exist for the given rolls (one INSERT ... ON CONFLICT DO NOTHING)."""
+        cls.objects.bulk_create([cls(roll=roll) for roll in rolls], ignore_conflicts=True)
+
     def __str__(self):
         return f"{self.roll}"
 